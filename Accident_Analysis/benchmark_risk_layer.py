@@ -0,0 +1,194 @@
+"""
+Scaling benchmarks for the risk layer pipeline in rout_planning_hotspot.py, on synthetic
+accident points spread over a Calgary-sized extent (EPSG:32611).
+
+Usage:
+    python benchmark_risk_layer.py hotspots [--sizes 10000 50000 500000] [--check 5000]
+    python benchmark_risk_layer.py risk [--sizes ...] [--roads 100000] [--check 200]
+    python benchmark_risk_layer.py line [--sizes ...] [--roads 100000] [--check 200]
+    python benchmark_risk_layer.py parallel [--method centroid|line|line-rtree] [--workers 1 2 4 8] [--chunk-size 5000]
+"""
+import argparse
+import contextlib
+import io
+import os
+import time
+import tracemalloc
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from scipy.spatial.distance import cdist
+
+from rtree import index
+
+from rout_planning_hotspot import (calculate_line_risk_layer, calculate_risk_layer, calculate_risk_layer_parallel,
+                                   calculate_road_risk, calculate_road_risk_, count_neighbors_within,
+                                   perform_hotspot_analysis, road_line_risk)
+
+# Roughly the City of Calgary, in EPSG:32611 metres
+EXTENT = (690000.0, 5640000.0, 725000.0, 5680000.0)
+
+
+def synthetic_accidents(count, seed=0, clusters=300, spread=300.0, background=0.3):
+    """
+    Accident-like points: most fall in Gaussian clusters (intersections, corridors),
+    the rest uniformly over EXTENT. Returns an EPSG:32611 GeoDataFrame.
+    """
+    rng = np.random.default_rng(seed)
+    min_x, min_y, max_x, max_y = EXTENT
+    n_background = int(count * background)
+    centers = rng.uniform((min_x, min_y), (max_x, max_y), size=(clusters, 2))
+    clustered = centers[rng.integers(clusters, size=count - n_background)]
+    clustered += rng.normal(0.0, spread, size=clustered.shape)
+    uniform = rng.uniform((min_x, min_y), (max_x, max_y), size=(n_background, 2))
+    coords = np.vstack((clustered, uniform))
+    return gpd.GeoDataFrame(geometry=gpd.points_from_xy(coords[:, 0], coords[:, 1]), crs='epsg:32611')
+
+
+def synthetic_roads(count, seed=0, min_length=20.0, max_length=300.0):
+    """Straight road segments with random position, heading and length over EXTENT."""
+    rng = np.random.default_rng(seed)
+    min_x, min_y, max_x, max_y = EXTENT
+    start = rng.uniform((min_x, min_y), (max_x, max_y), size=(count, 2))
+    heading = rng.uniform(0, 2 * np.pi, size=count)
+    length = rng.uniform(min_length, max_length, size=count)
+    end = start + np.column_stack((np.cos(heading), np.sin(heading))) * length[:, None]
+    return gpd.GeoSeries(shapely.linestrings(np.stack((start, end), axis=1)), crs='epsg:32611')
+
+
+def measure(fn, *args, **kwargs):
+    """Run fn once; return (seconds, peak traced memory in bytes, result)."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def bench_hotspots(sizes, check, distance_threshold=200):
+    if check:
+        coords = np.array([(p.x, p.y) for p in synthetic_accidents(check, seed=1).geometry])
+        expected = (cdist(coords, coords) <= distance_threshold).sum(axis=1)
+        assert np.array_equal(count_neighbors_within(coords, distance_threshold), expected), \
+            "KD-tree neighbour counts differ from cdist"
+        print(f"Neighbour counts identical to cdist on {check} points")
+
+    print(f"{'points':>10} {'seconds':>10} {'peak MB':>10} {'cdist would need':>18} {'mean density':>14}")
+    for size in sizes:
+        gdf = synthetic_accidents(size)
+        elapsed, peak, result = measure(perform_hotspot_analysis, gdf, distance_threshold=distance_threshold,
+                                        p_value_threshold=0.30, z_score_threshold=-0.6)
+        # float64 distances + bool mask + int64 neighbourhood matrix
+        matrix_bytes = size * size * (8 + 1 + 8)
+        print(f"{size:>10} {elapsed:>10.2f} {peak / 1e6:>10.1f} {matrix_bytes / 1e9:>15.1f} GB "
+              f"{result['local_density'].mean():>14.1f}")
+
+
+def bench_risk(sizes, road_count, check, max_distance=200):
+    roads = synthetic_roads(road_count)
+    print(f"{road_count} road segments; per-road baseline timed on {check} of them")
+    print(f"{'accidents':>10} {'bulk s':>10} {'peak MB':>10} {'per-road ms':>12} {'per-road total':>15}")
+    for size in sizes:
+        accidents = synthetic_accidents(size)
+        elapsed, peak, scores = measure(calculate_risk_layer, roads, accidents, max_distance=max_distance, power=2)
+        line = f"{size:>10} {elapsed:>10.2f} {peak / 1e6:>10.1f}"
+        if check:
+            sample = roads.iloc[:check]
+            start = time.perf_counter()
+            expected = sample.apply(lambda geom: calculate_road_risk(geom, accidents, max_distance=max_distance,
+                                                                     power=2)).to_numpy()
+            per_road = (time.perf_counter() - start) / check
+            assert np.array_equal(expected, scores[:check]), "bulk risk scores differ from calculate_road_risk"
+            line += f" {per_road * 1000:>12.2f} {per_road * road_count / 60:>12.1f} min"
+        print(line)
+
+
+def bench_line(sizes, road_count, check, max_distance=200):
+    roads = synthetic_roads(road_count)
+    print(f"{road_count} road segments; per-road calculate_road_risk_ loop timed on {check} of them")
+    print(f"{'hot spots':>10} {'batch s':>10} {'peak MB':>10} {'per-road ms':>12} {'per-road total':>15}")
+    for size in sizes:
+        accidents = synthetic_accidents(size)
+        accidents['hotspot'] = 'Hot Spot'
+        elapsed, peak, (_, risk_raw) = measure(calculate_line_risk_layer, roads, accidents,
+                                               max_distance=max_distance, power=2)
+        line = f"{size:>10} {elapsed:>10.2f} {peak / 1e6:>10.1f}"
+        if check:
+            hotspot_geoms = list(accidents.geometry)
+            spatial_index = index.Index()
+            for i, geom in enumerate(hotspot_geoms):
+                spatial_index.insert(i, geom.bounds)
+            start = time.perf_counter()
+            expected = [road_line_risk(geom, hotspot_geoms, spatial_index, max_distance, 2) or 0.0
+                        for geom in roads.iloc[:check]]
+            per_road = (time.perf_counter() - start) / check
+            # calculate_road_risk_ takes candidates from the bounds of a polygonal buffer, which can
+            # miss a hot spot just inside max_distance near a segment end; count where that happened
+            differing = np.count_nonzero(~np.isclose(expected, risk_raw[:check], rtol=1e-9, atol=0))
+            line += f" {per_road * 1000:>12.2f} {per_road * road_count / 60:>12.1f} min" \
+                    f"  ({differing}/{check} differ)"
+        print(line)
+
+
+def bench_parallel(method, accident_count, road_count, worker_counts, chunk_size, max_distance=200):
+    accidents = perform_hotspot_analysis(synthetic_accidents(accident_count), distance_threshold=200,
+                                         p_value_threshold=0.30, z_score_threshold=-0.6)
+    roads = synthetic_roads(road_count)
+    print(f"{method} risk, {road_count} road segments, {accident_count} accidents, "
+          f"chunks of {chunk_size}; {os.cpu_count()} CPUs")
+
+    start = time.perf_counter()
+    if method == 'centroid':
+        serial = calculate_risk_layer(roads, accidents, max_distance=max_distance, power=2)
+    elif method == 'line':
+        serial, _ = calculate_line_risk_layer(roads, accidents, max_distance=max_distance, power=2)
+    else:
+        # calculate_road_risk_ prints a line for every segment without nearby hot spots
+        with contextlib.redirect_stdout(io.StringIO()):
+            serial = calculate_road_risk_(gpd.GeoDataFrame(geometry=roads), accidents,
+                                          max_distance=max_distance, power=2)['risk_score'].to_numpy()
+    serial_time = time.perf_counter() - start
+    print(f"{'serial':>10} {serial_time:>10.2f} s")
+
+    base = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        scores = calculate_risk_layer_parallel(roads, accidents, method=method, workers=workers,
+                                               chunk_size=chunk_size, max_distance=max_distance, power=2)
+        elapsed = time.perf_counter() - start
+        base = base or elapsed
+        assert np.array_equal(scores, serial, equal_nan=True), "parallel risk scores differ from the serial result"
+        print(f"{workers:>4} workers {elapsed:>9.2f} s  speedup {base / elapsed:5.2f}x vs 1 worker, "
+              f"{serial_time / elapsed:5.2f}x vs serial")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmark", choices=["hotspots", "risk", "line", "parallel"])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000, 500000],
+                        help="Numbers of synthetic accident points")
+    parser.add_argument("--roads", type=int, default=100000, help="Number of synthetic road segments")
+    parser.add_argument("--method", choices=["centroid", "line", "line-rtree"], default="centroid",
+                        help="Risk computation to parallelize")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="Worker counts to time")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Road segments per worker task")
+    parser.add_argument("--check", type=int, default=None,
+                        help="Points (hotspots, default 5000) or road segments (risk, default 200) "
+                             "to compare against the original implementation on; 0 to skip")
+    args = parser.parse_args()
+
+    if args.benchmark == "hotspots":
+        bench_hotspots(args.sizes, 5000 if args.check is None else args.check)
+    elif args.benchmark == "risk":
+        bench_risk(args.sizes, args.roads, 200 if args.check is None else args.check)
+    elif args.benchmark == "line":
+        bench_line(args.sizes, args.roads, 200 if args.check is None else args.check)
+    elif args.benchmark == "parallel":
+        bench_parallel(args.method, args.sizes[0], args.roads, args.workers, args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,8 @@ from shapely.geometry import LineString
 import numpy as np
 import pickle
 import networkx as nx
+import os
+import sys
 
 
 node_id_map = {}
@@ -37,7 +39,8 @@ def add_road_to_graph(row):
                            road_id=row.get('FID', None),
                            maxspeed=row.get('maxspeed', None),
                            oneway=row.get('oneway', None),
-                           geometry=row.geometry)
+                           geometry=row.geometry,
+                           geometry_4326=row['geometry_4326'])
             prev_node_id = current_node_id_local
 
 
@@ -45,6 +48,8 @@ def add_road_to_graph(row):
 routes_gdf = gpd.read_file(r'./Datasets/Subset/road_risk_layer_categorized.shp').set_crs("EPSG:32611")
 
 # routes_gdf = routes_gdf.to_crs("EPSG:4326")
+# Project every road to WGS84 once here, so the server never reprojects route geometries
+routes_gdf['geometry_4326'] = routes_gdf.geometry.to_crs("EPSG:4326")
 
 # Step 2: Build a directed graph from the shapefile
 G = nx.DiGraph()
@@ -54,3 +59,8 @@ routes_gdf.apply(add_road_to_graph, axis=1)
 # Save the road network graph to pickle format
 with open("./Datasets/Subset/road_network.pkl", "wb") as f:
     pickle.dump(G, f)
+
+# Step 3: Write the memory-mapped graph artifact loaded by server.py (see graph_artifact.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from graph_artifact import write_graph_artifact
+write_graph_artifact(G, "./Datasets/Subset/road_network_graph")
@@ -0,0 +1,308 @@
+"""
+Incremental update of the hotspot layer, the road risk layer and the routing graph when a
+batch of new accident records arrives, instead of re-running rout_planning_hotspot.py and
+convert_shp_to_graph.py.
+
+Only the accidents within distance_threshold of a new one get a new local_density, and only
+the road segments within max_distance of an accident whose status changed get a new raw risk.
+Two values are global and are handled explicitly with --normalization:
+    global  z-scores, the risk score min-max normalization and the risk category quintiles are
+            recomputed over all points and roads, which gives the layers a full rebuild would.
+            Every edge whose score moved is patched, so this can touch most of the graph.
+    frozen  the mean and standard deviation of the densities, the risk min/max and the category
+            quintiles of the current layers are kept, so only nearby points and roads change.
+            Scores drift from a full rebuild as batches accumulate; run a global update or the
+            full pipeline periodically.
+
+Usage:
+    python incremental_update.py new_accidents.shp [--normalization global|frozen] [--risk-mode line|centroid]
+"""
+import argparse
+import json
+import os
+import pickle
+import shutil
+import sys
+import time
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from scipy import stats
+from scipy.spatial import cKDTree
+from shapely import STRtree
+
+from rout_planning_hotspot import (assign_risk_category, centroid_risk, classify_hotspots, count_points_within,
+                                   line_risk_raw, risk_category_percentiles)
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from csr_graph import MAX_CATEGORIES, category_key
+from graph_artifact import GraphArtifact, install_artifact, is_artifact
+
+# Shapefile field names are cut to 10 characters
+SHAPEFILE_COLUMNS = {'local_dens': 'local_density', 'risk_categ': 'risk_category'}
+
+
+def read_layer(path):
+    """Read a layer written by rout_planning_hotspot.py, restoring the full column names."""
+    gdf = gpd.read_file(path)
+    return gdf.rename(columns={k: v for k, v in SHAPEFILE_COLUMNS.items() if k in gdf.columns})
+
+
+# Step 1: Add the new accidents to the hotspot layer, recounting only the densities they change
+def update_hotspots(hotspot_gdf, new_gdf, distance_threshold=200, p_value_threshold=0.30, z_score_threshold=-0.6,
+                    normalization='global'):
+    """
+    Append new accidents to a layer from perform_hotspot_analysis and update its statistics.
+    Returns (gdf, changed): the updated layer (new accidents last) and a boolean array marking
+    the points that became or stopped being a 'Hot Spot'.
+    - normalization: 'global' recomputes z-scores over all points; 'frozen' scores the changed
+      points against the mean and standard deviation of the current densities.
+    """
+    old_coords = shapely.get_coordinates(np.asarray(hotspot_gdf.geometry, dtype=object))
+    new_coords = shapely.get_coordinates(np.asarray(new_gdf.geometry, dtype=object))
+    old_density = hotspot_gdf['local_density'].to_numpy(dtype=np.int64)
+    all_coords = np.vstack((old_coords, new_coords))
+
+    # Existing points near a new one gain a neighbour per new point within distance_threshold
+    old_tree = cKDTree(old_coords)
+    candidates = old_tree.query_ball_point(new_coords, distance_threshold * (1 + 1e-9) + 1e-9)
+    near = np.unique(np.concatenate([np.asarray(c, dtype=np.int64) for c in candidates] + [np.zeros(0, np.int64)]))
+    gained = count_points_within(old_coords[near], new_coords, distance_threshold)
+    touched = near[gained > 0]
+    density = np.concatenate((old_density, count_points_within(new_coords, all_coords, distance_threshold)))
+    density[touched] += gained[gained > 0]
+    # New points always count themselves, so they are always recomputed
+    recount = np.concatenate((touched, np.arange(len(old_coords), len(all_coords))))
+
+    gdf = pd.concat([hotspot_gdf, new_gdf.to_crs(hotspot_gdf.crs)], ignore_index=True)
+    was_hot = np.concatenate((hotspot_gdf['hotspot'].to_numpy(dtype=object) == 'Hot Spot',
+                              np.zeros(len(new_coords), dtype=bool)))
+    gdf['local_density'] = density
+    if normalization == 'global':
+        z_scores = stats.zscore(density)
+        gdf['z_score'] = z_scores
+        gdf['p_value'] = 1 - stats.norm.cdf(abs(z_scores))
+        gdf['hotspot'] = classify_hotspots(gdf['z_score'], gdf['p_value'], p_value_threshold, z_score_threshold)
+    elif normalization == 'frozen':
+        z_scores = (density[recount] - old_density.mean()) / old_density.std()
+        p_values = 1 - stats.norm.cdf(abs(z_scores))
+        gdf.loc[recount, 'z_score'] = z_scores
+        gdf.loc[recount, 'p_value'] = p_values
+        gdf.loc[recount, 'hotspot'] = classify_hotspots(z_scores, p_values, p_value_threshold, z_score_threshold)
+    else:
+        raise ValueError(f"Unknown normalization '{normalization}', expected 'global' or 'frozen'")
+
+    changed = (gdf['hotspot'].to_numpy(dtype=object) == 'Hot Spot') != was_hot
+    return gdf, changed
+
+
+# Step 2: Recompute the risk of the road segments near the changed points
+def update_risk_layer(road_gdf, hotspot_gdf, changed_points, risk_mode='line', max_distance=200, power=2,
+                      normalization='global'):
+    """
+    Update the risk_score, risk_raw and risk_category of a layer from rout_planning_hotspot.py.
+    Returns (gdf, changed): the updated layer and a boolean array marking the road segments
+    whose risk_score or risk_category changed.
+    - hotspot_gdf: The updated hotspot layer from update_hotspots.
+    - changed_points: Points that can change a road's risk: for 'line' those that became or
+      stopped being a hot spot, for 'centroid' the new accidents.
+    - normalization: 'global' renormalizes and recategorizes all roads; 'frozen' keeps the
+      current min/max and quintiles and only updates the roads near changed_points.
+    """
+    if normalization not in ('global', 'frozen'):
+        raise ValueError(f"Unknown normalization '{normalization}', expected 'global' or 'frozen'")
+    gdf = road_gdf.copy()
+    road_geometries = np.asarray(gdf.geometry, dtype=object)
+    # The search distance is padded; a road found needlessly just gets its current value back
+    search_distance = max_distance * (1 + 1e-9) + 1e-9
+
+    if risk_mode == 'line':
+        if 'risk_raw' not in gdf.columns:
+            raise ValueError("The road layer has no risk_raw column; rebuild it with "
+                             "rout_planning_hotspot.py --risk-mode line")
+        hotspot_points = np.asarray(hotspot_gdf.geometry[hotspot_gdf['hotspot'] == 'Hot Spot'], dtype=object)
+        _, affected = STRtree(road_geometries).query(np.asarray(changed_points, dtype=object),
+                                                     predicate='dwithin', distance=search_distance)
+        affected = np.unique(affected)
+        old_raw = gdf['risk_raw'].to_numpy(dtype=float)
+        risk_raw = old_raw.copy()
+        risk_raw[affected] = line_risk_raw(road_geometries[affected], shapely.get_coordinates(hotspot_points),
+                                           STRtree(hotspot_points), max_distance, power)
+        # Normalize risk scores to 0-1 range -min max normalization
+        low, high = risk_raw.min(), risk_raw.max()
+        if normalization == 'global' and (low, high) != (old_raw.min(), old_raw.max()):
+            # The range moved, so every score changes
+            risk_score = (risk_raw - low) / (high - low)
+        else:
+            # Scores read back from a shapefile are rounded, so unaffected roads keep theirs as-is
+            low, high = old_raw.min(), old_raw.max()
+            risk_score = gdf['risk_score'].to_numpy(dtype=float).copy()
+            risk_score[affected] = (risk_raw[affected] - low) / (high - low)
+        gdf['risk_raw'] = risk_raw
+    elif risk_mode == 'centroid':
+        accident_points = np.asarray(hotspot_gdf.geometry, dtype=object)
+        centroids = shapely.centroid(road_geometries)
+        _, affected = STRtree(centroids).query(np.asarray(changed_points, dtype=object),
+                                               predicate='dwithin', distance=search_distance)
+        affected = np.unique(affected)
+        risk_score = gdf['risk_score'].to_numpy(dtype=float).copy()
+        risk_score[affected] = centroid_risk(centroids[affected], accident_points, STRtree(accident_points),
+                                             max_distance, power)
+    else:
+        raise ValueError(f"Unknown risk mode '{risk_mode}', expected 'line' or 'centroid'")
+
+    old_score = gdf['risk_score'].to_numpy(dtype=float)
+    old_category = gdf['risk_category'].to_numpy(dtype=object)
+    category = old_category.copy()
+    if normalization == 'global':
+        percentiles = risk_category_percentiles(risk_score)
+        category[:] = [assign_risk_category(score, percentiles) for score in risk_score.tolist()]
+    else:
+        percentiles = risk_category_percentiles(old_score)
+        category[affected] = [assign_risk_category(score, percentiles) for score in risk_score[affected].tolist()]
+    gdf['risk_score'] = risk_score
+    gdf['risk_category'] = category
+
+    changed = (risk_score != old_score) | (category != old_category)
+    return gdf, changed
+
+
+# Step 3: Patch the edges of the changed roads in the routing graph
+def road_updates(road_gdf, changed):
+    """(risk_score, risk_category) of each changed road, keyed by the WKB of its geometry."""
+    rows = road_gdf[changed]
+    return dict(zip(shapely.to_wkb(np.asarray(rows.geometry, dtype=object)).tolist(),
+                    zip(rows['risk_score'].tolist(), rows['risk_category'].tolist())))
+
+
+def patch_graph(G, updates):
+    """
+    Set risk_score and risk_category on the edges of the updated roads of a networkx graph
+    from convert_shp_to_graph.py. Returns the number of edges patched.
+    - updates: From road_updates.
+    """
+    # Edges of one road share its geometry object, so each geometry is encoded once
+    edges_by_geometry = {}
+    geometries = {}
+    for u, v, data in G.edges(data=True):
+        geometry = data.get('geometry')
+        if geometry is not None:
+            edges_by_geometry.setdefault(id(geometry), []).append(data)
+            geometries[id(geometry)] = geometry
+    patched = 0
+    for key, geometry in geometries.items():
+        update = updates.get(shapely.to_wkb(geometry))
+        if update is None:
+            continue
+        for data in edges_by_geometry[key]:
+            data['risk_score'], data['risk_category'] = update
+            patched += 1
+    return patched
+
+
+def patch_graph_artifact(directory, updates):
+    """
+    Write a copy of a graph artifact (see graph_artifact.py) with new risk_score and
+    category_codes arrays for the updated roads, and swap it in for the original in one
+    rename. Servers that already mapped the artifact keep reading the previous arrays until
+    they reload it. Returns the number of edges patched.
+    - updates: From road_updates.
+    """
+    artifact = GraphArtifact(directory)
+    manifest = dict(artifact.manifest)
+    categories = list(manifest['categories'])
+    wkb, wkb_offsets = artifact._wkb, artifact._wkb_offsets
+    road_score = np.full(len(artifact.roads), np.nan)
+    road_code = np.full(len(artifact.roads), -1, dtype=np.int8)
+    for road in range(len(artifact.roads)):
+        update = updates.get(wkb[wkb_offsets[road]:wkb_offsets[road + 1]].tobytes())
+        if update is not None:
+            score, category = update
+            category = category_key(category)
+            if category not in categories:
+                if len(categories) == MAX_CATEGORIES:
+                    raise ValueError(f"more than {MAX_CATEGORIES} risk categories")
+                categories.append(category)
+            road_score[road] = score
+            road_code[road] = categories.index(category)
+
+    edges = np.flatnonzero(~np.isnan(road_score)[artifact.edge_road])
+    risk_score = np.array(artifact.graph.risk_score)
+    category_codes = np.array(artifact.graph.category_codes)
+    risk_score[edges] = road_score[artifact.edge_road[edges]]
+    category_codes[edges] = road_code[artifact.edge_road[edges]]
+    del artifact
+
+    directory = os.path.abspath(directory)
+    staging = directory + ".tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    shutil.copytree(directory, staging)
+    np.save(os.path.join(staging, "risk_score.npy"), risk_score)
+    np.save(os.path.join(staging, "category_codes.npy"), category_codes)
+    manifest['categories'] = categories
+    manifest['updated'] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    with open(os.path.join(staging, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    install_artifact(staging, directory)
+    return len(edges)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("accidents", help="New accident records (any format geopandas reads)")
+    parser.add_argument("--normalization", choices=["global", "frozen"], default="global",
+                        help="How z-scores, risk normalization and categories are updated (see above)")
+    parser.add_argument("--risk-mode", choices=["line", "centroid"], default="line",
+                        help="The --risk-mode the road layer was built with by rout_planning_hotspot.py")
+    parser.add_argument("--hotspots", default=r'./Datasets/Subset/Accident_hotspots.shp')
+    parser.add_argument("--roads", default=r'./Datasets/Subset/road_risk_layer_categorized.shp')
+    parser.add_argument("--graph", default=r'./Datasets/Subset/road_network.pkl',
+                        help="Pickled graph to patch; skipped if missing")
+    parser.add_argument("--artifact", default=r'./Datasets/Subset/road_network_graph',
+                        help="Graph artifact to patch; skipped if missing")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    new_gdf = gpd.read_file(args.accidents).to_crs('epsg:32611')
+    hotspot_gdf = read_layer(args.hotspots).to_crs('epsg:32611')
+    road_gdf = read_layer(args.roads).to_crs('epsg:32611')
+    print(f"Read {len(new_gdf)} new accidents, {len(hotspot_gdf)} accidents and {len(road_gdf)} road segments "
+          f"in {time.perf_counter() - start:.1f} s")
+
+    step = time.perf_counter()
+    hotspot_gdf, changed_points = update_hotspots(hotspot_gdf, new_gdf, distance_threshold=200, p_value_threshold=0.30,
+                                                  z_score_threshold=-0.6, normalization=args.normalization)
+    if args.risk_mode == 'line':
+        changed_points = hotspot_gdf.geometry[changed_points]
+    else:
+        changed_points = new_gdf.geometry
+    road_gdf, changed_roads = update_risk_layer(road_gdf, hotspot_gdf, changed_points, risk_mode=args.risk_mode,
+                                                max_distance=200, power=2, normalization=args.normalization)
+    print(f"{len(changed_points)} accidents changed hot spot status; {int(changed_roads.sum())} road segments changed "
+          f"risk ({time.perf_counter() - step:.1f} s)")
+
+    hotspot_gdf.to_file(args.hotspots, driver='ESRI Shapefile')
+    road_gdf.to_file(args.roads, driver='ESRI Shapefile')
+
+    updates = road_updates(road_gdf, changed_roads)
+    if os.path.exists(args.graph):
+        with open(args.graph, "rb") as f:
+            G = pickle.load(f)
+        patched = patch_graph(G, updates)
+        with open(args.graph + ".tmp", "wb") as f:
+            pickle.dump(G, f)
+        os.replace(args.graph + ".tmp", args.graph)
+        print(f"Patched {patched} edges in {args.graph}")
+    if is_artifact(args.artifact):
+        patched = patch_graph_artifact(args.artifact, updates)
+        print(f"Patched {patched} edges in {args.artifact}")
+    print("Contraction hierarchies and landmark tables built from the old scores are now stale. The server "
+          "stops using them when it reloads the graph (routing with plain A*, see /status warnings) until they "
+          "are rebuilt with contraction_hierarchy.py and landmarks.py")
+    print(f"Done in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
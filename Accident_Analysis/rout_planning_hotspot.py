@@ -8,9 +8,15 @@ from libpysal.examples import load_example
 from esda.getisord import G_Local
 from scipy import stats
 from scipy.spatial.distance import cdist
+from scipy.spatial import cKDTree
 from shapely.ops import nearest_points
+import shapely
+from shapely import STRtree
 import pandas as pd
 from rtree import index
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import argparse
 
 # Step 1: It takes road network and convert the MultiLineString to LineString and returns a gdf
 def explode_multilinestring(gdf):
@@ -119,23 +125,76 @@ def analyze_clusters(labels):
     print(f"Clustered accidents: {clustered_points} ({clustered_points/total_points*100:.2f}%)")
     print(f"Noise points: {noise_points} ({noise_points/total_points*100:.2f}%)")
 
+# Counts, for every point, the points within distance_threshold of it (itself included) without building an N x N matrix
+def count_neighbors_within(coords, distance_threshold):
+    """
+    Number of points within distance_threshold of each point, itself included.
+    Same counts as (cdist(coords, coords) <= distance_threshold).sum(axis=1), in O(N) memory.
+    """
+    return count_points_within(coords, coords, distance_threshold)
+
+def count_points_within(coords, others, distance_threshold, tree=None):
+    """
+    Number of `others` within distance_threshold of each point of coords.
+    Same counts as (cdist(coords, others) <= distance_threshold).sum(axis=1), in O(N) memory.
+    A KD-tree counts the pairs that are clearly inside the threshold; only the rare pairs
+    within rounding error of it are checked again with the distance computed as cdist does.
+    - tree: cKDTree over others, if one is already built.
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    others = np.asarray(others, dtype=float).reshape(-1, 2)
+    tree = cKDTree(others) if tree is None else tree
+    inner = distance_threshold * (1 - 1e-9)
+    outer = distance_threshold * (1 + 1e-9) + 1e-9
+    counts = np.asarray(tree.query_ball_point(coords, inner, return_length=True), dtype=np.int64)
+    borderline = tree.query_ball_point(coords, outer, return_length=True) > counts
+    for i in np.flatnonzero(borderline):
+        candidates = others[tree.query_ball_point(coords[i], outer)]
+        dx = coords[i, 0] - candidates[:, 0]
+        dy = coords[i, 1] - candidates[:, 1]
+        counts[i] = np.count_nonzero(np.sqrt(dx * dx + dy * dy) <= distance_threshold)
+    return counts
+
+# Labels points from their z-scores and p-values, as perform_hotspot_analysis does
+def classify_hotspots(z_scores, p_values, p_value_threshold=0.25, z_score_threshold=-0.2):
+    """
+    'Hot Spot', 'Cold Spot' or 'Not Significant' for each point.
+    """
+    z_scores = np.asarray(z_scores)
+    p_values = np.asarray(p_values)
+    labels = np.full(len(z_scores), 'Not Significant', dtype=object)
+    # labels[(z_scores > 1.96) & (p_values < 0.05)] = 'Hot Spot'
+    # labels[(z_scores < -1.96) & (p_values < 0.05)] = 'Cold Spot'
+    labels[(z_scores > z_score_threshold) & (p_values > p_value_threshold)] = 'Hot Spot'
+    labels[(z_scores < z_score_threshold) & (p_values < p_value_threshold)] = 'Cold Spot'
+    return labels
+
 #Step 6 : Performs a simplified hotspot analysis on accident points to identify statistically significant clusters (hotspots) and areas with fewer incidents (cold spots) using spatial statistics.
-def perform_hotspot_analysis(gdf, distance_threshold=200, p_value_threshold=0.25, z_score_threshold=-0.2):
+def perform_hotspot_analysis(gdf, distance_threshold=200, p_value_threshold=0.25, z_score_threshold=-0.2, method='kdtree'):
     """
     Perform hotspot analysis using spatial statistics
+    method: 'kdtree' counts every point's neighbours with KD-tree ball queries that return
+    only the counts (count_neighbors_within), in O(N) memory; 'cdist' builds the full
+    N x N distance matrix (only feasible for a few thousand points). Both give identical results.
     """
     # Get coordinates
     coords = np.array([(geom.x, geom.y) for geom in gdf.geometry])
-    
-    # Calculate distance matrix
-    distances = cdist(coords, coords)
-    
-    # Create binary neighborhood matrix
-    neighborhood = distances <= distance_threshold   #give true or false
-    neighborhood = neighborhood.astype(int)             #convert to 1(neighbor) or 0(not a neigbor)
-    
-    # Calculate local density (sum of neighbors)
-    local_density = np.sum(neighborhood, axis=1)  #Measures how "crowded" each point’s neighborhood
+
+    if method == 'kdtree':
+        # Calculate local density (number of points within distance_threshold)
+        local_density = count_neighbors_within(coords, distance_threshold)
+    elif method == 'cdist':
+        # Calculate distance matrix
+        distances = cdist(coords, coords)
+
+        # Create binary neighborhood matrix
+        neighborhood = distances <= distance_threshold   #give true or false
+        neighborhood = neighborhood.astype(int)             #convert to 1(neighbor) or 0(not a neigbor)
+
+        # Calculate local density (sum of neighbors)
+        local_density = np.sum(neighborhood, axis=1)  #Measures how "crowded" each point’s neighborhood
+    else:
+        raise ValueError(f"Unknown method '{method}', expected 'kdtree' or 'cdist'")
     
     # Calculate z-scores
     z_scores = stats.zscore(local_density)
@@ -146,11 +205,7 @@ def perform_hotspot_analysis(gdf, distance_threshold=200, p_value_threshold=0.25
     gdf['p_value'] = 1 - stats.norm.cdf(abs(z_scores))
     
     # Classify hotspots based on z-scores and p-values
-    gdf['hotspot'] = 'Not Significant'
-    # gdf.loc[(gdf['z_score'] > 1.96) & (gdf['p_value'] < 0.05), 'hotspot'] = 'Hot Spot'
-    # gdf.loc[(gdf['z_score'] < -1.96) & (gdf['p_value'] < 0.05), 'hotspot'] = 'Cold Spot'
-    gdf.loc[(gdf['z_score'] > z_score_threshold) & (gdf['p_value'] > p_value_threshold), 'hotspot'] = 'Hot Spot'
-    gdf.loc[(gdf['z_score'] < z_score_threshold) & (gdf['p_value'] < p_value_threshold), 'hotspot'] = 'Cold Spot'
+    gdf['hotspot'] = classify_hotspots(gdf['z_score'], gdf['p_value'], p_value_threshold, z_score_threshold)
 
     return gdf
 
@@ -204,6 +259,41 @@ def analyze_hotspots(gdf):
     total_points = len(gdf)
     print(f"\nPercentage of significant hotspots: {(significant_hotspots/total_points)*100:.2f}%")
 
+# Raw IDW risk of one road segment from the hotspots near it, used by calculate_road_risk_ and its worker processes
+def road_line_risk(road_geom, hotspot_geoms, spatial_index, max_distance=500, power=2):
+    """
+    Mean inverse distance weight of the hotspots within max_distance of a road segment,
+    or None if the spatial index finds no hotspot near it.
+    - hotspot_geoms: Sequence of hotspot Points.
+    - spatial_index: rtree Index holding hotspot_geoms[i].bounds under id i.
+    """
+    # Create buffer around road segment
+    buffer_geom = road_geom.buffer(max_distance) #buffer (polygon) of 500 mt around road segment
+
+    # Find potential hotspots using spatial index
+    potential_hotspot_indices = list(spatial_index.intersection(buffer_geom.bounds))
+
+    if not potential_hotspot_indices:
+        return None
+
+    # Calculate distances and weights for potential hotspots
+    total_risk = 0
+    count = 0
+
+    for candidate in potential_hotspot_indices:
+        hotspot = hotspot_geoms[candidate]
+
+        # Find the nearest point on the road to the hotspot
+        nearest_road_point, _ = nearest_points(road_geom, hotspot)
+        distance = nearest_road_point.distance(hotspot)
+
+        if distance <= max_distance:
+            weight = 1 / (distance ** power) #Inverse distance weight power=2
+            total_risk += weight
+            count += 1
+
+    return total_risk / count if count > 0 else 0.0 #Normalizes risk by the number of hotspots
+
 def calculate_road_risk_(road_gdf, hotspot_gdf, max_distance=500, power=2):
     """
     Calculate risk scores for road segments based on proximity to hotspots
@@ -223,44 +313,20 @@ def calculate_road_risk_(road_gdf, hotspot_gdf, max_distance=500, power=2):
     
     # Get hotspot points
     hotspot_points = hotspot_gdf[hotspot_gdf['hotspot'] == 'Hot Spot']
+    hotspot_geoms = list(hotspot_points.geometry)
     
     # Create spatial index for hotspot points- Builds an R-tree spatial index of hotspot bounding boxes. Speeds up queries by quickly identifying hotspots near a road, avoiding exhaustive distance checks. R-tree is efficient for spatial data.
     hotspot_idx = index.Index()
-    for idx, row in hotspot_points.iterrows():
-        hotspot_idx.insert(idx, row.geometry.bounds)
+    for i, geom in enumerate(hotspot_geoms):
+        hotspot_idx.insert(i, geom.bounds)
     
     # Calculate risk for each road segment using spatial indexing
     for idx, road in road_risk.iterrows():
-        road_geom = road.geometry
-        
-        # Create buffer around road segment
-        buffer_geom = road_geom.buffer(max_distance) #buffer (polygon) of 500 mt around road segment
-        
-        # Find potential hotspots using spatial index
-        potential_hotspot_indices = list(hotspot_idx.intersection(buffer_geom.bounds))
-        
-        if not potential_hotspot_indices:
+        risk = road_line_risk(road.geometry, hotspot_geoms, hotspot_idx, max_distance, power)
+        if risk is None:
             print('empty hotspot')
             continue
-            
-        # Calculate distances and weights for potential hotspots
-        total_risk = 0
-        count = 0
-        
-        for hotspot_idx in potential_hotspot_indices:
-            hotspot = hotspot_points.loc[hotspot_idx].geometry
-            
-            # Find the nearest point on the road to the hotspot
-            nearest_road_point, _ = nearest_points(road_geom, hotspot)
-            distance = nearest_road_point.distance(hotspot)
-            
-            if distance <= max_distance:
-                weight = 1 / (distance ** power) #Inverse distance weight power=2
-                total_risk += weight
-                count += 1
-        
-        if count > 0:
-            road_risk.at[idx, 'risk_score'] = total_risk / count #Normalizes risk by the number of hotspots
+        road_risk.at[idx, 'risk_score'] = risk
     
     # Normalize risk scores to 0-1 range -min max normalization
     road_risk['risk_score'] = (road_risk['risk_score'] - road_risk['risk_score'].min()) / \
@@ -307,6 +373,192 @@ def calculate_road_risk(road_geometry, hotspot_gdf, max_distance=500, power=2, m
     return risk_score
 
 
+# Computes calculate_road_risk for every road segment at once: one STRtree query for all centroids, then numpy sums per road
+def calculate_risk_layer(road_geometries, hotspot_gdf, max_distance=500, power=2, max_risk=1.0, chunk_size=100000):
+    """
+    Risk score of every road segment, identical to applying calculate_road_risk to each one.
+
+    Parameters:
+    - road_geometries: GeoSeries (or array) of road segment geometries.
+    - hotspot_gdf: GeoDataFrame with hotspot locations (geometry column).
+    - max_distance, power, max_risk: As for calculate_road_risk.
+    - chunk_size: Road segments handled per STRtree query, to bound memory.
+
+    Returns:
+    - numpy array of risk scores aligned with road_geometries.
+    """
+    road_geometries = np.asarray(road_geometries, dtype=object)
+    hotspot_points = np.asarray(hotspot_gdf.geometry, dtype=object)
+    centroids = shapely.centroid(road_geometries)
+    tree = STRtree(hotspot_points)
+    risk_scores = np.zeros(len(road_geometries))
+    for start in range(0, len(centroids), chunk_size):
+        chunk = centroids[start:start + chunk_size]
+        risk_scores[start:start + len(chunk)] = centroid_risk(chunk, hotspot_points, tree, max_distance, power, max_risk)
+    return risk_scores
+
+def centroid_risk(centroids, hotspot_points, tree, max_distance=500, power=2, max_risk=1.0):
+    """
+    calculate_road_risk for a batch of road centroids.
+    - hotspot_points: Array of hotspot Points; tree: STRtree over them.
+    """
+    # Candidate (road, hotspot) pairs; the search distance is padded and the exact
+    # distance <= max_distance test is applied below, as calculate_road_risk does
+    roads, hotspots = tree.query(centroids, predicate='dwithin', distance=max_distance * (1 + 1e-9) + 1e-9)
+    # Sum each road's weights in hotspot order, the order calculate_road_risk adds them in
+    order = np.lexsort((hotspots, roads))
+    roads, hotspots = roads[order], hotspots[order]
+    distances = shapely.distance(centroids[roads], hotspot_points[hotspots])
+    keep = (distances <= max_distance) & (distances > 0)  # Avoid division by zero
+    # Python's float ** (C pow) and numpy's power round differently in the last bit
+    # for a few values; taking the power per pair keeps the scores bit-identical
+    weights = np.fromiter((1 / (dist ** power) * max_risk for dist in distances[keep].tolist()),
+                          dtype=float, count=int(keep.sum()))
+    return np.bincount(roads[keep], weights=weights, minlength=len(centroids))
+
+# Line-to-point IDW (the calculate_road_risk_ semantics) for a batch of road segments, on coordinate arrays
+def line_risk_raw(road_geometries, hotspot_coords, tree, max_distance=500, power=2):
+    """
+    Mean inverse distance weight of the hotspots within max_distance of each road, measured
+    to the nearest point of the road (0 for roads with none). Pairs at distance 0 are skipped.
+    - hotspot_coords: (n, 2) array of hotspot coordinates; tree: STRtree over their Points.
+    """
+    road_geometries = np.asarray(road_geometries, dtype=object)
+    coords, owner = shapely.get_coordinates(road_geometries, return_index=True)
+    # Segments join consecutive vertices of the same road
+    is_segment = owner[1:] == owner[:-1]
+    a, b, segment_road = coords[:-1][is_segment], coords[1:][is_segment], owner[:-1][is_segment]
+
+    # Candidate (segment, hotspot) pairs from each segment's bounding box grown by max_distance
+    lo = np.minimum(a, b) - max_distance
+    hi = np.maximum(a, b) + max_distance
+    segments, hotspots = tree.query(shapely.box(lo[:, 0], lo[:, 1], hi[:, 0], hi[:, 1]))
+
+    # Distance from each hotspot to the closest point of the segment
+    p = hotspot_coords[hotspots]
+    a, d = a[segments], b[segments] - a[segments]
+    length2 = (d * d).sum(axis=1)
+    t = np.divide(((p - a) * d).sum(axis=1), length2, out=np.zeros(len(length2)), where=length2 > 0)
+    closest = a + np.clip(t, 0.0, 1.0)[:, None] * d
+    distances = np.hypot(p[:, 0] - closest[:, 0], p[:, 1] - closest[:, 1])
+
+    # Keep the nearest segment for each (road, hotspot) pair
+    roads = segment_road[segments]
+    order = np.lexsort((distances, hotspots, roads))
+    roads, hotspots, distances = roads[order], hotspots[order], distances[order]
+    first = np.ones(len(roads), dtype=bool)
+    first[1:] = (roads[1:] != roads[:-1]) | (hotspots[1:] != hotspots[:-1])
+    roads, distances = roads[first], distances[first]
+
+    keep = (distances <= max_distance) & (distances > 0)
+    total_risk = np.bincount(roads[keep], weights=1 / distances[keep] ** power, minlength=len(road_geometries))
+    count = np.bincount(roads[keep], minlength=len(road_geometries))
+    return np.divide(total_risk, count, out=np.zeros(len(road_geometries)), where=count > 0)
+
+# Batch replacement for calculate_road_risk_, the default for full-city runs
+def calculate_line_risk_layer(road_geometries, hotspot_gdf, max_distance=500, power=2, chunk_size=20000):
+    """
+    calculate_road_risk_ for all road segments at once: each segment's risk is the mean inverse
+    distance weight of the 'Hot Spot' points within max_distance of it, then all scores are
+    min-max normalized to 0-1. Candidates come from each segment's bounding box grown by
+    max_distance, so unlike the buffer bounds used by calculate_road_risk_ no hot spot within
+    max_distance of a segment end is missed.
+
+    Parameters:
+    - road_geometries: GeoSeries (or array) of road segment LineStrings.
+    - hotspot_gdf: GeoDataFrame from perform_hotspot_analysis (with the 'hotspot' column).
+    - chunk_size: Road segments handled per batch, to bound memory.
+
+    Returns:
+    - (risk_score, risk_raw): normalized and raw scores, aligned with road_geometries.
+    """
+    road_geometries = np.asarray(road_geometries, dtype=object)
+    hotspot_points = np.asarray(hotspot_gdf.geometry[hotspot_gdf['hotspot'] == 'Hot Spot'], dtype=object)
+    hotspot_coords = shapely.get_coordinates(hotspot_points)
+    tree = STRtree(hotspot_points)
+    risk_raw = np.zeros(len(road_geometries))
+    for start in range(0, len(road_geometries), chunk_size):
+        chunk = road_geometries[start:start + chunk_size]
+        risk_raw[start:start + len(chunk)] = line_risk_raw(chunk, hotspot_coords, tree, max_distance, power)
+    # Normalize risk scores to 0-1 range -min max normalization
+    risk_score = (risk_raw - risk_raw.min()) / (risk_raw.max() - risk_raw.min())
+    return risk_score, risk_raw
+
+# Worker state for calculate_risk_layer_parallel: hotspots rebuilt once per process from shared memory
+_risk_worker = {}
+
+def _init_risk_worker(shm_name, shape, dtype, method, max_distance, power, max_risk):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    coords = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    hotspot_points = shapely.points(coords)
+    _risk_worker.update(shm=shm, hotspot_coords=coords, hotspot_points=hotspot_points, method=method,
+                        max_distance=max_distance, power=power, max_risk=max_risk)
+    if method in ('centroid', 'line'):
+        _risk_worker['tree'] = STRtree(hotspot_points)
+    else:
+        # Same ids and insertion order as calculate_road_risk_, so candidates come back in the same order
+        spatial_index = index.Index()
+        for i, geom in enumerate(hotspot_points):
+            spatial_index.insert(i, geom.bounds)
+        _risk_worker['spatial_index'] = spatial_index
+
+def _risk_chunk(road_geometries):
+    w = _risk_worker
+    if w['method'] == 'centroid':
+        return centroid_risk(shapely.centroid(road_geometries), w['hotspot_points'], w['tree'],
+                             w['max_distance'], w['power'], w['max_risk'])
+    if w['method'] == 'line':
+        return line_risk_raw(road_geometries, w['hotspot_coords'], w['tree'], w['max_distance'], w['power'])
+    risks = [road_line_risk(geom, w['hotspot_points'], w['spatial_index'], w['max_distance'], w['power'])
+             for geom in road_geometries]
+    return np.array([0.0 if r is None else r for r in risks])
+
+# Runs either risk computation over chunks of road segments in a process pool
+def calculate_risk_layer_parallel(road_geometries, hotspot_gdf, method='centroid', workers=None, chunk_size=5000,
+                                  max_distance=500, power=2, max_risk=1.0, return_raw=False):
+    """
+    Risk scores of road segments computed by `workers` processes, chunk_size segments at a time.
+    Matches the serial result exactly: each segment's score only depends on the hotspots,
+    and chunks are reassembled in order.
+
+    Parameters:
+    - method: 'centroid' for calculate_risk_layer (all points of hotspot_gdf),
+      'line' for calculate_line_risk_layer and 'line-rtree' for calculate_road_risk_
+      (both use the 'Hot Spot' points and are min-max normalized).
+    - workers: Number of processes (default: one per CPU).
+    - chunk_size: Road segments per task.
+    - return_raw: For the line methods, also return the scores before normalization.
+
+    Returns:
+    - numpy array of risk scores aligned with road_geometries, or (risk_score, risk_raw).
+    """
+    if method in ('line', 'line-rtree'):
+        hotspot_gdf = hotspot_gdf[hotspot_gdf['hotspot'] == 'Hot Spot']
+    elif method != 'centroid':
+        raise ValueError(f"Unknown method '{method}', expected 'centroid', 'line' or 'line-rtree'")
+    road_geometries = np.asarray(road_geometries, dtype=object)
+    coords = shapely.get_coordinates(np.asarray(hotspot_gdf.geometry, dtype=object))
+    chunks = [road_geometries[start:start + chunk_size] for start in range(0, len(road_geometries), chunk_size)]
+
+    # The hotspot coordinates are copied into shared memory once, not pickled into every task
+    shm = shared_memory.SharedMemory(create=True, size=max(coords.nbytes, 1))
+    try:
+        np.ndarray(coords.shape, dtype=coords.dtype, buffer=shm.buf)[:] = coords
+        init_args = (shm.name, coords.shape, coords.dtype.str, method, max_distance, power, max_risk)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_risk_worker, initargs=init_args) as pool:
+            risk_scores = np.concatenate(list(pool.map(_risk_chunk, chunks)) or [np.zeros(0)])
+    finally:
+        shm.close()
+        shm.unlink()
+
+    if method == 'centroid':
+        return risk_scores
+    # Normalize risk scores to 0-1 range -min max normalization, as calculate_road_risk_ does
+    risk_raw = risk_scores
+    risk_scores = (risk_raw - risk_raw.min()) / (risk_raw.max() - risk_raw.min())
+    return (risk_scores, risk_raw) if return_raw else risk_scores
+
+
 def visualize_risk_layer(road_risk_gdf):
     """
     Visualize the risk layer
@@ -329,6 +581,22 @@ def visualize_risk_layer(road_risk_gdf):
     # plt.show()
     plt.close()
 
+# Risk categories are quintiles of the risk scores of all road segments
+def risk_category_percentiles(risk_scores):
+    return np.percentile(risk_scores, [20, 40, 60, 80])
+
+def assign_risk_category(score, percentiles):
+    if score <= percentiles[0]:
+        return 'Very Low'
+    elif score <= percentiles[1]:
+        return 'Low'
+    elif score <= percentiles[2]:
+        return 'Medium' 
+    elif score <= percentiles[3]:
+        return 'High'
+    else:
+        return 'Very High'
+
 def analyze_risk_layer(road_risk_gdf):
     """
     Analyze and print statistics about the risk layer
@@ -341,27 +609,25 @@ def analyze_risk_layer(road_risk_gdf):
     print(f"Minimum risk score: {road_risk_gdf['risk_score'].min():.4f}")
     # Calculate risk score percentiles for classification
     risk_scores = road_risk_gdf['risk_score']
-    percentiles = np.percentile(risk_scores, [20, 40, 60, 80])
-    
-    def assign_risk_category(score):
-        if score <= percentiles[0]:
-            return 'Very Low'
-        elif score <= percentiles[1]:
-            return 'Low'
-        elif score <= percentiles[2]:
-            return 'Medium' 
-        elif score <= percentiles[3]:
-            return 'High'
-        else:
-            return 'Very High'
+    percentiles = risk_category_percentiles(risk_scores)
     
     # Apply the categorization
-    road_risk_gdf['risk_category'] = road_risk_gdf['risk_score'].apply(assign_risk_category)
+    road_risk_gdf['risk_category'] = road_risk_gdf['risk_score'].apply(lambda score: assign_risk_category(score, percentiles))
 
     print("\nRisk Categories Distribution:")
     print(road_risk_gdf['risk_category'].value_counts().sort_index())
 
 def main():
+    parser = argparse.ArgumentParser(description="Accident hotspot analysis and road risk layer")
+    parser.add_argument("--risk-mode", choices=["line", "centroid", "line-rtree"], default="line",
+                        help="'line': mean IDW from the nearest point of each segment to nearby hot spots, normalized "
+                             "to 0-1 (calculate_line_risk_layer); 'centroid': IDW from each segment's centroid to all "
+                             "accidents (calculate_road_risk); 'line-rtree': the per-segment calculate_road_risk_")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes for the risk layer; above 1 the segments are split into chunks across a process pool")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Road segments per worker task")
+    args = parser.parse_args()
+
     # Path to your shapefiles
 
     # A subset of whole area
@@ -421,9 +687,31 @@ def main():
     # Calculate risk layer
     print("Calculating risk layer...")
     # road_risk_gdf = calculate_road_risk(road_gdf, gdf, max_distance=500, power=2)
-    road_gdf["risk_score"] = road_gdf["geometry"].apply(
-        lambda geom: calculate_road_risk(geom, gdf, max_distance=200, power=2)
-    )
+    # road_gdf["risk_score"] = road_gdf["geometry"].apply(
+    #     lambda geom: calculate_road_risk(geom, gdf, max_distance=200, power=2)
+    # )
+    if args.risk_mode == 'centroid':
+        if args.workers > 1:
+            road_gdf["risk_score"] = calculate_risk_layer_parallel(road_gdf.geometry, gdf, method='centroid',
+                                                                   workers=args.workers, chunk_size=args.chunk_size,
+                                                                   max_distance=200, power=2)
+        else:
+            road_gdf["risk_score"] = calculate_risk_layer(road_gdf.geometry, gdf, max_distance=200, power=2)
+    else:
+        # risk_raw keeps the per-segment mean weight before min-max normalization
+        if args.workers > 1:
+            risk_score, risk_raw = calculate_risk_layer_parallel(road_gdf.geometry, gdf, method=args.risk_mode,
+                                                                 workers=args.workers, chunk_size=args.chunk_size,
+                                                                 max_distance=200, power=2, return_raw=True)
+        elif args.risk_mode == 'line':
+            risk_score, risk_raw = calculate_line_risk_layer(road_gdf.geometry, gdf, max_distance=200, power=2)
+        else:
+            road_risk = calculate_road_risk_(road_gdf, gdf, max_distance=200, power=2)
+            risk_score = road_risk['risk_score']
+            risk_raw = None
+        road_gdf["risk_score"] = np.asarray(risk_score)
+        if risk_raw is not None:
+            road_gdf["risk_raw"] = risk_raw
     # Visualize risk layer
     print("Visualizing risk layer...")
     # visualize_risk_layer(road_gdf)
@@ -0,0 +1,147 @@
+"""
+incremental_update.py must give the layers a full rebuild by rout_planning_hotspot.py gives
+(--normalization global), and patch the routing graph and graph artifact with them. Uses the
+synthetic accidents and roads of benchmark_risk_layer.py.
+
+    python -m pytest test_incremental_update.py
+"""
+import contextlib
+import io
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+from benchmark_risk_layer import synthetic_accidents, synthetic_roads
+from incremental_update import patch_graph, patch_graph_artifact, road_updates, update_hotspots, update_risk_layer
+from rout_planning_hotspot import (analyze_risk_layer, calculate_line_risk_layer, calculate_risk_layer,
+                                   perform_hotspot_analysis)
+# From the repository root, which incremental_update.py puts on sys.path
+from graph_artifact import GraphArtifact, write_graph_artifact
+
+HOTSPOTS = dict(distance_threshold=200, p_value_threshold=0.30, z_score_threshold=-0.6)
+
+
+def full_rebuild(accident_gdf, road_geometries, risk_mode):
+    """The hotspot and road layers rout_planning_hotspot.py builds from scratch."""
+    hotspot_gdf = perform_hotspot_analysis(accident_gdf.copy(), **HOTSPOTS)
+    road_gdf = road_geometries.to_frame("geometry")
+    if risk_mode == 'line':
+        road_gdf['risk_score'], road_gdf['risk_raw'] = calculate_line_risk_layer(
+            road_gdf.geometry, hotspot_gdf, max_distance=200, power=2)
+    else:
+        road_gdf['risk_score'] = calculate_risk_layer(road_gdf.geometry, hotspot_gdf, max_distance=200, power=2)
+    with contextlib.redirect_stdout(io.StringIO()):
+        analyze_risk_layer(road_gdf)
+    return hotspot_gdf, road_gdf
+
+
+@pytest.fixture(scope="module")
+def data():
+    """(accidents so far, new accidents, road geometries)."""
+    accident_gdf = synthetic_accidents(20300, seed=3)
+    old, new = accident_gdf.iloc[:20000].reset_index(drop=True), accident_gdf.iloc[20000:].reset_index(drop=True)
+    return old, new, synthetic_roads(5000, seed=4)
+
+
+def incremental(hotspot_gdf, road_gdf, new, risk_mode, normalization):
+    hotspots, changed_points = update_hotspots(hotspot_gdf, new, normalization=normalization, **HOTSPOTS)
+    points = hotspots.geometry[changed_points] if risk_mode == 'line' else new.geometry
+    roads, changed_roads = update_risk_layer(road_gdf, hotspots, points, risk_mode=risk_mode, max_distance=200,
+                                             power=2, normalization=normalization)
+    return hotspots, changed_points, roads, changed_roads
+
+
+# Step 1: The layers
+
+@pytest.mark.parametrize("risk_mode", ['line', 'centroid'])
+def test_global_update_equals_a_full_rebuild(data, risk_mode):
+    old, new, road_geometries = data
+    hotspot_gdf, road_gdf = full_rebuild(old, road_geometries, risk_mode)
+    hotspots, changed_points, roads, changed_roads = incremental(hotspot_gdf, road_gdf, new, risk_mode, 'global')
+
+    expected_hotspots, expected_roads = full_rebuild(pd.concat([old, new], ignore_index=True), road_geometries,
+                                                     risk_mode)
+    for column in ('local_density', 'z_score', 'p_value', 'hotspot'):
+        assert np.array_equal(hotspots[column].to_numpy(), expected_hotspots[column].to_numpy())
+    assert np.array_equal(roads['risk_score'].to_numpy(), expected_roads['risk_score'].to_numpy())
+    assert np.array_equal(roads['risk_category'].to_numpy(), expected_roads['risk_category'].to_numpy())
+    # The changes reported are exactly the differences from the old layers
+    was_hot = np.concatenate((hotspot_gdf['hotspot'].to_numpy() == 'Hot Spot', np.zeros(len(new), dtype=bool)))
+    assert np.array_equal(changed_points, (hotspots['hotspot'].to_numpy() == 'Hot Spot') != was_hot)
+    assert changed_points.any()
+    assert np.array_equal(changed_roads, (roads['risk_score'].to_numpy() != road_gdf['risk_score'].to_numpy()) |
+                          (roads['risk_category'].to_numpy() != road_gdf['risk_category'].to_numpy()))
+
+
+@pytest.mark.parametrize("risk_mode", ['line', 'centroid'])
+def test_frozen_update_only_changes_roads_near_the_changes(data, risk_mode):
+    old, new, road_geometries = data
+    hotspot_gdf, road_gdf = full_rebuild(old, road_geometries, risk_mode)
+    hotspots, changed_points, roads, changed_roads = incremental(hotspot_gdf, road_gdf, new, risk_mode, 'frozen')
+
+    # Accidents far from every new one keep their statistics
+    far = shapely.distance(np.asarray(hotspot_gdf.geometry, dtype=object)[:, None],
+                           np.asarray(new.geometry, dtype=object)[None, :]).min(axis=1) > 200
+    for column in ('local_density', 'z_score', 'hotspot'):
+        assert np.array_equal(hotspots[column].to_numpy()[:len(old)][far], hotspot_gdf[column].to_numpy()[far])
+    points = hotspots.geometry[changed_points] if risk_mode == 'line' else new.geometry
+    targets = road_geometries if risk_mode == 'line' else road_geometries.centroid
+    near = shapely.distance(np.asarray(targets, dtype=object)[:, None],
+                            np.asarray(points, dtype=object)[None, :]).min(axis=1) <= 200
+    assert changed_roads.any() and not changed_roads[~near].any()
+    assert np.array_equal(roads['risk_score'].to_numpy()[~near], road_gdf['risk_score'].to_numpy()[~near])
+
+
+def test_unknown_normalization_is_an_error(data):
+    old, new, road_geometries = data
+    hotspot_gdf, road_gdf = full_rebuild(old, road_geometries, 'line')
+    with pytest.raises(ValueError):
+        update_hotspots(hotspot_gdf, new, normalization='local')
+    with pytest.raises(ValueError):
+        update_risk_layer(road_gdf, hotspot_gdf, new.geometry, normalization='local')
+
+
+# Step 2: The routing graph and graph artifact
+
+def road_graph(road_gdf):
+    """A graph of the road layer as convert_shp_to_graph.py builds it, one edge per road."""
+    G = nx.DiGraph()
+    G.graph['crs'] = 'epsg:32611'
+    ids = {}
+    for geometry, score, category in zip(road_gdf.geometry, road_gdf['risk_score'], road_gdf['risk_category']):
+        ends = [tuple(p) for p in shapely.get_coordinates(geometry)[[0, -1]]]
+        for p in ends:
+            if p not in ids:
+                ids[p] = len(ids)
+                G.add_node(ids[p], pos=p)
+        G.add_edge(ids[ends[0]], ids[ends[1]], name='Road', length=geometry.length, geometry=geometry,
+                   risk_score=float(score), risk_category=category)
+    return G
+
+
+def test_graph_and_artifact_get_the_new_scores(data, tmp_path):
+    old, new, road_geometries = data
+    hotspot_gdf, road_gdf = full_rebuild(old, road_geometries, 'line')
+    _, _, roads, changed_roads = incremental(hotspot_gdf, road_gdf, new, 'line', 'global')
+    updates = road_updates(roads, changed_roads)
+    assert len(updates) == changed_roads.sum() > 0
+
+    G = road_graph(road_gdf)
+    directory = str(tmp_path / "road_network_graph")
+    write_graph_artifact(G, directory)
+    assert patch_graph(G, updates) == len(updates)
+    assert patch_graph_artifact(directory, updates) == len(updates)
+
+    # Every edge now has the score and category of its road in the updated layer
+    expected = dict(zip(shapely.to_wkb(np.asarray(roads.geometry, dtype=object)).tolist(),
+                        zip(roads['risk_score'].tolist(), roads['risk_category'].tolist())))
+    for _, _, d in G.edges(data=True):
+        assert (d['risk_score'], d['risk_category']) == expected[shapely.to_wkb(d['geometry'])]
+    artifact = GraphArtifact(directory)
+    assert 'updated' in artifact.manifest
+    for edge in range(artifact.graph.number_of_edges):
+        record = artifact.edge_record(edge)
+        assert (record['risk_score'], record['risk_category']) == expected[shapely.to_wkb(record['geometry'])]
@@ -0,0 +1,158 @@
+"""
+The batch engines of rout_planning_hotspot.py must give the results of the straightforward
+versions they replace, on synthetic accidents and roads in a few square kilometres of
+Calgary (EPSG:32611).
+
+    python -m pytest test_rout_planning_hotspot.py
+"""
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+from scipy.spatial.distance import cdist
+
+from rout_planning_hotspot import (calculate_line_risk_layer, calculate_risk_layer, calculate_risk_layer_parallel,
+                                   calculate_road_risk, calculate_road_risk_, count_points_within, line_risk_raw,
+                                   perform_hotspot_analysis)
+
+ORIGIN = np.array([700000.0, 5650000.0])
+
+
+def accidents(count, seed=0):
+    """
+    Clustered accident points around ORIGIN, plus a row of points exactly 200 m (the
+    hotspot distance threshold) apart, where rounding decides what is a neighbour.
+    """
+    rng = np.random.default_rng(seed)
+    centers = ORIGIN + rng.uniform(0, 3000, size=(20, 2))
+    coords = centers[rng.integers(20, size=count)] + rng.normal(0, 150, size=(count, 2))
+    row = ORIGIN + np.column_stack((np.arange(10) * 200.0, np.full(10, -2000.0)))
+    coords = np.vstack((coords, row, row[:3]))
+    return gpd.GeoDataFrame(geometry=gpd.points_from_xy(coords[:, 0], coords[:, 1]), crs='epsg:32611')
+
+
+def roads(count, seed=0):
+    """
+    Straight road segments among the accidents, plus one whose centroid is an accident and
+    one whose centroid is exactly 200 m from one.
+    """
+    rng = np.random.default_rng(seed)
+    start = ORIGIN + rng.uniform(-200, 3200, size=(count, 2))
+    heading = rng.uniform(0, 2 * np.pi, size=count)
+    end = start + np.column_stack((np.cos(heading), np.sin(heading))) * rng.uniform(20, 300, size=(count, 1))
+    row = ORIGIN + [0.0, -2000.0]
+    start = np.vstack((start, row - [50, 0], row + [-50, 200]))
+    end = np.vstack((end, row + [50, 0], row + [50, 200]))
+    return gpd.GeoSeries(shapely.linestrings(np.stack((start, end), axis=1)), crs='epsg:32611')
+
+
+def coordinates(gdf):
+    return np.column_stack((gdf.geometry.x, gdf.geometry.y))
+
+
+@pytest.fixture(scope="module")
+def accident_gdf():
+    return accidents(2000)
+
+
+@pytest.fixture(scope="module")
+def hotspot_gdf(accident_gdf):
+    return perform_hotspot_analysis(accident_gdf.copy(), 200, 0.30, -0.6)
+
+
+@pytest.fixture(scope="module")
+def road_geometries():
+    return roads(500)
+
+
+# Step 1: KD-tree neighbour counts (perform_hotspot_analysis)
+
+@pytest.mark.parametrize("distance_threshold", [200, 57.5])
+def test_neighbour_counts_match_cdist(accident_gdf, distance_threshold):
+    coords = coordinates(accident_gdf)
+    expected = (cdist(coords, coords) <= distance_threshold).sum(axis=1)
+    assert np.array_equal(count_points_within(coords, coords, distance_threshold), expected)
+    others = coords[::7] + 0.5
+    expected = (cdist(coords, others) <= distance_threshold).sum(axis=1)
+    assert np.array_equal(count_points_within(coords, others, distance_threshold), expected)
+
+
+def test_hotspot_analysis_is_the_same_with_both_methods(accident_gdf):
+    kdtree = perform_hotspot_analysis(accident_gdf.copy(), 200, 0.30, -0.6, method='kdtree')
+    matrix = perform_hotspot_analysis(accident_gdf.copy(), 200, 0.30, -0.6, method='cdist')
+    for column in ('local_density', 'z_score', 'p_value', 'hotspot'):
+        assert np.array_equal(kdtree[column].to_numpy(), matrix[column].to_numpy())
+    # Points on the 200 m row (the first three twice) count their neighbours at exactly 200 m
+    assert kdtree['local_density'].iloc[-13:-10].tolist() == [4, 6, 5]
+    assert {'Hot Spot', 'Cold Spot'} <= set(kdtree['hotspot'])
+
+
+def test_unknown_method_is_an_error(accident_gdf):
+    with pytest.raises(ValueError):
+        perform_hotspot_analysis(accident_gdf.copy(), method='grid')
+
+
+# Step 2: Bulk centroid risk (calculate_risk_layer)
+
+@pytest.mark.parametrize("max_distance, power", [(200, 2), (350, 3)])
+def test_risk_layer_matches_the_per_road_function(accident_gdf, road_geometries, max_distance, power):
+    expected = np.array([calculate_road_risk(road, accident_gdf, max_distance, power) for road in road_geometries])
+    assert np.count_nonzero(expected) > len(expected) // 2
+    # Bit-identical, also when the roads are queried in several chunks
+    for chunk_size in (100000, 64):
+        risk = calculate_risk_layer(road_geometries, accident_gdf, max_distance, power, chunk_size=chunk_size)
+        assert np.array_equal(risk, expected)
+
+
+# Step 3: The process pool (calculate_risk_layer_parallel)
+
+def test_parallel_risk_layer_matches_the_serial_one(accident_gdf, hotspot_gdf, road_geometries):
+    parallel = dict(workers=2, chunk_size=64, max_distance=200)
+    assert np.array_equal(calculate_risk_layer_parallel(road_geometries, accident_gdf, 'centroid', **parallel),
+                          calculate_risk_layer(road_geometries, accident_gdf, 200))
+    score, raw = calculate_risk_layer_parallel(road_geometries, hotspot_gdf, 'line', return_raw=True, **parallel)
+    expected_score, expected_raw = calculate_line_risk_layer(road_geometries, hotspot_gdf, 200)
+    assert np.array_equal(score, expected_score) and np.array_equal(raw, expected_raw)
+    expected = calculate_road_risk_(gpd.GeoDataFrame(geometry=road_geometries), hotspot_gdf, 200)['risk_score']
+    assert np.array_equal(calculate_risk_layer_parallel(road_geometries, hotspot_gdf, 'line-rtree', **parallel),
+                          expected.to_numpy())
+
+
+def test_parallel_risk_layer_rejects_unknown_methods(accident_gdf, road_geometries):
+    with pytest.raises(ValueError):
+        calculate_risk_layer_parallel(road_geometries, accident_gdf, 'nearest', workers=1)
+
+
+# Step 4: Line-to-point risk on coordinate arrays (calculate_line_risk_layer)
+
+def line_risk_reference(road, hotspot_points, max_distance, power):
+    """Mean IDW weight of the hot spots within max_distance of the road, from shapely distances."""
+    distances = shapely.distance(road, hotspot_points)
+    distances = distances[(distances <= max_distance) & (distances > 0)]
+    return float(np.mean(1 / distances ** power)) if len(distances) else 0.0
+
+
+def test_line_risk_matches_shapely_distances(hotspot_gdf, road_geometries):
+    hot = np.asarray(hotspot_gdf.geometry[hotspot_gdf['hotspot'] == 'Hot Spot'], dtype=object)
+    rng = np.random.default_rng(5)
+    # Roads of several segments, with a vertex on a hot spot
+    bends = ORIGIN + np.cumsum(rng.uniform(-150, 150, size=(30, 4, 2)), axis=1) + rng.uniform(0, 3000, size=(30, 1, 2))
+    bends[0, 2] = shapely.get_coordinates(hot[0])[0]
+    geometries = np.concatenate((np.asarray(road_geometries, dtype=object), shapely.linestrings(bends)))
+    for max_distance, power in [(200, 2), (120, 3)]:
+        raw = line_risk_raw(geometries, shapely.get_coordinates(hot), shapely.STRtree(hot), max_distance, power)
+        expected = np.array([line_risk_reference(road, hot, max_distance, power) for road in geometries])
+        assert np.count_nonzero(expected) > len(expected) // 4
+        # Hot spots very close to a road get large weights 1/d**power from distances that
+        # differ in the last bits between the two distance formulas
+        np.testing.assert_allclose(raw, expected, rtol=1e-6, atol=0)
+
+
+def test_line_risk_layer_is_min_max_normalized(hotspot_gdf, road_geometries):
+    score, raw = calculate_line_risk_layer(road_geometries, hotspot_gdf, 200, chunk_size=50)
+    assert np.array_equal(raw, calculate_line_risk_layer(road_geometries, hotspot_gdf, 200)[1])
+    assert score.min() == 0.0 and score.max() == 1.0
+    np.testing.assert_allclose(score, (raw - raw.min()) / (raw.max() - raw.min()))
+    # The old per-road loop, which takes its candidates from buffer bounds instead
+    expected = calculate_road_risk_(gpd.GeoDataFrame(geometry=road_geometries), hotspot_gdf, 200)['risk_score']
+    np.testing.assert_allclose(score, expected.to_numpy(), rtol=1e-9, atol=1e-12)
@@ -0,0 +1,339 @@
+"""
+Asynchronous serving mode: the endpoints of server.py on an ASGI event loop.
+
+    uvicorn asgi_app:app --port 5000
+
+Geocoding (/geocode, /chat) uses an httpx.AsyncClient, so requests waiting on Geoapify
+hold no thread. Route searches (/find_path, /matrix, the route step of /chat) are CPU-bound and
+run on a bounded thread pool through server.find_path_response, so they share the graph, the
+route cache and the reload watcher with the Flask app. Each kind of work has its own limit
+(bounded_executor.py). When a limit is full the request is answered right away with
+503 and a Retry-After header instead of queueing, so a burst of slow geocodes cannot hold
+up route requests and the queue cannot grow without bound.
+
+Environment:
+    ROUTE_WORKERS        Threads running route searches (default: number of CPUs). With
+                         ROUTE_PROCESSES set (routing_pool.py) they hand the searches to
+                         worker processes and only wait for the results.
+    ROUTE_QUEUE          Route searches admitted at once, running or waiting (default: 4 per worker).
+    GEOCODE_CONCURRENCY  Geocoding requests in flight at once (default: 32).
+    BATCH_CONCURRENCY    /find_paths/batch requests streaming at once (default: 2). Each
+                         batch is routed on one route search thread, so it also takes a
+                         ROUTE_QUEUE slot while it runs.
+    TILE_WORKERS         Threads making vector tiles and answering bbox queries of the map
+                         layers (default: 2); up to 16 per thread admitted.
+"""
+import asyncio
+import concurrent.futures
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import httpx
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import server
+from batch_routing import plan_batch, stream_batch
+from bounded_executor import BoundedExecutor, ConcurrencyLimit, Overloaded
+from chatbot import process_chat_message_async
+from geocoding import default_geocoder
+
+ROUTE_WORKERS = int(os.getenv('ROUTE_WORKERS', str(os.cpu_count() or 1)))
+ROUTE_QUEUE = int(os.getenv('ROUTE_QUEUE', str(4 * ROUTE_WORKERS)))
+GEOCODE_CONCURRENCY = int(os.getenv('GEOCODE_CONCURRENCY', '32'))
+TILE_WORKERS = int(os.getenv('TILE_WORKERS', '2'))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '2'))
+# Routed /find_paths/batch lines waiting to be sent, and how long the routing waits for the client
+BATCH_BUFFER_LINES = 16
+BATCH_SEND_TIMEOUT = 60
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+route_executor = BoundedExecutor(ThreadPoolExecutor(max_workers=ROUTE_WORKERS, thread_name_prefix="route"),
+                                 ROUTE_WORKERS, ROUTE_QUEUE, name="route search")
+geocode_limit = ConcurrencyLimit(GEOCODE_CONCURRENCY, name="geocoding")
+batch_limit = ConcurrencyLimit(BATCH_CONCURRENCY, name="batch routing", retry_after=5)
+tile_executor = BoundedExecutor(ThreadPoolExecutor(max_workers=TILE_WORKERS, thread_name_prefix="tile"),
+                                TILE_WORKERS, 16 * TILE_WORKERS, name="map layers")
+# Created in lifespan(); one connection pool to Geoapify for all requests
+http_client = None
+
+
+def overloaded_response(e):
+    return JSONResponse({"error": f"Server busy: {e}"}, status_code=503,
+                        headers={"Retry-After": str(e.retry_after)})
+
+
+# Step 1: Route searches, run on the route executor threads
+
+def find_path_flask(data):
+    """
+    server.find_path_response(data) as (status, body, headers), or None if no route was found.
+    Runs in a worker thread, so it pushes its own Flask app context for jsonify.
+    """
+    with server.app.app_context():
+        result = server.find_path_response(data)
+        if result is None:
+            return None
+        response = server.app.make_response(result)
+        headers = {name: value for name, value in response.headers.items()
+                   if name in ('Content-Type', 'X-Route-Cache')}
+        return response.status_code, response.get_data(), headers
+
+
+def matrix_flask(data):
+    """server.matrix_response(data) as (status, body); a worker thread, like find_path_flask."""
+    with server.app.app_context():
+        response = server.app.make_response(server.matrix_response(data))
+        return response.status_code, response.get_data()
+
+
+def route_flask(start_coords, end_coords):
+    with server.app.app_context():
+        return server.route_in_process(start_coords, end_coords)
+
+
+def batch_lines(lines, queue, loop, stopped):
+    """
+    Route a batch (batch_routing.stream_batch lines) and pass each line to the event loop
+    through the bounded asyncio queue, so a slow client slows the routing down. Stops when
+    stopped is set (the response ended) or the client takes no line for BATCH_SEND_TIMEOUT s.
+    """
+    try:
+        for line in lines:
+            if stopped.is_set():
+                break
+            asyncio.run_coroutine_threadsafe(queue.put(line), loop).result(timeout=BATCH_SEND_TIMEOUT)
+    except concurrent.futures.TimeoutError:
+        print("Batch client stopped reading; routing abandoned")
+    finally:
+        lines.close()
+        loop.call_soon_threadsafe(queue.put_nowait, None)
+
+
+# Step 2: Endpoints
+
+async def index(request):
+    return PlainTextResponse("Backend is running!")
+
+
+async def status(request):
+    return JSONResponse(dict(server.graph_store.status(), route_cache=server.route_cache.stats(),
+                             geocoder=default_geocoder().stats(), route_executor=route_executor.stats(),
+                             geocode_limit=geocode_limit.stats(), batch_limit=batch_limit.stats(), map_layers=server.map_layers.stats(),
+                             tile_executor=tile_executor.stats()))
+
+
+async def get_config(request):
+    return JSONResponse({
+        "mapboxAccessToken": os.getenv('MAPBOX_ACCESS_TOKEN'),
+        "geoapifyApiKey": os.getenv('GEOAPIFY_API_KEY')
+    })
+
+
+async def geocode(request):
+    geoapify_api_key = os.getenv('GEOAPIFY_API_KEY')
+    geocoder = default_geocoder()
+    if not geoapify_api_key and not geocoder.can_answer_offline():
+        return JSONResponse({"error": "Geoapify API key not configured"}, status_code=500)
+    data = await request.json()
+    try:
+        async with geocode_limit.slot():
+            return JSONResponse(await geocoder.search_async(data['location'], http_client, geoapify_api_key))
+    except Overloaded as e:
+        return overloaded_response(e)
+    except httpx.HTTPError as e:
+        return JSONResponse({"error": f"Geocoding failed: {str(e)}"}, status_code=500)
+
+
+async def find_path(request):
+    data = await request.json()
+    try:
+        result = await route_executor.run(find_path_flask, data)
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        print(f"Error in find_path endpoint: {str(e)}")
+        return JSONResponse({"error": f"Unexpected error: {str(e)}"}, status_code=500)
+    if result is None:
+        return JSONResponse({"error": "No path found"}, status_code=500)
+    status_code, body, headers = result
+    return Response(body, status_code=status_code, headers=headers)
+
+
+async def matrix(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    try:
+        status_code, body = await route_executor.run(matrix_flask, data)
+    except Overloaded as e:
+        return overloaded_response(e)
+    return Response(body, status_code=status_code, media_type='application/json')
+
+
+async def find_paths_batch(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    try:
+        slot = batch_limit.slot()
+    except Overloaded as e:
+        return overloaded_response(e)
+    graph = server.graph_store.snapshot
+    try:
+        plan = plan_batch(graph, data, server.CALGARY_BOUNDS, server.BATCH_MAX_PAIRS)
+    except ValueError as e:
+        slot.release()
+        return JSONResponse({"error": f"Invalid batch: {str(e)}"}, status_code=400)
+    except BaseException:
+        slot.release()
+        raise
+    lines = stream_batch(graph, plan, server.route_cache, server.routing_pool, server.ALPHA, server.BETA)
+    # The routing takes a route executor slot like any route search, and the batch slot is
+    # held until it is done, whether or not the client read every line
+    queue = asyncio.Queue(maxsize=BATCH_BUFFER_LINES)
+    stopped = threading.Event()
+    try:
+        routing = route_executor.submit(batch_lines, lines, queue, asyncio.get_running_loop(), stopped)
+    except Overloaded as e:
+        slot.release()
+        return overloaded_response(e)
+
+    def routed(future):
+        slot.release()
+        if not future.cancelled() and future.exception() is not None:
+            print(f"Batch routing failed: {future.exception()!r}")
+    routing.add_done_callback(routed)
+
+    async def stream():
+        try:
+            while (line := await queue.get()) is not None:
+                yield line
+        finally:
+            stopped.set()
+            # Unblock a put waiting for room, so the routing thread sees stopped
+            while not queue.empty():
+                queue.get_nowait()
+    return StreamingResponse(stream(), media_type='application/x-ndjson',
+                             headers={'X-Pair-Count': str(len(plan['ids']))})
+
+
+async def chat(request):
+    try:
+        data = await request.json()
+        user_input = data.get('message', '')
+        if not user_input:
+            return JSONResponse({"error": "No message provided"}, status_code=400)
+
+        geoapify_api_key = os.getenv('GEOAPIFY_API_KEY')
+        geocoder = default_geocoder()
+        if not geoapify_api_key and not geocoder.can_answer_offline():
+            return JSONResponse({"error": "Geoapify API key not configured"}, status_code=500)
+
+        async def locate(location):
+            async with geocode_limit.slot():
+                return await geocoder.locate_async(location, http_client, geoapify_api_key)
+
+        async def route(start_coords, end_coords):
+            return await route_executor.run(route_flask, start_coords, end_coords)
+
+        return JSONResponse(await process_chat_message_async(user_input, locate, route))
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        print(f"Error in chat endpoint: {str(e)}")
+        return JSONResponse({"error": f"Unexpected error: {str(e)}"}, status_code=500)
+
+
+async def tile(request):
+    layer, z, x, y = (request.path_params[k] for k in ('layer', 'z', 'x', 'y'))
+    if not server.map_layers.valid(layer, z, x, y):
+        return JSONResponse({"error": f"No tile {layer}/{z}/{x}/{y}"}, status_code=404)
+    try:
+        data = await tile_executor.run(server.map_layers.tile, layer, z, x, y)
+    except Overloaded as e:
+        return overloaded_response(e)
+    except FileNotFoundError:
+        return JSONResponse({"error": f"Layer {layer} is not available"}, status_code=404)
+    return Response(data, media_type='application/vnd.mapbox-vector-tile', headers={'Cache-Control': 'max-age=300'})
+
+
+def static_layer(request, filename):
+    """A layer file in the best encoding the client accepts, or 304 (see server.send_static_layer)."""
+    try:
+        status, file, headers = server.static_layers.negotiate(os.path.join(STATIC_DIR, filename),
+                                                               request.headers.get('Accept-Encoding'),
+                                                               request.headers.get('If-None-Match'))
+    except FileNotFoundError:
+        return JSONResponse({"error": f"{filename} is not available"}, status_code=404)
+    if status == 304:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(file, media_type='application/geo+json', headers=headers)
+
+
+def map_layer(name):
+    """The layer file, or with bbox/zoom parameters the features in view (see server.serve_layer)."""
+    async def serve(request):
+        params = request.query_params
+        if 'bbox' not in params and 'zoom' not in params:
+            return static_layer(request, server.map_layers.specs[name]['file'])
+        try:
+            bbox, zoom = server.parse_viewport(params)
+        except ValueError as e:
+            return JSONResponse({"error": f"Invalid bbox or zoom: {str(e)}"}, status_code=400)
+        try:
+            count, chunks = await tile_executor.run(server.map_layers.query, name, bbox, zoom)
+        except Overloaded as e:
+            return overloaded_response(e)
+        except FileNotFoundError:
+            return JSONResponse({"error": f"Layer {name} is not available"}, status_code=404)
+        # Starlette encodes the remaining chunks in a worker thread as the client reads them
+        return StreamingResponse(chunks, media_type='application/json', headers={'X-Feature-Count': str(count)})
+    return serve
+
+
+def static_file(name):
+    async def serve(request):
+        return FileResponse(os.path.join(STATIC_DIR, name))
+    return serve
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global http_client
+    http_client = httpx.AsyncClient(limits=httpx.Limits(max_connections=GEOCODE_CONCURRENCY))
+    try:
+        yield
+    finally:
+        await http_client.aclose()
+        route_executor.executor.shutdown(wait=False)
+        tile_executor.executor.shutdown(wait=False)
+
+
+app = Starlette(
+    routes=[
+        Route('/', index),
+        Route('/status', status, methods=['GET']),
+        Route('/config', get_config, methods=['GET']),
+        Route('/geocode', geocode, methods=['POST']),
+        Route('/find_path', find_path, methods=['POST']),
+        Route('/find_paths/batch', find_paths_batch, methods=['POST']),
+        Route('/matrix', matrix, methods=['POST']),
+        Route('/chat', chat, methods=['POST']),
+        Route('/road_segments', map_layer('road_segments')),
+        Route('/accidents', map_layer('accidents')),
+        Route('/tiles/{layer}/{z:int}/{x:int}/{y:int}.pbf', tile),
+        Route('/config.js', static_file('config.js')),
+        Route('/chatbot.js', static_file('chatbot.js')),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=["http://localhost:8000"], allow_methods=["*"],
+                           allow_headers=["*"])],
+    lifespan=lifespan,
+)
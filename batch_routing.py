@@ -0,0 +1,180 @@
+"""
+Routes for many origin-destination pairs in one request: POST /find_paths/batch.
+
+Calling /find_path once per pair repeats its per-request work for every pair. A batch
+    1. snaps all start and end points with one vectorized projection and one KD-tree query;
+    2. groups the pairs by time bucket and start node. Routes from one origin in one bucket
+       share a search: on the CSR backend one shortest path tree answers every destination
+       of the group (routing_pool.route_group), also when there is only one. Every pair thus
+       gets the exact least-cost route under the /find_path cost, whatever else is in the
+       batch. It can differ from, and be cheaper than, /find_path's Euclidean A* route for the
+       same pair, so a batch is not a shortcut for repeated /find_path calls. On the other backends
+       (ch, networkx) each destination is searched as /find_path searches it, and the /find_path
+       route cache is shared;
+    3. routes the groups in the routing pool's worker processes when there is one
+       (ROUTE_PROCESSES), else one group after another;
+    4. streams one NDJSON line per pair as its group finishes, in completion order:
+           {"index":0,"id":"truck-1","route":{...GeoJSON in the /find_path format...}}
+           {"index":1,"error":"No path found"}
+"""
+import json
+import time
+from concurrent.futures import as_completed
+from datetime import datetime
+
+import numpy as np
+from dateutil.parser import parse as parse_datetime
+
+from find_path import risk_time_bucket
+from route_geojson import get_transformer
+from routing_pool import route_group, uses_tree
+
+
+def parse_pairs(data, max_pairs):
+    """
+    (start points, end points, times, ids) of a batch request body, the points as (n, 2)
+    lat/lon arrays. Each pair's time is its own 'time', else the batch's, else now.
+    Raises ValueError if the body is malformed or has more than max_pairs pairs.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("the body must be a JSON object with 'pairs'")
+    pairs = data.get('pairs')
+    if not isinstance(pairs, list) or not pairs:
+        raise ValueError("'pairs' must be a non-empty list")
+    if len(pairs) > max_pairs:
+        raise ValueError(f"at most {max_pairs} pairs per batch")
+    default_time = data.get('time')
+    default_time = parse_datetime(default_time) if default_time else datetime.now()
+    starts, ends, times, ids = [], [], [], []
+    for i, pair in enumerate(pairs):
+        try:
+            start_lat, start_lon = (float(v) for v in pair['start'])
+            end_lat, end_lon = (float(v) for v in pair['end'])
+            times.append(parse_datetime(pair['time']) if pair.get('time') else default_time)
+        except (KeyError, TypeError, ValueError, OverflowError) as e:
+            raise ValueError(f"pair {i}: {e!r}")
+        starts.append((start_lat, start_lon))
+        ends.append((end_lat, end_lon))
+        ids.append(pair.get('id'))
+    return np.array(starts), np.array(ends), times, ids
+
+
+def snap_points(graph, points):
+    """Nearest graph nodes of an (n, 2) array of lat/lon points, in one query."""
+    transformer = get_transformer("EPSG:4326", "EPSG:32611")
+    x, y = transformer.transform(points[:, 1], points[:, 0])
+    node_ids, _ = graph.node_index.nearest_many(np.column_stack((x, y)))
+    return node_ids.tolist()
+
+
+def in_bounds(points, bounds):
+    """Boolean mask of the lat/lon points inside bounds (min_lat, max_lat, min_lon, max_lon keys)."""
+    return ((bounds['min_lat'] <= points[:, 0]) & (points[:, 0] <= bounds['max_lat']) &
+            (bounds['min_lon'] <= points[:, 1]) & (points[:, 1] <= bounds['max_lon']))
+
+
+def plan_batch(graph, data, bounds, max_pairs):
+    """
+    Snap and group the pairs of a batch request body on a GraphSnapshot.
+    Returns {'ids': ids, 'errors': [(index, message)],
+             'groups': {(time bucket, start node): {'time': time, 'pairs': [(index, end node)]}}}.
+    Raises ValueError if the body is malformed (see parse_pairs).
+    """
+    starts, ends, times, ids = parse_pairs(data, max_pairs)
+    errors = []
+    start_ok, end_ok = in_bounds(starts, bounds), in_bounds(ends, bounds)
+    for i in np.flatnonzero(~start_ok).tolist():
+        errors.append((i, "Start point is outside Calgary bounds"))
+    for i in np.flatnonzero(start_ok & ~end_ok).tolist():
+        errors.append((i, "End point is outside Calgary bounds"))
+    valid = np.flatnonzero(start_ok & end_ok)
+    start_nodes = snap_points(graph, starts[valid]) if len(valid) else []
+    end_nodes = snap_points(graph, ends[valid]) if len(valid) else []
+    groups = {}
+    for i, start_node, end_node in zip(valid.tolist(), start_nodes, end_nodes):
+        group = groups.setdefault((risk_time_bucket(times[i]), start_node), {'time': times[i], 'pairs': []})
+        group['pairs'].append((i, end_node))
+    return {'ids': ids, 'errors': errors, 'groups': groups}
+
+
+def result_line(index, pair_id, body=None, error=None):
+    """One NDJSON line; body is an encoded route, spliced in without decoding it."""
+    head = {"index": index}
+    if pair_id is not None:
+        head["id"] = pair_id
+    if body is None:
+        head["error"] = error
+        return json.dumps(head, separators=(",", ":")).encode() + b"\n"
+    return json.dumps(head, separators=(",", ":")).encode()[:-1] + b',"route":' + body.rstrip(b"\n") + b"}\n"
+
+
+def stream_batch(graph, plan, route_cache, routing_pool, alpha, beta):
+    """
+    NDJSON lines answering a plan_batch() plan, yielded as each route group finishes.
+    - route_cache: route_cache.RouteCache shared with /find_path, used when routes are searched
+      as /find_path searches them (not uses_tree()).
+    - routing_pool: routing_pool.RoutingPool to route the groups in, or None.
+    """
+    started = time.perf_counter()
+    ids = plan['ids']
+    cache_hits = 0
+    for index, message in plan['errors']:
+        yield result_line(index, ids[index], error=message)
+
+    # Tree routes are not the routes /find_path searches, so they neither use nor fill its cache
+    cacheable = not uses_tree(graph)
+    # Per group, its destinations still to route, each with the pairs that asked for it
+    work = []
+    for (bucket, start_node), group in plan['groups'].items():
+        destinations = {}
+        for index, end_node in group['pairs']:
+            destinations.setdefault(end_node, []).append(index)
+        if cacheable:
+            for end_node, indexes in list(destinations.items()):
+                body = route_cache.get((graph.generation, start_node, end_node, bucket, alpha, beta))
+                if body is not None:
+                    cache_hits += len(indexes)
+                    del destinations[end_node]
+                    for index in indexes:
+                        yield result_line(index, ids[index], body)
+        if destinations:
+            work.append((bucket, start_node, group['time'], destinations))
+
+    def answer(bucket, start_node, destinations, routes):
+        for (end_node, indexes), route in zip(destinations.items(), routes):
+            if route is not None and cacheable:
+                route_cache.put((graph.generation, start_node, end_node, bucket, alpha, beta), route[1])
+            for index in indexes:
+                if route is None:
+                    yield result_line(index, ids[index], error="No path found")
+                else:
+                    yield result_line(index, ids[index], route[1])
+
+    def failed(destinations, e):
+        print(f"Batch route group failed: {str(e)}")
+        for indexes in destinations.values():
+            for index in indexes:
+                yield result_line(index, ids[index], error=f"Unexpected error: {str(e)}")
+
+    if routing_pool is not None and routing_pool.generation == graph.generation:
+        futures = {routing_pool.submit_route_group(start_node, list(destinations), current_time, alpha, beta):
+                   (bucket, start_node, destinations) for bucket, start_node, current_time, destinations in work}
+        for future in as_completed(futures):
+            bucket, start_node, destinations = futures[future]
+            try:
+                routes = future.result()
+            except Exception as e:
+                yield from failed(destinations, e)
+                continue
+            yield from answer(bucket, start_node, destinations, routes)
+    else:
+        for bucket, start_node, current_time, destinations in work:
+            try:
+                routes = route_group(graph, start_node, list(destinations), current_time, alpha, beta)
+            except Exception as e:
+                yield from failed(destinations, e)
+                continue
+            yield from answer(bucket, start_node, destinations, routes)
+
+    print(f"Batch: {len(ids)} pairs, {len(plan['groups'])} origin groups, {cache_hits} cached, "
+          f"{(time.perf_counter() - started) * 1000:.0f} ms")
@@ -0,0 +1,512 @@
+"""
+Micro-benchmarks for the routing backend.
+
+Usage:
+    python benchmarks.py snapping [--graph road_network_processed.pkl] [--queries 200]
+    python benchmarks.py edge-snapping
+    python benchmarks.py csr [--queries 50]
+    python benchmarks.py ch [--grid 100]
+    python benchmarks.py alt
+    python benchmarks.py startup
+    python benchmarks.py geojson
+    python benchmarks.py route-cache
+    python benchmarks.py routing-pool [--processes 8]
+    python benchmarks.py cost-matrix [--queries 20]
+
+Without --graph (or if the pickle is missing) a synthetic grid graph with the same
+node/edge attributes as convert_shp_to_graph.py is used, so the numbers can be
+reproduced without the Calgary data.
+"""
+import argparse
+import os
+import json
+import pickle
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import geopandas as gpd
+import networkx as nx
+import numpy as np
+import pandas as pd
+from shapely.geometry import LineString
+
+import csr_graph
+from cost_matrix import cost_matrices, edge_values
+from contraction_hierarchy import CHQuery, build_hierarchy
+from graph_artifact import write_graph_artifact
+from landmarks import Landmarks
+from csr_graph import CSRGraph
+from find_path import find_nearest_node, astar_path
+from risk_profiles import RiskProfiles
+from graph_store import GraphStore
+from route_cache import RouteCache
+from routing_pool import RoutingPool, encode_route, route_geojson, search_path
+from route_geojson import RouteSerializer
+from spatial_index import NodeIndex, EdgeIndex
+
+DEFAULT_GRAPH = os.path.join(os.path.dirname(__file__), "road_network_processed.pkl")
+RISK_CATEGORIES = ['Very Low', 'Low', 'Medium', 'High', 'Very High']
+
+
+def synthetic_graph(rows=200, cols=200, spacing=100.0, seed=0):
+    """
+    Build a jittered grid road graph around downtown Calgary (EPSG:32611).
+    Every grid row and column is one two-way "road" whose edges share a geometry,
+    mirroring how convert_shp_to_graph.add_road_to_graph builds the real graph.
+    """
+    rng = np.random.default_rng(seed)
+    origin_x, origin_y = 700000.0, 5650000.0
+    xs = origin_x + np.arange(cols) * spacing
+    ys = origin_y + np.arange(rows) * spacing
+    pos = {}
+    G = nx.DiGraph()
+    G.graph['crs'] = 'epsg:32611'
+    for r in range(rows):
+        for c in range(cols):
+            n = r * cols + c
+            pos[n] = (float(xs[c] + rng.uniform(-20, 20)), float(ys[r] + rng.uniform(-20, 20)))
+            G.add_node(n, pos=pos[n])
+
+    def add_road(nodes, road_id, name):
+        geometry = LineString([pos[n] for n in nodes])
+        for u, v in zip(nodes[:-1], nodes[1:]):
+            length = float(np.sqrt((pos[u][0] - pos[v][0]) ** 2 + (pos[u][1] - pos[v][1]) ** 2))
+            risk = float(rng.exponential(0.2))
+            category = RISK_CATEGORIES[min(int(risk * 10), 4)]
+            for a, b in ((u, v), (v, u)):
+                G.add_edge(a, b, name=name, risk_score=risk, risk_category=category,
+                           length=length, road_id=road_id, maxspeed=None, oneway=None,
+                           geometry=geometry)
+
+    road_id = 0
+    for r in range(rows):
+        add_road([r * cols + c for c in range(cols)], road_id, f"{r} Avenue SW")
+        road_id += 1
+    for c in range(cols):
+        add_road([r * cols + c for r in range(rows)], road_id, f"{c} Street SW")
+        road_id += 1
+    return G
+
+
+def load_graph(path, grid=200):
+    if path and os.path.exists(path):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    print(f"{path} not found, using a synthetic {grid}x{grid} grid graph")
+    return synthetic_graph(grid, grid)
+
+
+def random_points(G, count, seed=1):
+    """Random query points inside the bounding box of the graph."""
+    coords = np.array([d['pos'] for _, d in G.nodes(data=True)], dtype=float)
+    rng = np.random.default_rng(seed)
+    lo, hi = coords.min(axis=0), coords.max(axis=0)
+    return rng.uniform(lo, hi, size=(count, 2))
+
+
+def timed(fn, *args, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(*args)
+    return (time.perf_counter() - start) / repeat, result
+
+
+def bench_snapping(G, queries):
+    points = random_points(G, queries)
+    print(f"Graph: {G.number_of_nodes()} nodes, {G.number_of_edges()} edges; {queries} queries")
+
+    build_time, index = timed(NodeIndex.from_graph, G)
+    print(f"NodeIndex build:          {build_time * 1000:10.2f} ms (once per graph load)")
+
+    linear_points = points[:min(queries, 20)]
+    linear_time, linear = timed(lambda: [find_nearest_node(G, p) for p in linear_points])
+    per_linear = linear_time / len(linear_points)
+    print(f"Linear scan:              {per_linear * 1e6:10.1f} us/query")
+
+    indexed_time, indexed = timed(lambda: [find_nearest_node(G, p, index=index) for p in points])
+    per_indexed = indexed_time / len(points)
+    print(f"NodeIndex.nearest:        {per_indexed * 1e6:10.1f} us/query")
+
+    batch_time, (batch, _) = timed(index.nearest_many, points, repeat=10)
+    per_batch = batch_time / len(points)
+    print(f"NodeIndex.nearest_many:   {per_batch * 1e6:10.1f} us/query")
+
+    print(f"Speedup (single/batch):   {per_linear / per_indexed:10.0f}x / {per_linear / per_batch:.0f}x")
+    assert list(linear) == list(indexed[:len(linear)]) == batch[:len(linear)].tolist(), \
+        "indexed snapping disagrees with the linear scan"
+
+
+def bench_edge_snapping(G, queries):
+    points = random_points(G, queries)
+    print(f"Graph: {G.number_of_nodes()} nodes, {G.number_of_edges()} edges; {queries} queries")
+
+    build_time, index = timed(EdgeIndex.from_graph, G)
+    print(f"EdgeIndex build:          {build_time * 1000:10.2f} ms (once per graph load)")
+
+    snap_time, snaps = timed(lambda: [index.snap(p) for p in points])
+    print(f"EdgeIndex.snap:           {snap_time / len(points) * 1e6:10.1f} us/query")
+    print(f"Mean snap distance:       {np.mean([s.distance for s in snaps]):10.2f} m")
+
+
+def networkx_nbytes(G):
+    """
+    Approximate memory of a networkx DiGraph's dict-of-dicts: adjacency dicts, edge and
+    node attribute dicts and their scalar values. Shapely geometries are not counted.
+    """
+    total = sys.getsizeof(G._adj) + sys.getsizeof(G._node)
+    for n, nbrs in G._adj.items():
+        total += sys.getsizeof(nbrs) + sys.getsizeof(G._node[n]) + sys.getsizeof(G._node[n]['pos'])
+        for data in nbrs.values():
+            total += sys.getsizeof(data)
+            total += sum(sys.getsizeof(v) for k, v in data.items() if k != 'geometry')
+    return total
+
+
+def random_node_pairs(G, count, seed=2):
+    rng = np.random.default_rng(seed)
+    nodes = np.array(list(G.nodes))
+    return rng.choice(nodes, size=(count, 2)).tolist()
+
+
+def bench_csr(G, queries):
+    current_time = datetime(2025, 3, 26, 17, 0)
+    print(f"Graph: {G.number_of_nodes()} nodes, {G.number_of_edges()} edges; {queries} queries")
+
+    build_time, graph = timed(CSRGraph.from_networkx, G)
+    graph._adjacency()
+    print(f"CSRGraph build:           {build_time * 1000:10.2f} ms (once per graph load)")
+    nx_bytes = networkx_nbytes(G)
+    print(f"networkx bytes/edge:      {nx_bytes / G.number_of_edges():10.1f} (excluding geometries)")
+    print(f"CSR bytes/edge:           {graph.nbytes / graph.number_of_edges:10.1f}")
+
+    pairs = random_node_pairs(G, queries)
+    nx_time, nx_paths = timed(lambda: [astar_path(G, a, b, current_time, alpha=0.1, beta=0.9)
+                                       for a, b in pairs])
+    csr_time, csr_paths = timed(lambda: [csr_graph.astar_path(graph, a, b, current_time, alpha=0.1, beta=0.9)
+                                         for a, b in pairs])
+    profiles_time, profiles = timed(RiskProfiles, graph, 0.1, 0.9)
+    print(f"RiskProfiles build:       {profiles_time * 1000:10.2f} ms for 8 time buckets")
+    warm_time, warm_paths = timed(lambda: [csr_graph.astar_path(graph, a, b, current_time,
+                                                                cost=profiles.costs(current_time))
+                                           for a, b in pairs])
+    print(f"networkx astar_path:      {nx_time / queries * 1000:10.3f} ms/query")
+    print(f"CSR astar_path:           {csr_time / queries * 1000:10.3f} ms/query")
+    print(f"CSR + RiskProfiles:       {warm_time / queries * 1000:10.3f} ms/query")
+    assert nx_paths == csr_paths == warm_paths, "CSR backend returned different paths"
+
+
+def bench_ch(G, queries):
+    current_time = datetime(2025, 3, 26, 17, 0)
+    print(f"Graph: {G.number_of_nodes()} nodes, {G.number_of_edges()} edges; {queries} queries")
+    graph = CSRGraph.from_networkx(G)
+    profiles = RiskProfiles(graph, alpha=0.1, beta=0.9)
+    cost = profiles.costs(current_time)
+
+    build_time, hierarchy = timed(build_hierarchy, graph, cost)
+    print(f"CH build (one bucket):    {build_time:10.2f} s, {hierarchy.number_of_shortcuts} shortcuts "
+          f"for {graph.number_of_edges} edges")
+    engine = CHQuery(hierarchy)
+
+    pairs = [(graph.index_of(a), graph.index_of(b)) for a, b in random_node_pairs(G, queries)]
+    astar_time, _ = timed(lambda: [csr_graph.astar(graph, a, b, cost) for a, b in pairs])
+    dijkstra_time, dijkstra_paths = timed(lambda: [csr_graph.dijkstra(graph, a, b, cost) for a, b in pairs])
+    ch_time, ch_results = timed(lambda: [engine.shortest_path(a, b) for a, b in pairs])
+    print(f"CSR A* (Euclidean):       {astar_time / queries * 1000:10.3f} ms/query")
+    print(f"CSR Dijkstra:             {dijkstra_time / queries * 1000:10.3f} ms/query")
+    print(f"CH query + unpacking:     {ch_time / queries * 1000:10.3f} ms/query")
+
+    cost = np.frombuffer(cost, dtype=np.float64)
+    for path, (ch_cost, ch_path) in zip(dijkstra_paths, ch_results):
+        if path is None:
+            assert ch_path is None
+            continue
+        expected = cost[graph.edge_ids(path)].sum()
+        assert np.isclose(cost[graph.edge_ids(ch_path)].sum(), expected) and np.isclose(ch_cost, expected), \
+            "CH path is not a shortest path"
+
+
+def bench_alt(G, queries):
+    current_time = datetime(2025, 3, 26, 17, 0)
+    print(f"Graph: {G.number_of_nodes()} nodes, {G.number_of_edges()} edges; {queries} queries")
+    graph = CSRGraph.from_networkx(G)
+    graph._adjacency()
+    cost = RiskProfiles(graph, alpha=0.1, beta=0.9).costs(current_time)
+
+    build_time, landmarks = timed(Landmarks.build, graph, 0.1, 0.9)
+    size = landmarks.from_landmark.nbytes + landmarks.to_landmark.nbytes
+    print(f"Landmarks build:          {build_time:10.2f} s, {len(landmarks.landmarks)} landmarks, "
+          f"{size / 1e6:.1f} MB of tables")
+
+    pairs = [(graph.index_of(a), graph.index_of(b)) for a, b in random_node_pairs(G, queries)]
+    cost_array = np.frombuffer(cost, dtype=np.float64)
+    reference = None
+    for label, heuristic in (("Dijkstra", lambda a, b: False), ("Euclidean A*", lambda a, b: True),
+                             ("ALT A*, all landmarks", lambda a, b: landmarks.lower_bound),
+                             ("ALT A*, 4 active", landmarks.search_heuristic)):
+        settled = []
+        totals = []
+
+        def run():
+            for a, b in pairs:
+                stats = {}
+                path = csr_graph.astar(graph, a, b, cost, heuristic=heuristic(a, b), stats=stats)
+                settled.append(stats['settled'])
+                totals.append(cost_array[graph.edge_ids(path)].sum() if path else np.inf)
+
+        elapsed, _ = timed(run)
+        print(f"{label + ':':26}{elapsed / queries * 1000:10.3f} ms/query, "
+              f"{np.mean(settled):10.0f} settled nodes/query, route cost {np.mean(totals):.1f}")
+        if reference is None:
+            reference = totals
+        elif label != "Euclidean A*":
+            assert np.allclose(totals, reference), "ALT returned a route costlier than Dijkstra"
+
+
+# Loads the graph the way a routing worker does, answers one route, and reports load time
+# and memory after the imports, after loading and after that first route
+STARTUP_SCRIPT = """
+import json, sys, time
+from datetime import datetime
+from graph_store import load_snapshot
+from routing_pool import route_geojson, search_path
+
+def memory():
+    status = dict(line.split(':', 1) for line in open('/proc/self/status'))
+    kb = lambda key: int(status.get(key, '0 kB').split()[0])
+    return {'rss': kb('VmRSS'), 'anon': kb('RssAnon'), 'file': kb('RssFile')}
+
+imported = memory()
+start = time.perf_counter()
+if sys.argv[1] == 'pickle':
+    graph = load_snapshot('', sys.argv[2])
+else:
+    graph = load_snapshot(sys.argv[2], None)
+elapsed = time.perf_counter() - start
+loaded = memory()
+nodes = graph.csr.node_ids
+path = search_path(graph, nodes[0].item(), nodes[-1].item(), datetime(2025, 3, 26, 17, 0), 0.1, 0.9)
+route_geojson(graph, path, datetime(2025, 3, 26, 17, 0))
+print(json.dumps({'seconds': elapsed, 'imported': imported, 'loaded': loaded, 'queried': memory()}))
+"""
+
+
+def bench_startup(G):
+    """
+    Start-up time and resident memory of a fresh worker process, loading the pickle
+    versus the memory-mapped graph artifact, and after its first route. RssFile pages are
+    page cache shared by every worker; RssAnon is what each additional worker costs, and its
+    growth past the imports is the worker's private copy of the graph indexes.
+    """
+    print(f"Graph: {G.number_of_nodes()} nodes, {G.number_of_edges()} edges")
+    with tempfile.TemporaryDirectory() as tmp:
+        pickle_path = os.path.join(tmp, "road_network_processed.pkl")
+        with open(pickle_path, "wb") as f:
+            pickle.dump(G, f)
+        artifact_path = os.path.join(tmp, "road_network_graph")
+        write_graph_artifact(G, artifact_path)
+        print(f"Pickle size:              {os.path.getsize(pickle_path) / 1e6:10.1f} MB")
+        size = sum(os.path.getsize(os.path.join(artifact_path, n)) for n in os.listdir(artifact_path))
+        print(f"Artifact size:            {size / 1e6:10.1f} MB")
+
+        here = os.path.dirname(os.path.abspath(__file__))
+        for label, mode, path in (("pickle", "pickle", pickle_path), ("artifact", "artifact", artifact_path)):
+            out = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT, mode, path], cwd=here,
+                                 capture_output=True, text=True, check=True).stdout
+            r = json.loads(out.splitlines()[-1])
+            print(f"{label + ' start-up:':26}{r['seconds'] * 1000:10.1f} ms")
+            for when, stage in (("imported", "imports"), ("loaded", "loading"), ("queried", "first route")):
+                m = r[when]
+                print(f"{'  after ' + stage + ':':26}"
+                      f"RSS {m['rss'] / 1024:8.1f} MB (private {m['anon'] / 1024:.1f} MB, "
+                      f"file-backed {m['file'] / 1024:.1f} MB)")
+
+
+def geodataframe_feature_collection(route_edge_data, total_risk):
+    """The route GeoJSON as /find_path built it before route_geojson, for comparison."""
+    route_gdf = gpd.GeoDataFrame(route_edge_data, geometry=[d["geometry"] for d in route_edge_data],
+                                 crs='epsg:32611')
+    route_gdf_4326 = route_gdf.to_crs('epsg:4326')
+    total_length = sum(d["length"] for d in route_edge_data)
+    risk_category_counts = {}
+    for d in route_edge_data:
+        risk_category_counts[d["risk_category"]] = risk_category_counts.get(d["risk_category"], 0) + 1
+    total_travel_time = 0
+    features = []
+    for idx, row in route_gdf_4326.iterrows():
+        road_name = row.get('name', None)
+        if isinstance(road_name, list):
+            road_name = road_name[0] if road_name else 'Unnamed Road'
+        if pd.isna(road_name):
+            road_name = row.get('ref', None)
+        if pd.isna(road_name):
+            road_name = row.get('highway', 'Unnamed Road').capitalize()
+        length = row.get('length', 0)
+        edge_travel_time = length / 13.89 if length else 0
+        total_travel_time += edge_travel_time
+        features.append({"type": "Feature", "geometry": row.geometry.__geo_interface__,
+                         "properties": {"osmid": row.get('road_id', None), "name": road_name,
+                                        "length": row.get('length', None), "travel_time": edge_travel_time,
+                                        "total_risk": row.get('total_risk', None),
+                                        "risk_category": row.get('risk_categ', None)}})
+    return {"type": "FeatureCollection", "features": features,
+            "properties": {"total_length": total_length, "total_travel_time": total_travel_time,
+                           "total_risk": total_risk, "risk_category_counts": risk_category_counts}}
+
+
+def bench_geojson(G, queries):
+    current_time = datetime(2025, 3, 26, 17, 0)
+    print(f"Graph: {G.number_of_nodes()} nodes, {G.number_of_edges()} edges; {queries} routes")
+    build_time, serializer = timed(RouteSerializer.from_graph, G)
+    print(f"RouteSerializer build:    {build_time * 1000:10.2f} ms (once per graph load)")
+
+    graph = CSRGraph.from_networkx(G)
+    cost = RiskProfiles(graph, alpha=0.1, beta=0.9).costs(current_time)
+    routes = []
+    for a, b in random_node_pairs(G, queries):
+        path = csr_graph.astar_path(graph, a, b, current_time, cost=cost)
+        if path and len(path) > 1:
+            routes.append([G[u][v] for u, v in zip(path[:-1], path[1:])])
+    edges = sum(len(r) for r in routes)
+    print(f"Mean route length:        {edges / len(routes):10.0f} edges")
+
+    old_time, old = timed(lambda: [geodataframe_feature_collection(r, 1.0) for r in routes])
+    new_time, new = timed(lambda: [serializer.feature_collection(r, 1.0) for r in routes])
+    print(f"GeoDataFrame + iterrows:  {old_time / len(routes) * 1000:10.3f} ms/route")
+    print(f"RouteSerializer:          {new_time / len(routes) * 1000:10.3f} ms/route")
+    print(f"Speedup:                  {old_time / new_time:10.1f}x")
+    assert json.dumps(old) == json.dumps(new), "serialized routes differ"
+
+
+def bench_route_cache(G, queries):
+    """
+    A /find_path route computed and encoded (A* + GeoJSON + JSON) versus served from
+    RouteCache, as server.py does for repeated node-snapped requests.
+    """
+    current_time = datetime(2025, 3, 26, 17, 0)
+    print(f"Graph: {G.number_of_nodes()} nodes, {G.number_of_edges()} edges; {queries} routes")
+    graph = CSRGraph.from_networkx(G)
+    serializer = RouteSerializer.from_graph(G)
+    profiles = RiskProfiles(graph, alpha=0.1, beta=0.9)
+    cache = RouteCache()
+    pairs = random_node_pairs(G, queries)
+
+    def compute(a, b):
+        path = csr_graph.astar_path(graph, a, b, current_time, cost=profiles.costs(current_time))
+        route_edge_data = [G[u][v] for u, v in zip(path[:-1], path[1:])]
+        total_risk = profiles.total_risk(graph.edge_ids([graph.index_of(n) for n in path]), current_time)
+        return json.dumps(serializer.feature_collection(route_edge_data, total_risk)).encode()
+
+    start = time.perf_counter()
+    for a, b in pairs:
+        cache.put((a, b), compute(a, b))
+    miss_time = (time.perf_counter() - start) / len(pairs)
+    hit_time, _ = timed(lambda: [cache.get((a, b)) for a, b in pairs], repeat=20)
+    hit_time /= len(pairs)
+    stats = cache.stats()
+    print(f"Cached:                   {stats['entries']:10d} routes, {stats['bytes'] / 1e6:.1f} MB")
+    print(f"Computed and encoded:     {miss_time * 1000:10.3f} ms/route")
+    print(f"Cache hit:                {hit_time * 1e6:10.3f} us/route")
+
+
+def bench_routing_pool(G, queries, max_processes):
+    """
+    Route throughput (search + GeoJSON + JSON encoding) under load: all queries in flight at once on a
+    RoutingPool of 1, 2, 4, ... worker processes sharing a graph artifact, versus searching
+    in this process. Speed-up is bounded by the number of cores.
+    """
+    current_time = datetime(2025, 3, 26, 17, 0)
+    print(f"Graph: {G.number_of_nodes()} nodes, {G.number_of_edges()} edges; {queries} routes, "
+          f"{os.cpu_count()} CPUs")
+    pairs = random_node_pairs(G, queries)
+    with tempfile.TemporaryDirectory() as tmp:
+        artifact_path = os.path.join(tmp, "road_network_graph")
+        write_graph_artifact(G, artifact_path)
+        store = GraphStore(artifact_path, os.path.join(tmp, "road_network_processed.pkl"))
+        graph = store.snapshot
+
+        start = time.perf_counter()
+        expected = [encode_route(route_geojson(graph, search_path(graph, a, b, current_time, 0.1, 0.9),
+                                               current_time)) for a, b in pairs]
+        serial_time = time.perf_counter() - start
+        print(f"{'in-process:':26}{queries / serial_time:10.1f} routes/s")
+
+        processes = 1
+        while processes <= max_processes:
+            pool = RoutingPool(store, processes)
+            start = time.perf_counter()
+            futures = [pool.submit_route_json(a, b, current_time, 0.1, 0.9) for a, b in pairs]
+            routes = [f.result()[1] for f in futures]
+            pool_time = time.perf_counter() - start
+            pool.shutdown()
+            speedup = serial_time / pool_time
+            print(f"{f'{processes} process(es):':26}{queries / pool_time:10.1f} routes/s, x{speedup:.2f} "
+                  f"({speedup / processes:.0%} per process)")
+            assert routes == expected, "worker processes returned different routes"
+            processes *= 2
+
+
+def bench_cost_matrix(G, origins):
+    """
+    A cost matrix of `origins` x 4*`origins` points: one shortest path tree per origin
+    (cost_matrix.py) versus one CSR A* search per pair.
+    """
+    current_time = datetime(2025, 3, 26, 17, 0)
+    destinations = 4 * origins
+    graph = CSRGraph.from_networkx(G)
+    print(f"Graph: {G.number_of_nodes()} nodes, {G.number_of_edges()} edges; {origins} x {destinations} matrix")
+    rng = np.random.default_rng(3)
+    sources = rng.choice(graph.number_of_nodes, origins).tolist()
+    targets = rng.choice(graph.number_of_nodes, destinations).tolist()
+
+    matrix_time, matrices = timed(cost_matrices, graph, sources, targets, current_time)
+    cost = edge_values(graph, current_time)[0].tolist()
+    pairs = [(a, b) for a in sources for b in targets[:10]]
+    astar_time, paths = timed(lambda: [csr_graph.astar(graph, a, b, cost) for a, b in pairs])
+    astar_time *= destinations / 10
+    print(f"One tree per origin:      {matrix_time * 1000:10.2f} ms ({matrix_time / origins * 1000:.2f} ms/origin)")
+    print(f"A* per pair (estimated):  {astar_time * 1000:10.2f} ms ({astar_time / origins / destinations * 1000:.3f} ms/pair)")
+    print(f"Speed-up:                 {astar_time / matrix_time:10.1f}x")
+    for (a, b), path in zip(pairs, paths):
+        if path is not None and len(path) > 1:
+            route_cost = sum(cost[e] for e in graph.edge_ids(path))
+            assert matrices.cost[sources.index(a), targets.index(b)] <= route_cost + 1e-6, "matrix cost above A* route"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmark", choices=["snapping", "edge-snapping", "csr", "ch", "alt", "startup", "geojson",
+                                              "route-cache", "routing-pool", "cost-matrix"])
+    parser.add_argument("--graph", default=DEFAULT_GRAPH, help="Pickled road graph to benchmark on")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--grid", type=int, default=200, help="Side of the synthetic grid graph")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="Largest routing-pool size")
+    args = parser.parse_args()
+
+    G = load_graph(args.graph, args.grid)
+    if args.benchmark == "snapping":
+        bench_snapping(G, args.queries)
+    elif args.benchmark == "edge-snapping":
+        bench_edge_snapping(G, args.queries)
+    elif args.benchmark == "csr":
+        bench_csr(G, args.queries)
+    elif args.benchmark == "ch":
+        bench_ch(G, args.queries)
+    elif args.benchmark == "alt":
+        bench_alt(G, args.queries)
+    elif args.benchmark == "startup":
+        bench_startup(G)
+    elif args.benchmark == "geojson":
+        bench_geojson(G, args.queries)
+    elif args.benchmark == "route-cache":
+        bench_route_cache(G, args.queries)
+    elif args.benchmark == "routing-pool":
+        bench_routing_pool(G, args.queries, args.processes)
+    elif args.benchmark == "cost-matrix":
+        bench_cost_matrix(G, args.queries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Admission control for the asynchronous server (asgi_app.py).
+
+BoundedExecutor runs blocking work, such as route searches, on a concurrent.futures executor
+and admits at most max_pending tasks at a time, running or queued. ConcurrencyLimit caps the
+number of coroutines inside a block, such as outbound geocoding calls. When either is full,
+the request is refused at once with Overloaded and is not queued, so the server answers
+503 with a Retry-After header instead of letting waits grow without bound. Each kind of work
+has its own limit, so slow geocodes never take the slots that route requests need.
+
+Both are used from one event loop thread, so their counters need no locks. A task's
+BoundedExecutor slot is released when the task itself finishes, also when the request
+awaiting it is cancelled (the client went away): a running thread cannot be stopped, so
+freeing the slot earlier would let more than max_pending tasks run or wait at once.
+"""
+import asyncio
+import math
+import time
+
+
+class Overloaded(Exception):
+    """Raised when a limit is full. retry_after: suggested seconds before retrying."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} is at capacity; retry in {retry_after} s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class BoundedExecutor:
+    """
+    Runs functions on `executor` with at most max_pending admitted at once.
+    - workers: Number of workers of the executor, used to estimate Retry-After.
+    """
+
+    def __init__(self, executor, workers, max_pending, name="executor"):
+        self.executor = executor
+        self.workers = workers
+        self.max_pending = max_pending
+        self.name = name
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        # Moving average of task run time, for the Retry-After estimate
+        self.mean_seconds = 0.0
+
+    def retry_after(self):
+        """Seconds until a slot is likely to free up, rounded up to a whole second."""
+        return max(1, math.ceil(self.mean_seconds * self.pending / max(self.workers, 1)))
+
+    async def run(self, fn, *args):
+        """fn(*args) on the executor; raises Overloaded if max_pending tasks are already admitted."""
+        return await self.submit(fn, *args)
+
+    def submit(self, fn, *args):
+        """
+        Admit fn(*args) now and return an asyncio future of its result, for work the caller
+        does not await right away. Raises Overloaded if max_pending tasks are already admitted.
+        """
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise Overloaded(self.name, self.retry_after())
+        self.pending += 1
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        future = self.executor.submit(fn, *args)
+        # Runs in the worker thread once fn returns, or here if the task is cancelled before it starts
+        future.add_done_callback(lambda f: loop.call_soon_threadsafe(
+            self._release, None if f.cancelled() else time.perf_counter() - start))
+        return asyncio.wrap_future(future, loop=loop)
+
+    def _release(self, seconds):
+        """Free a task's slot; seconds is its run time, None if it was cancelled before it ran."""
+        self.pending -= 1
+        if seconds is None:
+            return
+        self.completed += 1
+        self.mean_seconds = seconds if self.completed == 1 else self.mean_seconds + 0.1 * (seconds - self.mean_seconds)
+
+    def stats(self):
+        return {"workers": self.workers, "max_pending": self.max_pending, "pending": self.pending,
+                "completed": self.completed, "rejected": self.rejected,
+                "mean_ms": round(self.mean_seconds * 1000, 2)}
+
+
+class ConcurrencyLimit:
+    """
+    At most `limit` slots held at once; slot() raises Overloaded when they are all taken.
+    The slot is taken by slot() itself, so it also counts when it is held across awaits
+    before use, and is freed on leaving `async with limit.slot():` or by its release().
+    - retry_after: Seconds suggested to refused clients.
+    """
+
+    def __init__(self, limit, name="limit", retry_after=1):
+        self.limit = limit
+        self.name = name
+        self.retry_after = retry_after
+        self.active = 0
+        self.rejected = 0
+
+    def slot(self):
+        if self.active >= self.limit:
+            self.rejected += 1
+            raise Overloaded(self.name, self.retry_after)
+        self.active += 1
+        return _Slot(self)
+
+    def stats(self):
+        return {"limit": self.limit, "active": self.active, "rejected": self.rejected}
+
+
+class _Slot:
+
+    def __init__(self, limit):
+        self._limit = limit
+        self._held = True
+
+    def release(self):
+        """Free the slot; later calls do nothing."""
+        if self._held:
+            self._held = False
+            self._limit.active -= 1
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+        return False
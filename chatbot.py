@@ -1,7 +1,20 @@
 # chatbot.py
+import asyncio
 import re
 import requests
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from geocoding import default_geocoder
+
+@lru_cache(maxsize=None)
+def geocode_pool():
+    """
+    The threads that geocode the start and end locations of a chat request at the same time,
+    created on first use, so importing this module starts nothing.
+    """
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="chat-geocode")
 
 def parse_user_input(user_input):
     """
@@ -48,19 +61,9 @@ def geocode_location(location, geoapify_api_key):
     """
     Geocode a location name to coordinates using the Geoapify API.
     Returns a tuple (latitude, longitude) or None if geocoding fails.
+    Repeated names are answered from the shared geocoding cache (see geocoding.py).
     """
-    url = f"https://api.geoapify.com/v1/geocode/search?text={location}&limit=1&apiKey={geoapify_api_key}"
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        if data['features'] and len(data['features']) > 0:
-            coords = data['features'][0]['geometry']['coordinates']
-            return coords[1], coords[0]  # [lat, lon]
-        return None
-    except requests.exceptions.RequestException as e:
-        print(f"Geocoding failed for {location}: {str(e)}")
-        return None
+    return default_geocoder().locate(location, geoapify_api_key)
 
 def find_route(start_coords, end_coords):
     """
@@ -131,41 +134,124 @@ def format_route_response(route_geojson, start_location, end_location):
     
     return response
 
-def process_chat_message(user_input, geoapify_api_key):
+PARSE_FAILED = "I couldn't understand your request. Please use a format like 'Find a route from Calgary Tower to University Station, Calgary'."
+NO_ROUTE = "I couldn't find a route between those locations. Please try different points or check if they are within Calgary."
+
+def not_found(location):
+    return f"I couldn't find the location '{location}'. Please try a more specific address."
+
+def with_city(location):
+    """Append ", Calgary, AB" if "Calgary" is not in the location name."""
+    if "calgary" not in location.lower():
+        return f"{location}, Calgary, AB"
+    return location
+
+def elapsed_ms(since):
+    return round((time.perf_counter() - since) * 1000, 2)
+
+def timed_geocode(location, geoapify_api_key):
+    """geocode_location, also returning the milliseconds it took."""
+    start = time.perf_counter()
+    coords = geocode_location(location, geoapify_api_key)
+    return coords, elapsed_ms(start)
+
+class _ChatSteps:
     """
-    Process the user's chat message and return a response.
+    What the sync and async chat handlers share: the parsed locations, the stage timings
+    and the replies. The handlers only differ in how they geocode and route.
     """
-    # Step 1: Parse the user input
-    start_location, end_location = parse_user_input(user_input)
-    if not start_location or not end_location:
-        return "I couldn't understand your request. Please use a format like 'Find a route from Calgary Tower to University Station, Calgary'."
-
-    # Step 2: Geocode the locations
-    # Append ", Calgary, AB" if "Calgary" is not in the location name
-    if "calgary" not in start_location.lower():
-        start_location = f"{start_location}, Calgary, AB"
-    if "calgary" not in end_location.lower():
-        end_location = f"{end_location}, Calgary, AB"
-        
-    print(f"Geocoding start location: {start_location}")
-    print(f"Geocoding end location: {end_location}")
 
-    start_coords = geocode_location(start_location, geoapify_api_key)
-    if not start_coords:
-        return f"I couldn't find the location '{start_location}'. Please try a more specific address."
+    def __init__(self, user_input):
+        # Step 1: Parse the user input
+        self.started = time.perf_counter()
+        self.timings = {}
+        start_location, end_location = parse_user_input(user_input)
+        self.timings['parse_ms'] = elapsed_ms(self.started)
+        self.parsed = bool(start_location and end_location)
+        self.start_location = with_city(start_location) if self.parsed else None
+        self.end_location = with_city(end_location) if self.parsed else None
 
-    end_coords = geocode_location(end_location, geoapify_api_key)
-    if not end_coords:
-        return f"I couldn't find the location '{end_location}'. Please try a more specific address."
+    def reply(self, message, **fields):
+        self.timings['total_ms'] = elapsed_ms(self.started)
+        return dict({"response": message, "timings": self.timings}, **fields)
 
+    def geocoded(self, since, start, end):
+        """
+        Step 2: Record the geocoding of both locations, started at `since`.
+        - start, end: (coords, milliseconds) of each location, as timed_geocode returns.
+        Returns the reply for a location that was not found, else None.
+        """
+        (start_coords, self.timings['geocode_start_ms']), (end_coords, self.timings['geocode_end_ms']) = start, end
+        self.timings['geocode_ms'] = elapsed_ms(since)
+        if not start_coords:
+            return self.reply(not_found(self.start_location))
+        if not end_coords:
+            return self.reply(not_found(self.end_location))
+        return None
+
+    def routed(self, since, route_geojson, start_coords, end_coords):
+        """Steps 3 and 4: Record the route search started at `since` and format the reply."""
+        self.timings['route_ms'] = elapsed_ms(since)
+        if not route_geojson:
+            return self.reply(NO_ROUTE)
+        stage = time.perf_counter()
+        response = format_route_response(route_geojson, self.start_location, self.end_location)
+        self.timings['format_ms'] = elapsed_ms(stage)
+        return self.reply(response, success=True, route_geojson=route_geojson, start_coords=start_coords,
+                          end_coords=end_coords)
+
+def process_chat_message(user_input, geoapify_api_key, route_fn=None):
+    """
+    Process the user's chat message and return a response.
+    - route_fn: Called as route_fn(start_coords, end_coords) to get the route GeoJSON (or None);
+      the server passes its in-process router. Defaults to find_route, which POSTs to /find_path.
+    The reply includes 'timings', the milliseconds spent in each stage.
+    """
+    route_fn = route_fn or find_route
+    chat = _ChatSteps(user_input)
+    if not chat.parsed:
+        return chat.reply(PARSE_FAILED)
+
+    print(f"Geocoding start location: {chat.start_location}")
+    print(f"Geocoding end location: {chat.end_location}")
+    stage = time.perf_counter()
+    pool = geocode_pool()
+    start_future = pool.submit(timed_geocode, chat.start_location, geoapify_api_key)
+    end_future = pool.submit(timed_geocode, chat.end_location, geoapify_api_key)
+    start, end = start_future.result(), end_future.result()
+    failed = chat.geocoded(stage, start, end)
+    if failed:
+        return failed
+
+    start_coords, end_coords = start[0], end[0]
     print(f"Start coordinates: {start_coords}")
     print(f"End coordinates: {end_coords}")
-    
-    # Step 3: Find the route
-    route_geojson = find_route(start_coords, end_coords)
-    if not route_geojson:
-        return "I couldn't find a route between those locations. Please try different points or check if they are within Calgary."
+    stage = time.perf_counter()
+    return chat.routed(stage, route_fn(start_coords, end_coords), start_coords, end_coords)
+
+async def process_chat_message_async(user_input, geocode, route):
+    """
+    process_chat_message for event loops (asgi_app.py); the reply has the same fields.
+    - geocode: Coroutine function, geocode(location) -> (latitude, longitude) or None.
+    - route: Coroutine function, route(start_coords, end_coords) -> route GeoJSON or None.
+    Exceptions raised by geocode or route (such as bounded_executor.Overloaded) propagate.
+    """
+    chat = _ChatSteps(user_input)
+    if not chat.parsed:
+        return chat.reply(PARSE_FAILED)
+
+    async def timed(location):
+        start = time.perf_counter()
+        coords = await geocode(location)
+        return coords, elapsed_ms(start)
+
+    # Both locations are geocoded concurrently
+    stage = time.perf_counter()
+    start, end = await asyncio.gather(timed(chat.start_location), timed(chat.end_location))
+    failed = chat.geocoded(stage, start, end)
+    if failed:
+        return failed
 
-    # Step 4: Format the response
-    response = format_route_response(route_geojson, start_location, end_location)
-    return {"success": True, "response": response, "route_geojson": route_geojson, "start_coords": start_coords, "end_coords": end_coords}
\ No newline at end of file
+    start_coords, end_coords = start[0], end[0]
+    stage = time.perf_counter()
+    return chat.routed(stage, await route(start_coords, end_coords), start_coords, end_coords)
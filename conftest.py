@@ -0,0 +1,57 @@
+"""
+Shared fixtures. The Calgary graph and layer files are not in the repository, so tests that
+load the servers use a graph artifact of benchmarks.synthetic_graph, which lies inside
+server.CALGARY_BOUNDS.
+"""
+import importlib
+import sys
+
+import pytest
+from pyproj import Transformer
+
+from benchmarks import synthetic_graph
+from graph_artifact import write_graph_artifact
+
+_to_wgs84 = Transformer.from_crs("EPSG:32611", "EPSG:4326", always_xy=True)
+
+
+def node_latlon(G, n, dx=0.0, dy=0.0):
+    """[lat, lon] of graph node n, moved by (dx, dy) metres."""
+    x, y = G.nodes[n]['pos']
+    lon, lat = _to_wgs84.transform(x + dx, y + dy)
+    return [lat, lon]
+
+
+@pytest.fixture(scope="session")
+def synthetic_G():
+    return synthetic_graph(rows=15, cols=15)
+
+
+@pytest.fixture(scope="session")
+def artifact_dir(tmp_path_factory, synthetic_G):
+    directory = tmp_path_factory.mktemp("artifact") / "graph"
+    write_graph_artifact(synthetic_G, str(directory))
+    return str(directory)
+
+
+def load_server(artifact_dir, monkeypatch, modules=("server",), **env):
+    """
+    Import the given modules afresh (the servers read their settings at import) with server.py
+    on artifact_dir, graph reloading and routing processes off, and `env` set.
+    Returns the last module.
+    """
+    settings = {"GRAPH_ARTIFACT": artifact_dir, "GRAPH_RELOAD_INTERVAL": "0", "ROUTE_PROCESSES": "0",
+                "TILE_CACHE": ""}
+    settings.update(env)
+    for name, value in settings.items():
+        monkeypatch.setenv(name, value)
+    for module in ("asgi_app", "server"):
+        sys.modules.pop(module, None)
+    return [importlib.import_module(module) for module in modules][-1]
+
+
+@pytest.fixture(scope="module")
+def server(artifact_dir):
+    """server.py loaded on the synthetic graph artifact."""
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        yield load_server(artifact_dir, monkeypatch)
@@ -0,0 +1,343 @@
+"""
+Contraction Hierarchies (CH) for the risk-weighted routing graph.
+
+Preprocessing contracts nodes one at a time in order of importance, adding shortcut
+edges that preserve shortest-path costs. A query then only relaxes edges leading to
+more important nodes, from both ends, so it settles a few hundred nodes instead of a
+large part of the city. There is one hierarchy per time-bucket cost profile from
+risk_profiles.RiskProfiles, since each bucket weights the edges differently.
+
+Build offline (pure Python, takes a while on the full Calgary graph):
+    python contraction_hierarchy.py road_network_processed.pkl --out road_network_ch.npz
+"""
+import argparse
+import math
+import os
+import pickle
+import time
+from array import array
+from heapq import heapify, heappop, heappush
+
+import numpy as np
+
+from csr_graph import CSRGraph
+from risk_profiles import TIME_BUCKETS, RiskProfiles
+
+INF = math.inf
+
+
+def _bucket_key(bucket):
+    return ''.join('1' if flag else '0' for flag in bucket)
+
+
+class ContractionHierarchy:
+    """
+    The upward search graphs of a hierarchy, in CSR form over CSRGraph node positions.
+    - fwd_*: edges u -> w with rank[w] > rank[u], stored at u (forward search).
+    - bwd_*: edges u -> v with rank[u] > rank[v], stored at v (backward search).
+    mid is -1 for an original edge, otherwise the contracted node the shortcut skips.
+    """
+
+    def __init__(self, rank, fwd_offsets, fwd_targets, fwd_cost, fwd_mid,
+                 bwd_offsets, bwd_targets, bwd_cost, bwd_mid):
+        self.rank = np.asarray(rank, dtype=np.int32)
+        self.fwd = tuple(np.asarray(a) for a in (fwd_offsets, fwd_targets, fwd_cost, fwd_mid))
+        self.bwd = tuple(np.asarray(a) for a in (bwd_offsets, bwd_targets, bwd_cost, bwd_mid))
+
+    @property
+    def number_of_shortcuts(self):
+        return int((self.fwd[3] >= 0).sum() + (self.bwd[3] >= 0).sum())
+
+    def to_arrays(self, prefix=''):
+        names = ('offsets', 'targets', 'cost', 'mid')
+        arrays = {f'{prefix}rank': self.rank}
+        arrays.update({f'{prefix}fwd_{name}': a for name, a in zip(names, self.fwd)})
+        arrays.update({f'{prefix}bwd_{name}': a for name, a in zip(names, self.bwd)})
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix=''):
+        names = ('offsets', 'targets', 'cost', 'mid')
+        return cls(arrays[f'{prefix}rank'],
+                   *(arrays[f'{prefix}fwd_{name}'] for name in names),
+                   *(arrays[f'{prefix}bwd_{name}'] for name in names))
+
+
+def build_hierarchy(graph, cost, settle_limit=60):
+    """
+    Contract every node of a CSRGraph under one per-edge cost vector.
+    - settle_limit: Nodes a witness search may settle before giving up and adding
+      the shortcut anyway. Lower is faster to build but adds more shortcuts.
+    """
+    n = graph.number_of_nodes
+    offsets, targets = graph.offsets.tolist(), graph.targets.tolist()
+    cost = list(cost)
+    # Remaining graph as dicts: out_adj[u][w] = in_adj[w][u] = (cost, mid)
+    out_adj = [dict() for _ in range(n)]
+    in_adj = [dict() for _ in range(n)]
+    for u in range(n):
+        for e in range(offsets[u], offsets[u + 1]):
+            w = targets[e]
+            if u != w and (w not in out_adj[u] or cost[e] < out_adj[u][w][0]):
+                out_adj[u][w] = in_adj[w][u] = (cost[e], -1)
+
+    def witness_distances(source, skip, max_cost):
+        dist = {source: 0.0}
+        heap = [(0.0, source)]
+        settled = 0
+        while heap and settled < settle_limit:
+            d, x = heappop(heap)
+            if d > dist[x] or d > max_cost:
+                continue
+            settled += 1
+            for y, (c, _) in out_adj[x].items():
+                nd = d + c
+                if y != skip and nd < dist.get(y, INF):
+                    dist[y] = nd
+                    heappush(heap, (nd, y))
+        return dist
+
+    def shortcuts_for(v):
+        shortcuts = []
+        outs = out_adj[v]
+        if not outs:
+            return shortcuts
+        max_out = max(c for c, _ in outs.values())
+        for u, (c_uv, _) in in_adj[v].items():
+            dist = witness_distances(u, v, c_uv + max_out)
+            for w, (c_vw, _) in outs.items():
+                if w != u and dist.get(w, INF) > c_uv + c_vw:
+                    shortcuts.append((u, w, c_uv + c_vw))
+        return shortcuts
+
+    deleted_neighbors = [0] * n
+    level = [0] * n  # 1 + the highest level among contracted neighbours
+
+    def priority(v, shortcuts):
+        # Weighted edge difference, plus terms that spread contraction evenly over the
+        # graph and keep the hierarchy shallow
+        return 2 * len(shortcuts) - len(in_adj[v]) - len(out_adj[v]) + deleted_neighbors[v] + level[v]
+
+    heap = [(priority(v, shortcuts_for(v)), v) for v in range(n)]
+    heapify(heap)
+    rank = np.empty(n, dtype=np.int32)
+    fwd = [None] * n
+    bwd = [None] * n
+    next_rank = 0
+    while heap:
+        _, v = heappop(heap)
+        shortcuts = shortcuts_for(v)
+        p = priority(v, shortcuts)
+        if heap and p > heap[0][0]:
+            heappush(heap, (p, v))
+            continue
+
+        # v is the least important remaining node: its remaining edges all lead upwards
+        rank[v] = next_rank
+        next_rank += 1
+        fwd[v] = [(w, c, mid) for w, (c, mid) in out_adj[v].items()]
+        bwd[v] = [(u, c, mid) for u, (c, mid) in in_adj[v].items()]
+        for w in out_adj[v]:
+            del in_adj[w][v]
+            level[w] = max(level[w], level[v] + 1)
+            deleted_neighbors[w] += 1
+        for u in in_adj[v]:
+            del out_adj[u][v]
+            level[u] = max(level[u], level[v] + 1)
+            deleted_neighbors[u] += 1
+        out_adj[v] = in_adj[v] = None
+        for u, w, c in shortcuts:
+            if w not in out_adj[u] or c < out_adj[u][w][0]:
+                out_adj[u][w] = in_adj[w][u] = (c, v)
+
+    def to_csr(adjacency):
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(edges) for edges in adjacency])
+        flat = [edge for edges in adjacency for edge in edges]
+        targets = np.array([e[0] for e in flat], dtype=np.int32)
+        costs = np.array([e[1] for e in flat], dtype=np.float64)
+        mids = np.array([e[2] for e in flat], dtype=np.int32)
+        return offsets, targets, costs, mids
+
+    return ContractionHierarchy(rank, *to_csr(fwd), *to_csr(bwd))
+
+
+def save_hierarchies(path, hierarchies, alpha, beta, fingerprint):
+    """
+    Write {time bucket: ContractionHierarchy} to one .npz file, with the weights and the
+    CSRGraph.fingerprint() of the graph they were built for.
+    """
+    arrays = {'alpha': np.float64(alpha), 'beta': np.float64(beta), 'graph': np.str_(fingerprint)}
+    for bucket, hierarchy in hierarchies.items():
+        arrays.update(hierarchy.to_arrays(prefix=f'b{_bucket_key(bucket)}_'))
+    np.savez(path, **arrays)
+
+
+def load_hierarchies(path):
+    """
+    Read the file written by save_hierarchies. Returns (hierarchies, alpha, beta, graph
+    fingerprint), the fingerprint None for files written before it was stored.
+    """
+    with np.load(path) as data:
+        arrays = {k: data[k] for k in data.files}
+    hierarchies = {bucket: ContractionHierarchy.from_arrays(arrays, prefix=f'b{_bucket_key(bucket)}_')
+                   for bucket in TIME_BUCKETS}
+    fingerprint = str(arrays['graph']) if 'graph' in arrays else None
+    return hierarchies, float(arrays['alpha']), float(arrays['beta']), fingerprint
+
+
+class CHQuery:
+    """Bidirectional Dijkstra over a ContractionHierarchy."""
+
+    def __init__(self, hierarchy):
+        def packed(arrays):
+            offsets, targets, cost, mid = arrays
+            return (array('q', offsets.astype(np.int64).tobytes()), array('i', targets.astype(np.int32).tobytes()),
+                    array('d', cost.astype(np.float64).tobytes()), array('i', mid.astype(np.int32).tobytes()))
+        self.fwd = packed(hierarchy.fwd)
+        self.bwd = packed(hierarchy.bwd)
+
+    def shortest_path(self, source, target):
+        """
+        Shortest path between two node positions.
+        Returns (cost, path of node positions), or (inf, None) if target is unreachable.
+        """
+        if source == target:
+            return 0.0, [source]
+        searches = (
+            (self.fwd, {source: 0.0}, {source: None}, [(0.0, source)]),
+            (self.bwd, {target: 0.0}, {target: None}, [(0.0, target)]),
+        )
+        best, meet = INF, None
+        while True:
+            # Advance whichever search has the smaller key; stop once neither can improve best
+            heap_f, heap_b = searches[0][3], searches[1][3]
+            key_f = heap_f[0][0] if heap_f else INF
+            key_b = heap_b[0][0] if heap_b else INF
+            if min(key_f, key_b) >= best:
+                break
+            side = 0 if key_f <= key_b else 1
+            (offsets, targets, costs, _), dist, parent, heap = searches[side]
+            other_dist = searches[1 - side][1]
+            d, v = heappop(heap)
+            if d > dist[v]:
+                continue
+            if v in other_dist and d + other_dist[v] < best:
+                best, meet = d + other_dist[v], v
+            for e in range(offsets[v], offsets[v + 1]):
+                w = targets[e]
+                nd = d + costs[e]
+                if nd < dist.get(w, INF):
+                    dist[w] = nd
+                    parent[w] = (v, e)
+                    heappush(heap, (nd, w))
+        if meet is None:
+            return INF, None
+
+        # Hierarchy edges source -> meet, then meet -> target, as (u, w, mid)
+        edges = []
+        node = meet
+        while searches[0][2][node] is not None:
+            prev, e = searches[0][2][node]
+            edges.append((prev, node, self.fwd[3][e]))
+            node = prev
+        edges.reverse()
+        node = meet
+        while searches[1][2][node] is not None:
+            nxt, e = searches[1][2][node]
+            edges.append((node, nxt, self.bwd[3][e]))
+            node = nxt
+        return best, self._unpack(edges)
+
+    def _mid(self, adjacency, at, other):
+        offsets, targets, _, mids = adjacency
+        for e in range(offsets[at], offsets[at + 1]):
+            if targets[e] == other:
+                return mids[e]
+        raise KeyError((at, other))
+
+    def _unpack(self, edges):
+        """Expand shortcuts back into original edges; returns the node path."""
+        path = [edges[0][0]]
+        stack = list(reversed(edges))
+        while stack:
+            u, w, mid = stack.pop()
+            if mid < 0:
+                path.append(w)
+                continue
+            # mid ranks below u and w: u -> mid is stored in mid's backward list,
+            # mid -> w in its forward list
+            stack.append((mid, w, self._mid(self.fwd, mid, w)))
+            stack.append((u, mid, self._mid(self.bwd, mid, u)))
+        return path
+
+
+class CHRouter:
+    """Query engines for every time bucket, addressed by graph node ids."""
+
+    def __init__(self, graph, hierarchies):
+        self.graph = graph
+        self.engines = {bucket: CHQuery(h) for bucket, h in hierarchies.items()}
+
+    @classmethod
+    def load(cls, graph, path, alpha, beta):
+        """
+        Hierarchies saved by save_hierarchies, for `graph` searched with the cost weights alpha, beta.
+        Raises ValueError if they were built for a graph with another number of nodes, with
+        other weights, or for another version of the graph (graph.fingerprint(), which changes
+        when risk scores are patched), since their routes would then be wrong.
+        """
+        hierarchies, saved_alpha, saved_beta, fingerprint = load_hierarchies(path)
+        nodes = {len(h.rank) for h in hierarchies.values()}
+        if nodes != {graph.number_of_nodes}:
+            raise ValueError(f"{path} was built for a graph with {min(nodes)} nodes, "
+                             f"not {graph.number_of_nodes}; rebuild it with contraction_hierarchy.py")
+        if not (math.isclose(saved_alpha, alpha) and math.isclose(saved_beta, beta)):
+            raise ValueError(f"{path} was built with alpha={saved_alpha}, beta={saved_beta}, "
+                             f"not alpha={alpha}, beta={beta}; rebuild it with contraction_hierarchy.py")
+        if fingerprint is None:
+            raise ValueError(f"{path} does not record the graph it was built for; rebuild it with "
+                             f"contraction_hierarchy.py")
+        if fingerprint != graph.fingerprint():
+            raise ValueError(f"{path} was built for another version of the graph (it changed or was re-scored "
+                             f"since); rebuild it with contraction_hierarchy.py")
+        router = cls(graph, hierarchies)
+        router.alpha, router.beta = saved_alpha, saved_beta
+        return router
+
+    def shortest_path(self, start_node, end_node, bucket):
+        """Path of graph node ids for a time bucket from find_path.risk_time_bucket, or None."""
+        _, path = self.engines[bucket].shortest_path(self.graph.index_of(start_node),
+                                                     self.graph.index_of(end_node))
+        if path is None:
+            return None
+        return self.graph.node_ids[path].tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("graph", help="Pickled road graph from convert_shp_to_graph.py")
+    parser.add_argument("--out", default=None, help="Output .npz (default: road_network_ch.npz next to the graph)")
+    parser.add_argument("--alpha", type=float, default=0.1, help="Distance weight, as used by /find_path")
+    parser.add_argument("--beta", type=float, default=0.9, help="Risk weight, as used by /find_path")
+    parser.add_argument("--settle-limit", type=int, default=60)
+    args = parser.parse_args()
+
+    out = args.out or os.path.join(os.path.dirname(os.path.abspath(args.graph)), "road_network_ch.npz")
+    with open(args.graph, "rb") as f:
+        G = pickle.load(f)
+    graph = CSRGraph.from_networkx(G)
+    profiles = RiskProfiles(graph, alpha=args.alpha, beta=args.beta)
+
+    hierarchies = {}
+    for bucket in TIME_BUCKETS:
+        start = time.perf_counter()
+        hierarchies[bucket] = build_hierarchy(graph, profiles.bucket_costs(bucket), settle_limit=args.settle_limit)
+        print(f"Bucket {_bucket_key(bucket)} (rush hour, weekday, winter): "
+              f"{hierarchies[bucket].number_of_shortcuts} shortcuts in {time.perf_counter() - start:.1f} s")
+    save_hierarchies(out, hierarchies, args.alpha, args.beta, graph.fingerprint())
+    print(f"Saved {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Travel cost, length and risk matrices between sets of points, without route geometries.
+
+A matrix of N origins by M destinations from find_path.astar_path is N*M searches. Here each
+origin is one Dijkstra over the CSR graph (csr_graph.shortest_path_tree, compiled scipy code)
+that reaches every destination at once, with the /find_path edge cost
+alpha*length + beta*adjusted_risk*length. The length and summed adjusted risk of the
+least-cost route to every node are then added up along the shortest path tree for all nodes
+at once by pointer jumping (about log2 of the tree depth numpy passes), so no route is walked
+in Python.
+
+Values are those of exact least-cost routes, so a cost can be lower than that of the A*
+route /find_path returns for the same pair (its straight-line heuristic is not a lower bound
+on the risk-weighted cost). Unreachable pairs are inf.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from csr_graph import shortest_path_tree
+from find_path import apply_risk_factors, risk_time_bucket
+
+# (origins, destinations) float64 arrays: route cost, length in meters and summed adjusted risk
+CostMatrices = namedtuple('CostMatrices', ['cost', 'length', 'risk'])
+
+
+def edge_values(graph, current_time, alpha=0.1, beta=0.9):
+    """(cost, length, adjusted risk) per edge of a CSRGraph at current_time, as risk_profiles computes them."""
+    adjusted_risk = apply_risk_factors(graph.risk_score, risk_time_bucket(current_time))
+    return alpha * graph.length + beta * adjusted_risk * graph.length, graph.length, adjusted_risk
+
+
+def tree_sums(graph, source, predecessors, edge_arrays):
+    """
+    Per node, the sum of each per-edge array along the shortest path tree from source;
+    0 at the source and inf where the node is unreachable.
+    """
+    n = graph.number_of_nodes
+    nodes = np.arange(n)
+    reached = predecessors >= 0
+    parent_edges = graph.edges_between(predecessors[reached], nodes[reached])
+    # jump[v] is an ancestor of v and sums[k][v] the sum over the tree path from jump[v] to v.
+    # Each pass doubles the path covered, until every jump is the source (or the node itself
+    # when unreachable), whose sums stay 0.
+    jump = np.where(reached, predecessors, nodes)
+    sums = []
+    for values in edge_arrays:
+        initial = np.zeros(n)
+        initial[reached] = values[parent_edges]
+        sums.append(initial)
+    while True:
+        next_jump = jump[jump]
+        if np.array_equal(next_jump, jump):
+            break
+        for values in sums:
+            values += values[jump]
+        jump = next_jump
+    unreachable = ~reached
+    unreachable[source] = False
+    for values in sums:
+        values[unreachable] = np.inf
+    return sums
+
+
+def cost_matrices(graph, origins, destinations, current_time, alpha=0.1, beta=0.9):
+    """
+    Cost, length and risk of the least-cost routes from every origin to every destination.
+    - graph: csr_graph.CSRGraph.
+    - origins, destinations: Sequences of node positions; repeated origins are searched once.
+    - current_time: datetime for the risk adjustment.
+    - alpha, beta: Distance and risk weights, as in find_path.astar_path.
+    Returns CostMatrices of shape (len(origins), len(destinations)).
+    """
+    cost, length, risk = edge_values(graph, current_time, alpha, beta)
+    origins = np.asarray(origins, dtype=np.int64)
+    destinations = np.asarray(destinations, dtype=np.int64)
+    matrices = CostMatrices(*(np.empty((len(origins), len(destinations))) for _ in range(3)))
+    unique_origins, rows = np.unique(origins, return_inverse=True)
+    for i, source in enumerate(unique_origins.tolist()):
+        distances, predecessors = shortest_path_tree(graph, source, cost)
+        lengths, risks = tree_sums(graph, source, predecessors, (length, risk))
+        for matrix, values in zip(matrices, (distances, lengths, risks)):
+            matrix[rows == i] = values[destinations]
+    return matrices
+
+
+def snapshot_matrices(graph, origin_nodes, destination_nodes, current_time, alpha, beta, routing_pool=None):
+    """
+    cost_matrices() between graph node ids on a GraphSnapshot, split by origin across the
+    routing pool's worker processes when there is one serving this snapshot.
+    """
+    csr = graph.csr
+    if csr is None:
+        raise ValueError("cost matrices need the CSR graph (ROUTING_BACKEND=csr or ch)")
+    if routing_pool is None or routing_pool.generation != graph.generation or len(origin_nodes) < 2:
+        return cost_matrices(csr, [csr.index_of(n) for n in origin_nodes],
+                             [csr.index_of(n) for n in destination_nodes], current_time, alpha, beta)
+    chunks = np.array_split(np.arange(len(origin_nodes)), min(routing_pool.processes, len(origin_nodes)))
+    futures = [routing_pool.submit_cost_matrices([origin_nodes[i] for i in chunk], destination_nodes,
+                                                 current_time, alpha, beta) for chunk in chunks]
+    parts = [f.result() for f in futures]
+    return CostMatrices(*(np.vstack([part[k] for part in parts]) for k in range(3)))
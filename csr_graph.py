@@ -0,0 +1,285 @@
+import hashlib
+import math
+from bisect import bisect_left
+from heapq import heappop, heappush
+from itertools import count
+
+import numpy as np
+
+from find_path import adjust_risk_score
+
+# category_codes are int8, so a graph can have at most this many risk categories
+MAX_CATEGORIES = int(np.iinfo(np.int8).max) + 1
+
+
+def category_key(category):
+    """A risk category as stored in CSRGraph.categories: missing and NaN (pandas' missing value) are both None."""
+    if category is None or (isinstance(category, float) and math.isnan(category)):
+        return None
+    return category
+
+
+class CSRGraph:
+    """
+    Compact compressed-sparse-row copy of the routing graph.
+
+    Node i has outgoing edges offsets[i]:offsets[i + 1]; edge e goes to node targets[e]
+    and carries length[e], risk_score[e] and category_codes[e] (an index into categories).
+    Nodes are addressed by position; node_ids maps positions back to graph node ids.
+    """
+
+    def __init__(self, node_ids, x, y, offsets, targets, length, risk_score, category_codes, categories):
+        self.node_ids = np.asarray(node_ids)
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.targets = np.asarray(targets, dtype=np.int32)
+        self.length = np.asarray(length, dtype=np.float64)
+        self.risk_score = np.asarray(risk_score, dtype=np.float64)
+        self.category_codes = np.asarray(category_codes, dtype=np.int8)
+        self.categories = list(categories)
+        self._index = None
+        self._lists = None
+        self._fingerprint = None
+
+    @classmethod
+    def from_networkx(cls, G):
+        """
+        Build from the networkx DiGraph produced by convert_shp_to_graph.py.
+        Edges keep G's adjacency order, so searches break ties the same way networkx does.
+        """
+        index = {n: i for i, n in enumerate(G.nodes)}
+        n_nodes = len(index)
+        n_edges = G.number_of_edges()
+        x = np.empty(n_nodes)
+        y = np.empty(n_nodes)
+        offsets = np.zeros(n_nodes + 1, dtype=np.int64)
+        targets = np.empty(n_edges, dtype=np.int32)
+        length = np.empty(n_edges)
+        risk_score = np.empty(n_edges)
+        category_codes = np.empty(n_edges, dtype=np.int8)
+        categories = {}
+
+        e = 0
+        for i, (n, d) in enumerate(G.nodes(data=True)):
+            x[i], y[i] = d['pos'][0], d['pos'][1]
+            for v, data in G[n].items():
+                targets[e] = index[v]
+                length[e] = float(data['length'])
+                risk_score[e] = float(data['risk_score'])
+                category = category_key(data.get('risk_category'))
+                if category not in categories:
+                    if len(categories) == MAX_CATEGORIES:
+                        raise ValueError(f"more than {MAX_CATEGORIES} risk categories")
+                    categories[category] = len(categories)
+                category_codes[e] = categories[category]
+                e += 1
+            offsets[i + 1] = e
+
+        graph = cls(list(index), x, y, offsets, targets, length, risk_score, category_codes, categories)
+        graph._index = index
+        return graph
+
+    @property
+    def number_of_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def number_of_edges(self):
+        return len(self.targets)
+
+    @property
+    def nbytes(self):
+        """Memory held by the CSR arrays."""
+        return sum(a.nbytes for a in (self.node_ids, self.x, self.y, self.offsets, self.targets,
+                                      self.length, self.risk_score, self.category_codes))
+
+    def fingerprint(self):
+        """
+        SHA-256 of the node ids, topology, lengths and risk scores: the inputs of every search
+        cost. Files derived from the graph (contraction hierarchies, landmark tables) store it,
+        so a graph that was rebuilt or re-scored since is detected when they are loaded.
+        """
+        if self._fingerprint is None:
+            digest = hashlib.sha256()
+            node_ids = self.node_ids
+            digest.update(node_ids.astype(np.int64).tobytes() if node_ids.dtype.kind in 'iu'
+                          else repr(node_ids.tolist()).encode())
+            for a in (self.offsets, self.targets, self.length, self.risk_score):
+                digest.update(np.ascontiguousarray(a).tobytes())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def index_of(self, node):
+        """Position of a graph node id in the CSR arrays. Raises KeyError for unknown nodes."""
+        if self._index is None:
+            node_ids = self.node_ids
+            if node_ids.dtype.kind in 'iu' and (node_ids[1:] > node_ids[:-1]).all():
+                self._index = _SortedNodeIds(node_ids)
+            else:
+                self._index = {n: i for i, n in enumerate(node_ids.tolist())}
+        return self._index[node]
+
+    def edge_ids(self, path):
+        """Edge positions along a path of node positions, looked up for all hops at once."""
+        edges = self.edges_between(path[:-1], path[1:])
+        if (edges < 0).any():
+            raise ValueError("path contains a hop that is not an edge of the graph")
+        return edges
+
+    def edges_between(self, u, v):
+        """Positions of the edges u[i] -> v[i] for arrays of node positions; -1 where there is none."""
+        u = np.asarray(u, dtype=np.int64)
+        v = np.asarray(v, dtype=np.int64)
+        start = self.offsets[u]
+        degree = self.offsets[u + 1] - start
+        edges = np.full(len(u), -1, dtype=np.int64)
+        for k in range(int(degree.max()) if len(u) else 0):
+            candidate = np.minimum(start + k, len(self.targets) - 1)
+            hit = (edges < 0) & (k < degree) & (self.targets[candidate] == v)
+            edges[hit] = candidate[hit]
+        return edges
+
+    def edge_costs(self, current_time, alpha=1.0, beta=1.0):
+        """Per-edge cost alpha*length + beta*adjusted_risk*length, as used by find_path.astar_path."""
+        adjusted_risk = adjust_risk_score(self.risk_score, current_time,
+                                          rush_hour_factor=2.0, weekday_factor=1.5, winter_factor=1.5)
+        return alpha * self.length + beta * adjusted_risk * self.length
+
+    def to_sparse(self, cost):
+        """The graph as a scipy CSR matrix with the given per-edge costs, for scipy.sparse.csgraph."""
+        from scipy.sparse import csr_matrix
+        n = self.number_of_nodes
+        return csr_matrix((np.asarray(cost, dtype=np.float64), self.targets, self.offsets), shape=(n, n))
+
+    def _adjacency(self):
+        # The search loops run in Python, where numpy scalar indexing is slow. Indexing a
+        # memoryview of an array returns plain Python numbers about as fast as a list, and
+        # reads the arrays in place, so the memory-mapped arrays of a graph artifact are not
+        # copied into every worker process.
+        if self._lists is None:
+            self._lists = tuple(memoryview(a) for a in (self.offsets, self.targets, self.x, self.y))
+        return self._lists
+
+
+class _SortedNodeIds:
+    """
+    Node id -> position lookups by binary search in increasing integer node ids, such as the
+    ids convert_shp_to_graph.py numbers in graph order. Reads node_ids in place instead of
+    building a dict of every node.
+    """
+
+    def __init__(self, node_ids):
+        self._ids = memoryview(node_ids)
+
+    def __getitem__(self, node):
+        try:
+            i = bisect_left(self._ids, node)
+        except TypeError:
+            raise KeyError(node) from None
+        if i == len(self._ids) or self._ids[i] != node:
+            raise KeyError(node)
+        return i
+
+
+def astar(graph, source, target, cost, heuristic=True, stats=None):
+    """
+    A* over a CSRGraph between node positions source and target.
+    - cost: Per-edge cost sequence, e.g. graph.edge_costs(...). A list is fastest when
+      the same costs serve many queries.
+    - heuristic: True for the Euclidean heuristic of find_path.heuristic, False for
+      plain Dijkstra, or a callable h(node, target).
+    - stats: Optional dict that receives the number of 'settled' nodes.
+    Returns the path as a list of node positions, or None if no path exists.
+    """
+    offsets, targets, xs, ys = graph._adjacency()
+    if heuristic is True:
+        target_x, target_y = xs[target], ys[target]
+        h_fn = lambda n: math.sqrt((xs[n] - target_x) ** 2 + (ys[n] - target_y) ** 2)
+    elif heuristic:
+        h_fn = lambda n: heuristic(n, target)
+    else:
+        h_fn = lambda n: 0
+
+    # Same bookkeeping as networkx's astar_path so equal-cost ties resolve identically
+    counter = count()
+    queue = [(0, next(counter), source, 0, None)]
+    enqueued = {}
+    explored = {}
+    while queue:
+        _, __, current, dist, parent = heappop(queue)
+        if current == target:
+            if stats is not None:
+                stats['settled'] = len(explored)
+            path = [current]
+            node = parent
+            while node is not None:
+                path.append(node)
+                node = explored[node]
+            path.reverse()
+            return path
+        if current in explored:
+            if explored[current] is None:
+                continue
+            qcost, _ = enqueued[current]
+            if qcost < dist:
+                continue
+        explored[current] = parent
+        for e in range(offsets[current], offsets[current + 1]):
+            neighbor = targets[e]
+            ncost = dist + cost[e]
+            if neighbor in enqueued:
+                qcost, hcost = enqueued[neighbor]
+                if qcost <= ncost:
+                    continue
+            else:
+                hcost = h_fn(neighbor)
+            enqueued[neighbor] = ncost, hcost
+            heappush(queue, (ncost + hcost, next(counter), neighbor, ncost, current))
+    if stats is not None:
+        stats['settled'] = len(explored)
+    return None
+
+
+def dijkstra(graph, source, target, cost):
+    """Dijkstra over a CSRGraph; astar without a heuristic."""
+    return astar(graph, source, target, cost, heuristic=False)
+
+
+def astar_path(graph, start_node, end_node, current_time, alpha=1.0, beta=1.0, cost=None, heuristic=True):
+    """
+    Drop-in replacement for find_path.astar_path on a CSRGraph.
+    Takes and returns graph node ids, so the path can be used with the networkx graph.
+    - cost: Optional precomputed graph.edge_costs(current_time, alpha, beta), as a list
+      for the fastest search.
+    - heuristic: As for astar, e.g. landmarks.Landmarks.lower_bound.
+    """
+    if cost is None:
+        cost = graph.edge_costs(current_time, alpha=alpha, beta=beta)
+    path = astar(graph, graph.index_of(start_node), graph.index_of(end_node), cost, heuristic=heuristic)
+    if path is None:
+        return None
+    return graph.node_ids[path].tolist()
+
+
+def shortest_path_tree(graph, source, cost):
+    """
+    One-to-many Dijkstra over a CSRGraph from node position source, run over the whole
+    graph by scipy's compiled search. Serves any number of targets from one origin.
+    Returns (distances, predecessors) arrays over node positions; unreachable nodes have
+    distance inf and predecessor -9999.
+    """
+    from scipy.sparse.csgraph import dijkstra as scipy_dijkstra
+    return scipy_dijkstra(graph.to_sparse(cost), directed=True, indices=source, return_predecessors=True)
+
+
+def tree_path(predecessors, source, target):
+    """Path of node positions from source to target in a shortest_path_tree, or None if unreachable."""
+    path = [target]
+    while path[-1] != source:
+        parent = int(predecessors[path[-1]])
+        if parent < 0:
+            return None
+        path.append(parent)
+    path.reverse()
+    return path
@@ -1,29 +1,48 @@
 import networkx as nx
 import numpy as np
 from datetime import time
+from heapq import heappop, heappush
+from itertools import count
 
 
 # Step 3: Dynamic risk adjustment function
-def adjust_risk_score(base_risk, current_time, rush_hour_factor=2.0, weekday_factor=1.5, winter_factor=1.5):
+RUSH_HOURS = [(time(7, 0), time(9, 0)), (time(16, 0), time(18, 0))]
+
+def risk_time_bucket(current_time):
     """
-    Adjust risk score based on time, day, and month.
-    - rush_hour_factor: Multiplier during rush hour.
-    - weekday_factor: Multiplier for weekdays.
-    - winter_factor: Multiplier for winter months (Dec-Feb).
+    Classify a datetime into the (is_rush_hour, is_weekday, is_winter) bucket.
+    These three flags are all adjust_risk_score uses from the time, so the
+    multiplier is constant within a bucket and there are only 8 buckets.
     """
-    rush_hours = [(time(7, 0), time(9, 0)), (time(16, 0), time(18, 0))]
-    is_rush_hour = any(start <= current_time.time() <= end for start, end in rush_hours)
+    is_rush_hour = any(start <= current_time.time() <= end for start, end in RUSH_HOURS)
     is_weekday = current_time.weekday() < 5  # Monday=0, Sunday=6
     is_winter = current_time.month in [12, 1, 2]
+    return is_rush_hour, is_weekday, is_winter
 
+def apply_risk_factors(base_risk, bucket, rush_hour_factor=2.0, weekday_factor=1.5, winter_factor=1.5):
+    """
+    Adjust risk score for a time bucket from risk_time_bucket.
+    base_risk may be a float or a numpy array of per-edge risks.
+    """
+    is_rush_hour, is_weekday, is_winter = bucket
     adjusted_risk = base_risk
     if is_rush_hour:
-        adjusted_risk *= rush_hour_factor
+        adjusted_risk = adjusted_risk * rush_hour_factor
     if is_weekday:
-        adjusted_risk *= weekday_factor
+        adjusted_risk = adjusted_risk * weekday_factor
     if is_winter:
-        adjusted_risk *= winter_factor
-    
+        adjusted_risk = adjusted_risk * winter_factor
+    return adjusted_risk
+
+def adjust_risk_score(base_risk, current_time, rush_hour_factor=2.0, weekday_factor=1.5, winter_factor=1.5):
+    """
+    Adjust risk score based on time, day, and month.
+    - rush_hour_factor: Multiplier during rush hour.
+    - weekday_factor: Multiplier for weekdays.
+    - winter_factor: Multiplier for winter months (Dec-Feb).
+    """
+    adjusted_risk = apply_risk_factors(base_risk, risk_time_bucket(current_time),
+                                       rush_hour_factor, weekday_factor, winter_factor)
     # return min(adjusted_risk, 1.0)  # Cap at 1.0 (or adjust max as needed)
     return adjusted_risk
 
@@ -34,37 +53,169 @@ def heuristic(u, v, G):
     v_x, v_y = G.nodes[v]['pos'][0], G.nodes[v]['pos'][1]
     return np.sqrt((u_x - v_x) ** 2 + (u_y - v_y) ** 2)
 
-def astar_path(G, start_node, end_node, current_time, alpha=1.0, beta=1.0):
+def astar_path(G, start_node, end_node, current_time, alpha=1.0, beta=1.0, landmarks=None):
     """
     A* algorithm balancing distance and risk.
     - alpha: Weight for distance.
     - beta: Weight for risk.
+    - landmarks: Optional landmarks.Landmarks built for G with the same alpha/beta.
+      Replaces the Euclidean heuristic with the admissible landmark (ALT) lower bound.
     """
+    # The time only selects one of 8 buckets, so classify it once per search
+    bucket = risk_time_bucket(current_time)
+
     def cost(u, v, d):
         length = float(G[u][v]['length'])
         base_risk = float(G[u][v]['risk_score'])
-        adjusted_risk = adjust_risk_score(base_risk, current_time,
-                                          rush_hour_factor=2.0, weekday_factor=1.5, winter_factor=1.5)
+        adjusted_risk = apply_risk_factors(base_risk, bucket,
+                                           rush_hour_factor=2.0, weekday_factor=1.5, winter_factor=1.5)
         # adjusted_risk = base_risk
         return alpha * length + beta * adjusted_risk * length
     
+    if landmarks is not None:
+        if (landmarks.alpha, landmarks.beta) != (alpha, beta):
+            raise ValueError("landmark tables were computed for different alpha/beta weights")
+        h = landmarks.heuristic_for(start_node, end_node)
+    else:
+        h = lambda u, v: heuristic(u, v, G)
+
     try:
         path = nx.astar_path(G, start_node, end_node, 
-                            heuristic=lambda u, v: heuristic(u, v, G), 
+                            heuristic=h, 
                             weight=cost)
         return path
     except nx.NetworkXNoPath:
         return None
 
 # Step 5: Find nearest nodes to start/end coordinates
-def find_nearest_node(G, point):
-    #TODO: Implement a more efficient nearest node search, add internal nodes for more accuracy
+def find_nearest_node(G, point, index=None):
+    """
+    Return the graph node closest to point (x, y in the graph CRS).
+    - index: Optional spatial_index.NodeIndex built once for G. Without it
+      every node is scanned, which is O(n) per call.
+    """
+    # For mid-segment accuracy snap with spatial_index.EdgeIndex and route with astar_split_path.
+    if index is not None:
+        return index.nearest(point)
     coords = [(n, (d['pos'][0], d['pos'][1])) for n, d in G.nodes(data=True)]
     nodes, node_coords = zip(*coords)
     distances = [np.sqrt((x - point[0])**2 + (y - point[1])**2) for x, y in node_coords]
     return nodes[np.argmin(distances)]
 
 
+# Step 6: Temporary split nodes for points snapped onto the middle of an edge
+VIRTUAL_START = -1
+VIRTUAL_END = -2
+
+class SplitGraph:
+    """
+    Per-request view of G with a virtual node at each snapped point.
+    The snapped edges are split around those nodes; G itself is never modified,
+    so concurrent requests can share it.
+    - start_snap, end_snap: spatial_index.EdgeSnap results for the two endpoints.
+    """
+    def __init__(self, G, start_snap, end_snap):
+        self.G = G
+        self.positions = {VIRTUAL_START: start_snap.point, VIRTUAL_END: end_snap.point}
+        self.virtual_edges = {VIRTUAL_START: {}}
+
+        # Leave the start point towards either end of its edge that can be driven to
+        u, v, t = start_snap.u, start_snap.v, start_snap.fraction
+        if G.has_edge(u, v):
+            self._add(VIRTUAL_START, v, G[u][v], 1.0 - t)
+        if G.has_edge(v, u):
+            self._add(VIRTUAL_START, u, G[v][u], t)
+
+        # Reach the end point from either end of its edge
+        a, b, s = end_snap.u, end_snap.v, end_snap.fraction
+        if G.has_edge(a, b):
+            self._add(a, VIRTUAL_END, G[a][b], s)
+        if G.has_edge(b, a):
+            self._add(b, VIRTUAL_END, G[b][a], 1.0 - s)
+
+        # Both points on the same segment: drive straight along it if its direction allows
+        if {u, v} == {a, b}:
+            s = s if (a, b) == (u, v) else 1.0 - s
+            if G.has_edge(u, v) and t <= s:
+                self._add(VIRTUAL_START, VIRTUAL_END, G[u][v], s - t)
+            elif G.has_edge(v, u) and t >= s:
+                self._add(VIRTUAL_START, VIRTUAL_END, G[v][u], t - s)
+
+    def _add(self, u, v, data, fraction):
+        edge = dict(data)
+        edge['length'] = float(data['length']) * fraction
+        self.virtual_edges.setdefault(u, {})[v] = edge
+
+    def position(self, n):
+        if n in self.positions:
+            return self.positions[n]
+        return self.G.nodes[n]['pos']
+
+    def successors(self, n):
+        """Yield (neighbor, edge data) pairs, including virtual edges."""
+        if n in self.G:
+            yield from self.G[n].items()
+        yield from self.virtual_edges.get(n, {}).items()
+
+    def edge(self, u, v):
+        """Edge data for (u, v), as G[u][v] would return for a real edge."""
+        virtual = self.virtual_edges.get(u, {})
+        if v in virtual:
+            return virtual[v]
+        return self.G[u][v]
+
+def astar_split_path(G, start_snap, end_snap, current_time, alpha=1.0, beta=1.0):
+    """
+    A* between two points snapped onto edges, starting and ending mid-segment.
+    Uses the same cost and heuristic as astar_path.
+    Returns (path, split_graph); path runs from VIRTUAL_START to VIRTUAL_END,
+    or is None if no path exists. Use split_graph.edge(u, v) to read the path's edges.
+    """
+    split = SplitGraph(G, start_snap, end_snap)
+    bucket = risk_time_bucket(current_time)
+    target_x, target_y = split.position(VIRTUAL_END)[:2]
+
+    def h(n):
+        x, y = split.position(n)[:2]
+        return np.sqrt((x - target_x) ** 2 + (y - target_y) ** 2)
+
+    # Same bookkeeping as networkx's astar_path so ties are broken the same way
+    counter = count()
+    queue = [(0, next(counter), VIRTUAL_START, 0, None)]
+    enqueued = {}
+    explored = {}
+    while queue:
+        _, __, current, dist, parent = heappop(queue)
+        if current == VIRTUAL_END:
+            path = [current]
+            node = parent
+            while node is not None:
+                path.append(node)
+                node = explored[node]
+            path.reverse()
+            return path, split
+        if current in explored:
+            if explored[current] is None:
+                continue
+            qcost, _ = enqueued[current]
+            if qcost < dist:
+                continue
+        explored[current] = parent
+        for neighbor, data in split.successors(current):
+            length = float(data['length'])
+            adjusted_risk = apply_risk_factors(float(data['risk_score']), bucket)
+            ncost = dist + alpha * length + beta * adjusted_risk * length
+            if neighbor in enqueued:
+                qcost, hcost = enqueued[neighbor]
+                if qcost <= ncost:
+                    continue
+            else:
+                hcost = h(neighbor)
+            enqueued[neighbor] = ncost, hcost
+            heappush(queue, (ncost + hcost, next(counter), neighbor, ncost, current))
+    return None, split
+
+
 # def dijkstra_path(G, start_node, end_node, current_time, alpha=1.0, beta=1.0):
 #     """
 #     Dijkstra's algorithm implementation balancing distance and risk.
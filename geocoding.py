@@ -0,0 +1,257 @@
+"""
+Geocoding shared by /geocode and the chatbot.
+
+Geoapify lookups go through one pooled requests.Session. Responses are cached by
+normalized query text ("Calgary  Tower" and "calgary tower" are the same query):
+    1. an in-memory LRU,
+    2. an optional gazetteer: a local JSON file of known places, which answers without
+       the network (set GEOCODER_GAZETTEER; with no API key it is the only source),
+    3. an optional SQLite cache that survives restarts and is shared by worker processes
+       (set GEOCODE_CACHE to its path; entries expire after GEOCODE_CACHE_TTL seconds).
+Only then is Geoapify asked. Failed requests are not cached.
+
+Gazetteer format, latitude then longitude:
+    {"Calgary Tower": [51.0447, -114.0631], "University Station": [51.0680, -114.1326]}
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+import requests
+from requests.adapters import HTTPAdapter
+
+GEOAPIFY_URL = "https://api.geoapify.com/v1/geocode/search"
+# Suffixes the chatbot appends; a gazetteer entry matches with or without them
+CITY_SUFFIXES = (", calgary, ab", ", calgary")
+
+
+def normalize_query(text):
+    """Case- and whitespace-insensitive form of a query, used as the cache key."""
+    text = re.sub(r"\s*,\s*", ", ", " ".join(str(text).split()))
+    return text.strip(" ,").casefold()
+
+
+def feature_collection(text, lat=None, lon=None, name=None):
+    """A Geoapify-shaped response with one result at (lat, lon), or none."""
+    features = []
+    if lat is not None:
+        features.append({
+            "type": "Feature",
+            "properties": {"formatted": name or text, "lat": lat, "lon": lon, "result_type": "gazetteer"},
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+        })
+    return {"type": "FeatureCollection", "features": features, "query": {"text": text}}
+
+
+def first_coordinates(data):
+    """(latitude, longitude) of the first feature of a search response, or None."""
+    if data.get('features'):
+        coords = data['features'][0]['geometry']['coordinates']
+        return coords[1], coords[0]  # [lat, lon]
+    return None
+
+
+def load_gazetteer(path):
+    """Read a gazetteer file into {normalized name: (name, lat, lon)}."""
+    with open(path, encoding="utf-8") as f:
+        places = json.load(f)
+    return {normalize_query(name): (name, float(lat), float(lon)) for name, (lat, lon) in places.items()}
+
+
+class Geocoder:
+    """
+    Cached Geoapify geocoder; safe to share between threads.
+    - api_key: Default Geoapify key; search() may pass another.
+    - cache_path: SQLite file for the persistent cache, or None.
+    - ttl: Seconds a cached response stays valid (memory and SQLite).
+    - memory_size: Entries kept in the in-memory LRU.
+    - gazetteer_path: Local gazetteer file, or None.
+    - pool_size: Connections kept open to Geoapify.
+    """
+
+    def __init__(self, api_key=None, cache_path=None, ttl=30 * 24 * 3600, memory_size=1024, gazetteer_path=None,
+                 pool_size=16, timeout=10):
+        self.api_key = api_key
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self.timeout = timeout
+        self.gazetteer = load_gazetteer(gazetteer_path) if gazetteer_path else None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if cache_path:
+            self._db = sqlite3.connect(cache_path, check_same_thread=False, timeout=30)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS geocode "
+                             "(query TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL)")
+            self._db.commit()
+        self.counts = {"memory_hits": 0, "gazetteer_hits": 0, "disk_hits": 0, "requests": 0, "errors": 0}
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+    def _remember(self, key, response, created):
+        with self._lock:
+            self._memory[key] = (response, created)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def _from_memory(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[1] >= self.ttl:
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            self.counts["memory_hits"] += 1
+            return entry[0]
+
+    def _from_gazetteer(self, key, text):
+        if self.gazetteer is None:
+            return None
+        candidates = [key] + [key[:-len(suffix)] for suffix in CITY_SUFFIXES if key.endswith(suffix)]
+        for candidate in candidates:
+            place = self.gazetteer.get(candidate)
+            if place is not None:
+                self._count("gazetteer_hits")
+                name, lat, lon = place
+                return feature_collection(text, lat, lon, name)
+        return None
+
+    def _from_disk(self, key):
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT response, created FROM geocode WHERE query = ?", (key,)).fetchone()
+        if row is None or time.time() - row[1] >= self.ttl:
+            return None
+        self._count("disk_hits")
+        return json.loads(row[0]), row[1]
+
+    def _to_disk(self, key, response, created):
+        if self._db is None:
+            return
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO geocode (query, response, created) VALUES (?, ?, ?)",
+                             (key, json.dumps(response), created))
+            self._db.commit()
+
+    def _cached(self, key, text):
+        """The response for key from the memory LRU, gazetteer or SQLite cache, or None."""
+        response = self._from_memory(key)
+        if response is not None:
+            return response
+        response = self._from_gazetteer(key, text)
+        if response is not None:
+            self._remember(key, response, time.time())
+            return response
+        cached = self._from_disk(key)
+        if cached is not None:
+            self._remember(key, *cached)
+            return cached[0]
+        return None
+
+    def _store(self, key, response):
+        created = time.time()
+        self._remember(key, response, created)
+        self._to_disk(key, response, created)
+
+    def search(self, text, api_key=None):
+        """
+        Geoapify search response (a GeoJSON FeatureCollection with at most one feature) for text.
+        Without an API key only the caches and gazetteer are used, and a miss has no features.
+        Raises requests.exceptions.RequestException if Geoapify fails.
+        """
+        key = normalize_query(text)
+        response = self._cached(key, text)
+        if response is not None:
+            return response
+
+        api_key = api_key or self.api_key
+        if not api_key:
+            return feature_collection(text)
+        self._count("requests")
+        try:
+            http_response = self.session.get(GEOAPIFY_URL, params={"text": text, "limit": 1, "apiKey": api_key},
+                                             timeout=self.timeout)
+            http_response.raise_for_status()
+            response = http_response.json()
+        except requests.exceptions.RequestException:
+            self._count("errors")
+            raise
+        self._store(key, response)
+        return response
+
+    async def search_async(self, text, client, api_key=None):
+        """
+        search() for event loops: a cache miss is fetched with `client`, an httpx.AsyncClient
+        owned by the caller, so no thread is blocked while Geoapify answers.
+        Raises the client's exception (httpx.HTTPError) if Geoapify fails.
+        """
+        key = normalize_query(text)
+        response = self._cached(key, text)
+        if response is not None:
+            return response
+
+        api_key = api_key or self.api_key
+        if not api_key:
+            return feature_collection(text)
+        self._count("requests")
+        try:
+            http_response = await client.get(GEOAPIFY_URL, params={"text": text, "limit": 1, "apiKey": api_key},
+                                             timeout=self.timeout)
+            http_response.raise_for_status()
+            response = http_response.json()
+        except Exception:
+            self._count("errors")
+            raise
+        self._store(key, response)
+        return response
+
+    def locate(self, text, api_key=None):
+        """(latitude, longitude) of the first result for text, or None."""
+        try:
+            data = self.search(text, api_key)
+        except requests.exceptions.RequestException as e:
+            print(f"Geocoding failed for {text}: {str(e)}")
+            return None
+        return first_coordinates(data)
+
+    async def locate_async(self, text, client, api_key=None):
+        """locate() through search_async()."""
+        try:
+            data = await self.search_async(text, client, api_key)
+        except Exception as e:
+            print(f"Geocoding failed for {text}: {str(e)}")
+            return None
+        return first_coordinates(data)
+
+    def can_answer_offline(self):
+        return self.gazetteer is not None
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, memory_entries=len(self._memory), disk_cache=self._db is not None,
+                        gazetteer_places=len(self.gazetteer) if self.gazetteer is not None else None)
+
+
+@lru_cache(maxsize=None)
+def default_geocoder():
+    """The process-wide Geocoder, configured from the environment on first use."""
+    return Geocoder(api_key=os.getenv('GEOAPIFY_API_KEY'),
+                    cache_path=os.getenv('GEOCODE_CACHE') or None,
+                    ttl=float(os.getenv('GEOCODE_CACHE_TTL', str(30 * 24 * 3600))),
+                    gazetteer_path=os.getenv('GEOCODER_GAZETTEER') or None)
@@ -0,0 +1,350 @@
+"""
+Versioned binary format for the routing graph, loaded by server.py instead of
+unpickling the networkx graph and all of its Shapely geometries at start-up.
+
+An artifact is a directory holding:
+    manifest.json         format name and version, node/edge counts, CRS, risk categories
+    <name>.npy            the csr_graph.CSRGraph arrays (node_ids, x, y, offsets, ...)
+    edge_road.npy         road record of every edge
+    road_wkb.npy          WKB of every road geometry, packed back to back
+    road_wkb_offsets.npy  where each road's WKB starts in road_wkb.npy
+    roads.json            the remaining edge attributes (name, road_id, ...) per road
+    road_coords_4326.npy  road geometries projected to WGS84, for route_geojson
+    road_coord_offsets.npy  where each road's coordinates start in road_coords_4326.npy
+    road_names.json       display name of each road
+
+Arrays are opened with np.load(mmap_mode='r'): loading only maps the files, and worker
+processes share the pages through the OS page cache instead of each holding a copy. The
+searches read the arrays in place (CSRGraph._adjacency, index_of). What each worker still
+builds privately when it loads the graph are the snapping indexes (the KD-tree and the
+STRtree of edge segments, which own their data) and the 8 cost vectors of RiskProfiles.
+`python benchmarks.py startup` reports that private memory after loading and after the
+first route.
+
+Convert an existing pickle:
+    python graph_artifact.py road_network_processed.pkl --out road_network_graph
+"""
+import argparse
+import json
+import math
+import os
+import pickle
+import shutil
+import time
+from collections.abc import Mapping
+from functools import lru_cache
+
+import numpy as np
+import shapely
+
+from csr_graph import CSRGraph
+from route_geojson import RouteSerializer, display_name, wgs84_coordinates
+
+FORMAT = "safe-way-road-graph"
+FORMAT_VERSION = 2
+CSR_ARRAYS = ('node_ids', 'x', 'y', 'offsets', 'targets', 'length', 'risk_score', 'category_codes')
+# Edge attributes kept per edge in the CSR arrays rather than in the road records
+EDGE_COLUMNS = ('length', 'risk_score', 'risk_category', 'geometry', 'geometry_4326')
+
+
+def _json_value(value):
+    """Edge attribute value as a hashable, JSON-serializable equivalent."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, (list, tuple)):
+        return tuple(_json_value(v) for v in value)
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def write_graph_artifact(G, directory):
+    """
+    Write a networkx road graph (as built by convert_shp_to_graph.py) as an artifact.
+    Edges that share a geometry and their other attributes, i.e. the edges of one road,
+    share a road record, so each road geometry is stored once.
+    The artifact is written next to `directory` and renamed into place when complete.
+    """
+    graph = CSRGraph.from_networkx(G)
+    edge_road = np.empty(graph.number_of_edges, dtype=np.int32)
+    road_index = {}
+    roads = []
+    geometries = []
+    geometries_4326 = []
+    e = 0
+    for n in G.nodes:
+        for data in G[n].values():
+            attributes = tuple((k, _json_value(v)) for k, v in data.items() if k not in EDGE_COLUMNS)
+            geometry = data.get('geometry')
+            key = (id(geometry), attributes)
+            if key not in road_index:
+                road_index[key] = len(roads)
+                roads.append(dict(attributes))
+                geometries.append(geometry)
+                geometries_4326.append(data.get('geometry_4326'))
+            edge_road[e] = road_index[key]
+            e += 1
+
+    wkb = [shapely.to_wkb(g) if g is not None else b"" for g in geometries]
+    wkb_offsets = np.zeros(len(wkb) + 1, dtype=np.int64)
+    wkb_offsets[1:] = np.cumsum([len(b) for b in wkb])
+    blob = np.frombuffer(b"".join(wkb), dtype=np.uint8)
+    crs = G.graph.get('crs', 'epsg:32611')
+    coords_4326, coord_offsets = wgs84_coordinates(geometries, crs, geometries_4326)
+
+    directory = os.path.abspath(directory)
+    staging = directory + ".tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    for name in CSR_ARRAYS:
+        np.save(os.path.join(staging, name + ".npy"), getattr(graph, name))
+    np.save(os.path.join(staging, "edge_road.npy"), edge_road)
+    np.save(os.path.join(staging, "road_wkb.npy"), blob)
+    np.save(os.path.join(staging, "road_wkb_offsets.npy"), wkb_offsets)
+    np.save(os.path.join(staging, "road_coords_4326.npy"), coords_4326)
+    np.save(os.path.join(staging, "road_coord_offsets.npy"), coord_offsets)
+    with open(os.path.join(staging, "roads.json"), "w") as f:
+        json.dump(roads, f)
+    with open(os.path.join(staging, "road_names.json"), "w") as f:
+        json.dump([display_name(road) for road in roads], f)
+    manifest = {
+        "format": FORMAT,
+        "version": FORMAT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "crs": crs,
+        "nodes": graph.number_of_nodes,
+        "edges": graph.number_of_edges,
+        "roads": len(roads),
+        "categories": graph.categories,
+    }
+    # Written last: a directory without a manifest is never loaded
+    with open(os.path.join(staging, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    install_artifact(staging, directory)
+    return manifest
+
+
+def install_artifact(staging, directory):
+    """
+    Move a complete artifact from `staging` (directory + ".tmp") to `directory`, replacing
+    any artifact there. Processes that already mapped the old files keep reading them.
+    """
+    if os.path.exists(directory):
+        old = directory + ".old"
+        shutil.rmtree(old, ignore_errors=True)
+        os.rename(directory, old)
+        os.rename(staging, directory)
+        shutil.rmtree(old, ignore_errors=True)
+    else:
+        os.rename(staging, directory)
+
+
+def is_artifact(directory):
+    return os.path.isfile(os.path.join(directory, "manifest.json"))
+
+
+class GraphArtifact:
+    """
+    A loaded graph artifact.
+    - graph: csr_graph.CSRGraph over the memory-mapped arrays.
+    - manifest: The parsed manifest.json.
+    edge_record(e) rebuilds the attribute dict networkx would hold for edge e.
+    """
+
+    def __init__(self, directory, mmap_mode='r'):
+        with open(os.path.join(directory, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format") != FORMAT:
+            raise ValueError(f"{directory} is not a road graph artifact")
+        if self.manifest.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{directory} has format version {self.manifest.get('version')}, "
+                             f"expected {FORMAT_VERSION}; rebuild it with graph_artifact.py")
+        self.directory = directory
+
+        def load(name):
+            return np.load(os.path.join(directory, name + ".npy"), mmap_mode=mmap_mode)
+
+        # The arrays are saved with CSRGraph's dtypes, so CSRGraph keeps them mapped
+        # instead of copying
+        self.graph = CSRGraph(*(load(name) for name in CSR_ARRAYS), self.manifest["categories"])
+        self.edge_road = load("edge_road")
+        self._wkb = load("road_wkb")
+        self._wkb_offsets = load("road_wkb_offsets")
+        with open(os.path.join(directory, "roads.json")) as f:
+            self.roads = json.load(f)
+        self.geometry = lru_cache(maxsize=4096)(self._decode_geometry)
+        with open(os.path.join(directory, "road_names.json")) as f:
+            names = json.load(f)
+        self.serializer = RouteSerializer(load("road_coords_4326"), load("road_coord_offsets"), names,
+                                          [road.get('road_id') for road in self.roads])
+
+    def _decode_geometry(self, road):
+        start, end = self._wkb_offsets[road], self._wkb_offsets[road + 1]
+        if start == end:
+            return None
+        return shapely.from_wkb(self._wkb[start:end].tobytes())
+
+    def edge_record(self, e):
+        """
+        Attributes of the edge at CSR position e, including its road geometry and
+        'road', its road's index for artifact.serializer.
+        """
+        road = int(self.edge_road[e])
+        record = dict(self.roads[road])
+        record['length'] = float(self.graph.length[e])
+        record['risk_score'] = float(self.graph.risk_score[e])
+        record['risk_category'] = self.graph.categories[self.graph.category_codes[e]]
+        record['geometry'] = self.geometry(road)
+        record['road'] = road
+        return record
+
+    def view(self):
+        return ArtifactGraphView(self)
+
+
+class _NodeView:
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __contains__(self, n):
+        try:
+            self._graph.index_of(n)
+        except KeyError:
+            return False
+        return True
+
+    def __getitem__(self, n):
+        i = self._graph.index_of(n)
+        return {'pos': (float(self._graph.x[i]), float(self._graph.y[i]))}
+
+    def __iter__(self):
+        return iter(self._graph.node_ids.tolist())
+
+    def __len__(self):
+        return self._graph.number_of_nodes
+
+
+class _EdgeView(Mapping):
+    """
+    Attributes of the edge at CSR position e. 'length' and 'risk_score', all a route search
+    reads, come straight from the CSR arrays; the full edge_record() is only built when
+    another attribute is read, as for the edges of the route that is returned.
+    """
+    __slots__ = ('_artifact', '_e', '_length', '_risk_score', '_record')
+
+    def __init__(self, artifact, e, length, risk_score):
+        self._artifact = artifact
+        self._e = e
+        self._length = length
+        self._risk_score = risk_score
+        self._record = None
+
+    def _full(self):
+        if self._record is None:
+            self._record = self._artifact.edge_record(self._e)
+        return self._record
+
+    def __getitem__(self, key):
+        if key == 'length':
+            return self._length
+        if key == 'risk_score':
+            return self._risk_score
+        return self._full()[key]
+
+    def __iter__(self):
+        return iter(self._full())
+
+    def __len__(self):
+        return len(self._full())
+
+
+class _AdjacencyView(Mapping):
+    """Neighbours of the node at CSR position i, mapped to _EdgeView of the edges to them."""
+    __slots__ = ('_artifact', '_edges')
+
+    def __init__(self, artifact, i):
+        csr = artifact.graph
+        self._artifact = artifact
+        self._edges = range(csr.offsets[i], csr.offsets[i + 1])
+
+    def __getitem__(self, v):
+        csr = self._artifact.graph
+        try:
+            j = csr.index_of(v)
+        except KeyError:
+            raise KeyError(v) from None
+        for e in reversed(self._edges):
+            if csr.targets[e] == j:
+                return _EdgeView(self._artifact, e, float(csr.length[e]), float(csr.risk_score[e]))
+        raise KeyError(v)
+
+    def __iter__(self):
+        csr = self._artifact.graph
+        return iter(csr.node_ids[csr.targets[self._edges.start:self._edges.stop]].tolist())
+
+    def __len__(self):
+        return len(self._edges)
+
+    def items(self):
+        csr = self._artifact.graph
+        edges = slice(self._edges.start, self._edges.stop)
+        return [(v, _EdgeView(self._artifact, e, length, risk_score))
+                for v, e, length, risk_score in zip(csr.node_ids[csr.targets[edges]].tolist(), self._edges,
+                                                    csr.length[edges].tolist(), csr.risk_score[edges].tolist())]
+
+
+class ArtifactGraphView:
+    """
+    Read-only stand-in for the networkx graph over a GraphArtifact, covering what the
+    server and find_path.SplitGraph use: G.nodes[n]['pos'], n in G, G[u][v],
+    G[u].items() and G.has_edge(u, v). Edge data are read-only mappings (_EdgeView).
+    """
+
+    def __init__(self, artifact):
+        self.artifact = artifact
+        self.graph = {'crs': artifact.manifest['crs']}
+        self.nodes = _NodeView(artifact.graph)
+
+    def __contains__(self, n):
+        return n in self.nodes
+
+    def __getitem__(self, u):
+        return _AdjacencyView(self.artifact, self.artifact.graph.index_of(u))
+
+    def has_edge(self, u, v):
+        if u not in self.nodes or v not in self.nodes:
+            return False
+        csr = self.artifact.graph
+        i = csr.index_of(u)
+        return bool((csr.targets[csr.offsets[i]:csr.offsets[i + 1]] == csr.index_of(v)).any())
+
+    def number_of_nodes(self):
+        return self.artifact.graph.number_of_nodes
+
+    def number_of_edges(self):
+        return self.artifact.graph.number_of_edges
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("graph", help="Pickled road graph from convert_shp_to_graph.py")
+    parser.add_argument("--out", default=None,
+                        help="Output directory (default: road_network_graph next to the pickle)")
+    args = parser.parse_args()
+
+    out = args.out or os.path.join(os.path.dirname(os.path.abspath(args.graph)), "road_network_graph")
+    with open(args.graph, "rb") as f:
+        G = pickle.load(f)
+    start = time.perf_counter()
+    manifest = write_graph_artifact(G, out)
+    size = sum(os.path.getsize(os.path.join(out, name)) for name in os.listdir(out))
+    print(f"Wrote {manifest['nodes']} nodes, {manifest['edges']} edges and {manifest['roads']} roads "
+          f"({size / 1e6:.1f} MB) to {out} in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
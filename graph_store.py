@@ -0,0 +1,235 @@
+"""
+Routing graph state for server.py, reloaded in the background when the graph files change.
+
+A GraphSnapshot bundles the graph with everything derived from it: spatial indexes, cost
+profiles, route serializer, contraction hierarchies and landmarks. GraphStore holds the
+current snapshot. Its watcher thread polls the files the graph is loaded from, builds a new
+snapshot off the request path when they change, and then swaps the reference. A request
+reads store.snapshot once and uses that object throughout, so it never mixes two graphs,
+and requests in flight finish on the snapshot they started with.
+"""
+import os
+import pickle
+import threading
+import time
+import traceback
+
+from contraction_hierarchy import CHRouter
+from csr_graph import CSRGraph
+from graph_artifact import GraphArtifact, is_artifact
+from landmarks import Landmarks
+from risk_profiles import RiskProfiles
+from route_geojson import RouteSerializer
+from spatial_index import EdgeIndex, NodeIndex
+
+
+class GraphSnapshot:
+    """
+    One loaded routing graph and the state derived from it. Never modified after loading.
+    - G: networkx graph, or a graph_artifact.ArtifactGraphView.
+    - csr: csr_graph.CSRGraph, or None for the 'networkx' backend.
+    - version: The artifact manifest's 'updated' (or 'created') time, or the pickle's mtime.
+    - generation: 1 for the graph loaded at start-up, +1 for every reload.
+    - warnings: Why contraction hierarchies or landmark tables that were asked for are not used.
+    """
+
+    def __init__(self, G, csr, route_serializer, node_index, edge_index, risk_profiles, ch_router, landmarks,
+                 routing_backend, source, version, generation, load_seconds, warnings=()):
+        self.G = G
+        self.csr = csr
+        self.route_serializer = route_serializer
+        self.node_index = node_index
+        self.edge_index = edge_index
+        self.risk_profiles = risk_profiles
+        self.ch_router = ch_router
+        self.landmarks = landmarks
+        self.routing_backend = routing_backend
+        self.source = source
+        self.version = version
+        self.generation = generation
+        self.loaded_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self.load_seconds = load_seconds
+        self.warnings = list(warnings)
+
+    def number_of_nodes(self):
+        return self.csr.number_of_nodes if self.csr is not None else self.G.number_of_nodes()
+
+    def number_of_edges(self):
+        return self.csr.number_of_edges if self.csr is not None else self.G.number_of_edges()
+
+
+def load_snapshot(artifact_path, pickle_path, routing_backend='csr', ch_path=None, landmarks_path=None,
+                  generation=1, alpha=0.1, beta=0.9):
+    """
+    Load the routing graph the way server.py serves it.
+    - artifact_path: Graph artifact directory, used when it holds an artifact.
+    - pickle_path: Pickled networkx graph, loaded otherwise.
+    - routing_backend: 'csr', 'ch' or 'networkx' ('networkx' needs the pickle).
+    - ch_path: Contraction hierarchies for the 'ch' backend.
+    - landmarks_path: Landmark tables for the ALT heuristic, or None for Euclidean A*.
+    - alpha, beta: Distance and risk weights routes are searched with (those of /find_path).
+    Contraction hierarchies or landmarks built for another graph, version of it or weights are
+    not used: routes fall back to CSR A* with the Euclidean heuristic, and the reason is kept
+    in the snapshot's warnings.
+    """
+    start = time.perf_counter()
+    if is_artifact(artifact_path):
+        # Memory-mapped arrays written by graph_artifact.py, shared by all worker processes
+        artifact = GraphArtifact(artifact_path)
+        G = artifact.view()
+        csr = artifact.graph
+        route_serializer = artifact.serializer
+        if routing_backend == 'networkx':
+            print("The networkx backend needs road_network_processed.pkl; using csr with the graph artifact")
+            routing_backend = 'csr'
+        source = artifact_path
+        version = artifact.manifest.get('updated', artifact.manifest['created'])
+    else:
+        with open(pickle_path, "rb") as f:
+            G = pickle.load(f)
+        csr = CSRGraph.from_networkx(G) if routing_backend in ('csr', 'ch') else None
+        # WGS84 road coordinates and display names for the route GeoJSON, resolved once
+        route_serializer = RouteSerializer.from_graph(G)
+        source = pickle_path
+        version = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(os.path.getmtime(pickle_path)))
+    node_index = NodeIndex.from_csr(csr) if csr is not None else NodeIndex.from_graph(G)
+    edge_index = EdgeIndex.from_csr(csr) if csr is not None else EdgeIndex.from_graph(G)
+    # Cost vectors for the 8 rush-hour/weekday/winter buckets, with the alpha/beta used by /find_path
+    risk_profiles = RiskProfiles(csr, alpha=alpha, beta=beta) if csr is not None else None
+    warnings = []
+    ch_router = None
+    if routing_backend == 'ch':
+        try:
+            ch_router = CHRouter.load(csr, ch_path, alpha, beta)
+        except (OSError, ValueError) as e:
+            warnings.append(f"Contraction hierarchies not used, routing with csr: {e}")
+            routing_backend = 'csr'
+    # Landmark bounds from landmarks.py replace the Euclidean A* heuristic
+    landmarks = None
+    if landmarks_path is not None:
+        # The networkx backend has no CSR graph, but the landmark tables were built from one
+        fingerprint = (csr if csr is not None else CSRGraph.from_networkx(G)).fingerprint()
+        try:
+            landmarks = Landmarks.load(landmarks_path, csr.node_ids if csr is not None else list(G.nodes),
+                                       alpha, beta, fingerprint)
+        except (OSError, ValueError) as e:
+            warnings.append(f"Landmarks not used, routing with the Euclidean heuristic: {e}")
+    for warning in warnings:
+        print(warning)
+    return GraphSnapshot(G, csr, route_serializer, node_index, edge_index, risk_profiles, ch_router, landmarks,
+                         routing_backend, source, version, generation, time.perf_counter() - start, warnings)
+
+
+class GraphStore:
+    """
+    The current GraphSnapshot, reloaded when its files change.
+    Arguments are those of load_snapshot; the initial snapshot is loaded by the constructor.
+    """
+
+    def __init__(self, artifact_path, pickle_path, routing_backend='csr', ch_path=None, landmarks_path=None,
+                 alpha=0.1, beta=0.9):
+        self.artifact_path = artifact_path
+        self.pickle_path = pickle_path
+        self.routing_backend = routing_backend
+        self.ch_path = ch_path
+        self.landmarks_path = landmarks_path
+        self.alpha = alpha
+        self.beta = beta
+        self.last_checked = None
+        self.last_error = None
+        self.reloads = 0
+        # Called with the new snapshot after every reload
+        self.listeners = []
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        self._stop = threading.Event()
+        self._signature = self.signature()
+        self.snapshot = self._load(generation=1)
+
+    def _load(self, generation):
+        return load_snapshot(self.artifact_path, self.pickle_path, self.routing_backend, self.ch_path,
+                             self.landmarks_path, generation=generation, alpha=self.alpha, beta=self.beta)
+
+    def signature(self):
+        """
+        Identity of the files the graph is loaded from: (path, inode, size, mtime) of each, or
+        None if the artifact is part-way through being replaced by graph_artifact.install_artifact.
+        """
+        paths = [os.path.join(self.artifact_path, "manifest.json"), self.pickle_path]
+        if self.routing_backend == 'ch':
+            paths.append(self.ch_path)
+        if self.landmarks_path is not None:
+            paths.append(self.landmarks_path)
+        if not is_artifact(self.artifact_path) and os.path.exists(self.artifact_path + ".tmp"):
+            return None
+        stats = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                stats.append((path, None))
+                continue
+            stats.append((path, st.st_ino, st.st_size, st.st_mtime_ns))
+        return tuple(stats)
+
+    def reload(self, force=False):
+        """
+        Load a new snapshot if the graph files changed (or if force) and swap it in.
+        Returns True if the snapshot was replaced. On failure the current snapshot stays
+        and the error is kept in last_error.
+        """
+        with self._reload_lock:
+            self.last_checked = time.strftime("%Y-%m-%dT%H:%M:%S")
+            signature = self.signature()
+            if signature is None or (signature == self._signature and not force):
+                return False
+            # Files still being written fail to load and are retried once they change again
+            self._signature = signature
+            try:
+                snapshot = self._load(generation=self.snapshot.generation + 1)
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                traceback.print_exc()
+                return False
+            self.snapshot = snapshot
+            self.last_error = None
+            self.reloads += 1
+        for listener in self.listeners:
+            listener(snapshot)
+        print(f"Reloaded graph version {snapshot.version} from {snapshot.source} in {snapshot.load_seconds:.2f} s")
+        return True
+
+    def watch(self, interval=30.0):
+        """Check for a new graph every `interval` seconds in a daemon thread."""
+        if self._watcher is not None or interval <= 0:
+            return self._watcher
+
+        def run():
+            while not self._stop.wait(interval):
+                self.reload()
+
+        self._watcher = threading.Thread(target=run, name="graph-reload", daemon=True)
+        self._watcher.start()
+        return self._watcher
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self):
+        snapshot = self.snapshot
+        return {
+            "version": snapshot.version,
+            "generation": snapshot.generation,
+            "source": snapshot.source,
+            "loaded_at": snapshot.loaded_at,
+            "load_seconds": round(snapshot.load_seconds, 3),
+            "nodes": snapshot.number_of_nodes(),
+            "edges": snapshot.number_of_edges(),
+            "routing_backend": snapshot.routing_backend,
+            "heuristic": "alt" if snapshot.landmarks is not None else "euclidean",
+            "reloads": self.reloads,
+            "watching": self._watcher is not None and self._watcher.is_alive(),
+            "last_checked": self.last_checked,
+            "last_error": self.last_error,
+            "warnings": snapshot.warnings,
+        }
@@ -0,0 +1,182 @@
+"""
+ALT (A*, Landmarks, Triangle inequality) heuristic for the risk-weighted routing graph.
+
+A handful of landmarks are picked far apart, and shortest-path costs from and to each
+landmark are precomputed for every node. By the triangle inequality
+    cost(v, t) >= d(L, t) - d(L, v)   and   cost(v, t) >= d(v, L) - d(t, L)
+for any landmark L, which gives A* a lower bound that accounts for risk. The plain
+Euclidean distance does not.
+
+Tables are computed for the cheapest time bucket (no rush hour, weekend, not winter).
+Every other bucket multiplies risk by factors >= 1, so the bound is admissible for
+all of them.
+
+Build offline:
+    python landmarks.py road_network_processed.pkl --out road_network_landmarks.npz
+"""
+import argparse
+import math
+import os
+import pickle
+import time
+
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+
+from csr_graph import CSRGraph
+from risk_profiles import RiskProfiles
+
+# The bucket every other bucket's costs are >= to
+CHEAPEST_BUCKET = (False, False, False)
+
+
+class Landmarks:
+    """
+    Landmark distance tables over CSRGraph node positions.
+    - from_landmark[v, i]: cost from landmark i to node v.
+    - to_landmark[v, i]: cost from node v to landmark i.
+    - node_ids: Graph node id of each position.
+    - fingerprint: CSRGraph.fingerprint() of the graph the tables were built for.
+    Stored as float32; `slack` absorbs the rounding so the bound stays admissible.
+    """
+
+    def __init__(self, node_ids, landmarks, from_landmark, to_landmark, alpha, beta, fingerprint=None):
+        self.node_ids = np.asarray(node_ids)
+        self.fingerprint = fingerprint
+        self._index = None
+        self.landmarks = np.asarray(landmarks, dtype=np.int64)
+        self.from_landmark = np.asarray(from_landmark, dtype=np.float32)
+        self.to_landmark = np.asarray(to_landmark, dtype=np.float32)
+        self.alpha = alpha
+        self.beta = beta
+        finite = np.concatenate([self.from_landmark[np.isfinite(self.from_landmark)],
+                                 self.to_landmark[np.isfinite(self.to_landmark)]])
+        self.slack = 2 * float(np.finfo(np.float32).eps) * float(finite.max(initial=0.0))
+
+    @classmethod
+    def build(cls, graph, alpha, beta, count=16, seed=0):
+        """
+        Pick `count` landmarks by farthest-point selection and compute their tables.
+        - alpha, beta: Cost weights the heuristic is valid for (those used by /find_path).
+        """
+        profiles = RiskProfiles(graph, alpha=alpha, beta=beta)
+        matrix = graph.to_sparse(np.frombuffer(profiles.bucket_costs(CHEAPEST_BUCKET), dtype=np.float64))
+
+        # Start from a random node, then repeatedly add the node farthest from all
+        # landmarks chosen so far. Spread-out landmarks give tighter bounds.
+        rng = np.random.default_rng(seed)
+        landmarks = [int(rng.integers(graph.number_of_nodes))]
+        while len(landmarks) < count:
+            nearest = dijkstra(matrix, indices=landmarks, min_only=True)
+            nearest[~np.isfinite(nearest)] = -1
+            landmarks.append(int(np.argmax(nearest)))
+        if count > 1:
+            # The random start is rarely a good landmark; replace it with the farthest node
+            nearest = dijkstra(matrix, indices=landmarks[1:], min_only=True)
+            nearest[~np.isfinite(nearest)] = -1
+            landmarks[0] = int(np.argmax(nearest))
+
+        from_landmark = dijkstra(matrix, indices=landmarks).T
+        to_landmark = dijkstra(matrix.T.tocsr(), indices=landmarks).T
+        return cls(graph.node_ids, landmarks, from_landmark, to_landmark, alpha, beta, graph.fingerprint())
+
+    def save(self, path):
+        np.savez(path, node_ids=self.node_ids, landmarks=self.landmarks, from_landmark=self.from_landmark,
+                 to_landmark=self.to_landmark, alpha=np.float64(self.alpha), beta=np.float64(self.beta),
+                 graph=np.str_(self.fingerprint or ''))
+
+    @classmethod
+    def load(cls, path, node_ids, alpha, beta, fingerprint):
+        """
+        Tables saved by save(), for the graph whose node ids by position are node_ids and whose
+        CSRGraph.fingerprint() is fingerprint, searched with the cost weights alpha, beta.
+        Raises ValueError if they were built for other nodes, weights or risk scores: searches
+        index the tables by node position, and bounds for other costs may not be admissible.
+        """
+        with np.load(path) as data:
+            # Tables saved before the fingerprint was stored have none, and are refused
+            saved_fingerprint = str(data['graph']) if 'graph' in data.files else ''
+            landmarks = cls(data['node_ids'], data['landmarks'], data['from_landmark'], data['to_landmark'],
+                            float(data['alpha']), float(data['beta']), saved_fingerprint or None)
+        if not np.array_equal(landmarks.node_ids, np.asarray(node_ids)):
+            raise ValueError(f"{path} was built for a graph with different node ids; rebuild it with landmarks.py")
+        if not (math.isclose(landmarks.alpha, alpha) and math.isclose(landmarks.beta, beta)):
+            raise ValueError(f"{path} was built with alpha={landmarks.alpha}, beta={landmarks.beta}, "
+                             f"not alpha={alpha}, beta={beta}; rebuild it with landmarks.py")
+        if landmarks.fingerprint is None:
+            raise ValueError(f"{path} does not record the graph it was built for; rebuild it with landmarks.py")
+        if landmarks.fingerprint != fingerprint:
+            raise ValueError(f"{path} was built for another version of the graph (it changed or was re-scored "
+                             f"since); rebuild it with landmarks.py")
+        return landmarks
+
+    def lower_bound(self, v, t):
+        """Admissible estimate of the cost from node position v to t."""
+        with np.errstate(invalid='ignore'):
+            forward = np.fmax.reduce(self.from_landmark[t] - self.from_landmark[v])
+            backward = np.fmax.reduce(self.to_landmark[v] - self.to_landmark[t])
+        bound = np.fmax(forward, backward)
+        if not bound > self.slack:
+            # Covers nan from landmarks that reach neither node
+            return 0.0
+        return float(bound) - self.slack
+
+    def bounds_to(self, t, source=None, active=4):
+        """
+        lower_bound from every node to t, as one float64 array.
+        - source: If given, only the `active` landmarks giving the best bound for
+          (source, t) are used, which is cheaper and nearly as tight.
+        """
+        columns = slice(None)
+        if source is not None and active < len(self.landmarks):
+            with np.errstate(invalid='ignore'):
+                per_landmark = np.fmax(self.from_landmark[t] - self.from_landmark[source],
+                                       self.to_landmark[source] - self.to_landmark[t])
+            columns = np.argsort(np.nan_to_num(per_landmark, nan=-np.inf))[-active:]
+        with np.errstate(invalid='ignore'):
+            forward = self.from_landmark[t, columns] - self.from_landmark[:, columns]
+            backward = self.to_landmark[:, columns] - self.to_landmark[t, columns]
+            bound = np.fmax(np.fmax.reduce(forward, axis=1), np.fmax.reduce(backward, axis=1))
+        bound = np.nan_to_num(bound.astype(np.float64), nan=0.0, posinf=np.inf) - self.slack
+        return np.maximum(bound, 0.0)
+
+    def index_of(self, node):
+        if self._index is None:
+            self._index = {n: i for i, n in enumerate(self.node_ids.tolist())}
+        return self._index[node]
+
+    def search_heuristic(self, source, target):
+        """Heuristic h(node, target) over node positions for one csr_graph.astar search."""
+        bounds = self.bounds_to(target, source=source)
+        return lambda n, t: bounds[n]
+
+    def heuristic_for(self, start_node, end_node):
+        """The same over graph node ids, in the h(u, v) form networkx's astar_path expects."""
+        bounds = self.bounds_to(self.index_of(end_node), source=self.index_of(start_node))
+        return lambda u, v: bounds[self.index_of(u)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("graph", help="Pickled road graph from convert_shp_to_graph.py")
+    parser.add_argument("--out", default=None,
+                        help="Output .npz (default: road_network_landmarks.npz next to the graph)")
+    parser.add_argument("--count", type=int, default=16, help="Number of landmarks")
+    parser.add_argument("--alpha", type=float, default=0.1, help="Distance weight, as used by /find_path")
+    parser.add_argument("--beta", type=float, default=0.9, help="Risk weight, as used by /find_path")
+    args = parser.parse_args()
+
+    out = args.out or os.path.join(os.path.dirname(os.path.abspath(args.graph)), "road_network_landmarks.npz")
+    with open(args.graph, "rb") as f:
+        G = pickle.load(f)
+    graph = CSRGraph.from_networkx(G)
+    start = time.perf_counter()
+    landmarks = Landmarks.build(graph, args.alpha, args.beta, count=args.count)
+    landmarks.save(out)
+    size = landmarks.from_landmark.nbytes + landmarks.to_landmark.nbytes
+    print(f"Selected {args.count} landmarks in {time.perf_counter() - start:.1f} s; "
+          f"tables use {size / 1e6:.1f} MB. Saved {out}")
+
+
+if __name__ == "__main__":
+    main()
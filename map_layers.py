@@ -0,0 +1,373 @@
+"""
+The road risk layer and the accident hotspot layer, served by viewport.
+
+Plain /road_segments and /accidents send the whole GeoJSON files, which the browser downloads
+and parses on every page load. MapLayers loads both files into memory once, in Web Mercator
+with an STRtree, and answers from there:
+    - Mapbox Vector Tiles, /tiles/<layer>/<z>/<x>/<y>.pbf (see below).
+    - GeoJSON of the features in a bounding box, /road_segments?bbox=...&zoom=..., written
+      out in chunks as it is encoded. With a zoom, lines are simplified (Douglas-Peucker)
+      and thinned as for tiles; features keep all their properties and are not clipped.
+A file is read again when it changes.
+
+Tiles only load what is on screen, at the detail the zoom level can show:
+    - Only the attributes the map styles by or shows in its popups are kept
+      (risk_categ/risk_score/name for roads, hotspot/z_score/description for accidents).
+    - Lines are clipped to the tile (plus a small buffer) and simplified to about a screen
+      pixel at the tile's zoom; lines shorter than that are left out.
+    - Accidents are thinned to one per screen pixel, keeping hot spots.
+Tiles are made on first request and cached on disk under the layer file's version and
+TILE_FORMAT, so replacing road_segments.geojson or accidents.geojson starts a new cache.
+
+Pre-generate tiles with:
+    python map_layers.py --layer road_segments --min-zoom 10 --max-zoom 15
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import threading
+
+import mapbox_vector_tile
+import numpy as np
+import shapely
+from shapely.geometry import shape
+
+from route_geojson import get_transformer
+
+# Tile grid resolution and the extra margin drawn around each tile, in tile units
+EXTENT = 4096
+BUFFER = 64
+# Screen pixels per tile; lines are simplified and points thinned to one of these
+TILE_PIXELS = 256
+# Features per chunk of a streamed GeoJSON response
+CHUNK_FEATURES = 500
+MAX_ZOOM = 16
+WEB_MERCATOR_HALF = 20037508.342789244
+MAX_LATITUDE = 85.0511287798
+# Part of the tile cache key; bumped when the attributes kept in tiles change, so tiles
+# cached by an earlier version of LAYERS are not served
+TILE_FORMAT = 2
+
+# For each layer: its GeoJSON file (in the static folder), the attributes kept under their
+# tile names (with the source column names to take them from, in order of preference) and,
+# for point layers, which features to keep first when thinning.
+LAYERS = {
+    'road_segments': {
+        'file': 'road_segments.geojson',
+        'properties': {'risk_categ': ('risk_categ', 'risk_category'), 'risk_score': ('risk_score',),
+                       'name': ('name',)},
+    },
+    'accidents': {
+        'file': 'accidents.geojson',
+        'properties': {'hotspot': ('hotspot',), 'z_score': ('z_score',), 'description': ('description',)},
+        'keep_first': ('hotspot', 'Hot Spot'),
+    },
+}
+
+
+def tile_bounds(z, x, y):
+    """Web Mercator (EPSG:3857) bounds of tile z/x/y as (minx, miny, maxx, maxy)."""
+    size = 2 * WEB_MERCATOR_HALF / 2 ** z
+    minx = -WEB_MERCATOR_HALF + x * size
+    maxy = WEB_MERCATOR_HALF - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def tiles_covering(bounds, z):
+    """(x, y) of the zoom-z tiles that intersect Web Mercator bounds."""
+    size = 2 * WEB_MERCATOR_HALF / 2 ** z
+    last = 2 ** z - 1
+    x0 = min(max(int((bounds[0] + WEB_MERCATOR_HALF) // size), 0), last)
+    x1 = min(max(int((bounds[2] + WEB_MERCATOR_HALF) // size), 0), last)
+    y0 = min(max(int((WEB_MERCATOR_HALF - bounds[3]) // size), 0), last)
+    y1 = min(max(int((WEB_MERCATOR_HALF - bounds[1]) // size), 0), last)
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def pixel_size(z):
+    """Web Mercator metres per screen pixel at zoom z."""
+    return 2 * WEB_MERCATOR_HALF / 2 ** z / TILE_PIXELS
+
+
+def mercator_bounds(bbox):
+    """Web Mercator bounds of a (min_lon, min_lat, max_lon, max_lat) box."""
+    lat = np.clip([bbox[1], bbox[3]], -MAX_LATITUDE, MAX_LATITUDE)
+    x, y = get_transformer("EPSG:4326", "EPSG:3857").transform([bbox[0], bbox[2]], lat)
+    return x[0], y[0], x[1], y[1]
+
+
+def file_version(path):
+    st = os.stat(path)
+    return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+
+def tile_property(value):
+    """A GeoJSON attribute as a tile value, or None to leave it out."""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if isinstance(value, (float, np.floating)):
+        return round(float(value), 4)
+    if isinstance(value, np.integer):
+        return int(value)
+    return value
+
+
+class MapLayer:
+    """
+    One layer file in memory, indexed for viewport queries.
+    - geometries: shapely geometry array in Web Mercator (EPSG:3857).
+    - geometries_wgs84: The same geometries as read from the file.
+    - properties: Attribute dict of each feature, pruned for tiles.
+    - properties_json: Each feature's full properties, JSON-encoded once at load.
+    """
+
+    def __init__(self, name, geometries_wgs84, properties, properties_json, version):
+        self.name = name
+        self.geometries_wgs84 = geometries_wgs84
+        self.geometries = shapely.transform(geometries_wgs84, _to_mercator)
+        self.properties = properties
+        self.properties_json = properties_json
+        self.version = version
+        self.points = bool(len(geometries_wgs84)) and bool(np.all(shapely.get_type_id(geometries_wgs84) == 0))
+        self.tree = shapely.STRtree(self.geometries)
+        self.bounds = tuple(shapely.total_bounds(self.geometries))
+
+    @classmethod
+    def from_file(cls, name, path, spec):
+        """Read a GeoJSON layer file (WGS84); tile attributes are those in spec['properties']."""
+        version = file_version(path)
+        with open(path, encoding="utf-8") as f:
+            features = [feature for feature in json.load(f)['features'] if feature.get('geometry')]
+        if 'keep_first' in spec:
+            column, value = spec['keep_first']
+            features.sort(key=lambda feature: (feature.get('properties') or {}).get(column) != value)
+        geometries = np.array([shape(feature['geometry']) for feature in features], dtype=object)
+        properties, properties_json = [], []
+        for feature in features:
+            source = feature.get('properties') or {}
+            props = {}
+            for tile_name, columns in spec['properties'].items():
+                value = next((source[c] for c in columns if source.get(c) is not None), None)
+                value = tile_property(value)
+                if value is not None:
+                    props[tile_name] = value
+            properties.append(props)
+            properties_json.append(json.dumps(source))
+        return cls(name, geometries, properties, properties_json, version)
+
+    def select(self, bounds, pixel=None, clip=False):
+        """
+        Features intersecting Web Mercator bounds: (indices, geometries in EPSG:3857).
+        - pixel: Screen pixel size in metres. Lines are simplified to it and dropped if shorter,
+          and points are thinned to one per pixel. None keeps the geometries as they are.
+        - clip: Cut lines at the bounds.
+        """
+        index = np.sort(self.tree.query(shapely.box(*bounds), predicate='intersects'))
+        geometries = self.geometries[index]
+        if pixel is None or len(index) == 0:
+            return index, geometries
+        if self.points:
+            # One point per screen pixel; the layer is ordered so the first one is the one to keep
+            cells = np.floor((shapely.get_coordinates(geometries) - bounds[:2]) / pixel).astype(np.int64)
+            _, first = np.unique(cells, axis=0, return_index=True)
+            keep = np.sort(first)
+        else:
+            if clip:
+                geometries = shapely.clip_by_rect(geometries, *bounds)
+            geometries = shapely.simplify(geometries, pixel, preserve_topology=False)
+            keep = np.flatnonzero(~shapely.is_empty(geometries) & (shapely.length(geometries) >= pixel))
+        return index[keep], geometries[keep]
+
+    def features(self, z, x, y):
+        """The layer's features for tile z/x/y: (geometry, properties) clipped and simplified."""
+        minx, miny, maxx, maxy = tile_bounds(z, x, y)
+        unit = (maxx - minx) / EXTENT
+        clip = (minx - BUFFER * unit, miny - BUFFER * unit, maxx + BUFFER * unit, maxy + BUFFER * unit)
+        index, geometries = self.select(clip, pixel_size(z), clip=True)
+        return [(geometry, self.properties[i]) for i, geometry in zip(index, geometries)]
+
+    def encode(self, z, x, y):
+        """Tile z/x/y of this layer as Mapbox Vector Tile bytes."""
+        features = [{"geometry": geometry, "properties": properties}
+                    for geometry, properties in self.features(z, x, y)]
+        return mapbox_vector_tile.encode([{"name": self.name, "features": features}],
+                                         default_options={"quantize_bounds": tile_bounds(z, x, y),
+                                                          "extents": EXTENT})
+
+    def geojson(self, bbox=None, zoom=None):
+        """
+        The features in bbox (min_lon, min_lat, max_lon, max_lat; None for all) as a GeoJSON
+        FeatureCollection: (feature count, iterator of str chunks).
+        With a zoom, geometries are simplified and thinned for that zoom level; otherwise
+        they are as in the file.
+        """
+        bounds = mercator_bounds(bbox) if bbox is not None else self.bounds
+        pixel = pixel_size(zoom) if zoom is not None else None
+        index, geometries = self.select(bounds, pixel)
+        if pixel is None or self.points:
+            geometries = self.geometries_wgs84[index]
+        else:
+            geometries = shapely.transform(geometries, _to_wgs84)
+        return len(index), self._chunks(index, geometries)
+
+    def _chunks(self, index, geometries):
+        yield '{"type": "FeatureCollection", "features": ['
+        for start in range(0, len(index), CHUNK_FEATURES):
+            stop = min(start + CHUNK_FEATURES, len(index))
+            geometry_json = shapely.to_geojson(geometries[start:stop])
+            chunk = ", ".join(f'{{"type": "Feature", "geometry": {geometry}, "properties": {self.properties_json[i]}}}'
+                              for i, geometry in zip(index[start:stop], geometry_json))
+            yield chunk if start == 0 else ", " + chunk
+        yield ']}'
+
+
+def _to_mercator(coords):
+    return np.column_stack(get_transformer("EPSG:4326", "EPSG:3857").transform(coords[:, 0], coords[:, 1]))
+
+
+def _to_wgs84(coords):
+    return np.column_stack(get_transformer("EPSG:3857", "EPSG:4326").transform(coords[:, 0], coords[:, 1]))
+
+
+class MapLayers:
+    """
+    The LAYERS files in static_dir, as tiles cached on disk and as bbox queries; safe to
+    share between threads.
+    - cache_dir: Tile cache directory, or None to make every tile on request.
+    - max_zoom: Highest zoom served; the map scales up these tiles beyond it.
+    """
+
+    def __init__(self, static_dir, cache_dir=None, layers=LAYERS, max_zoom=MAX_ZOOM):
+        self.static_dir = static_dir
+        self.cache_dir = cache_dir
+        self.specs = layers
+        self.max_zoom = max_zoom
+        self._layers = {}
+        # _lock guards _layers and counts; a layer's load lock is held while its file is parsed
+        self._lock = threading.Lock()
+        self._load_locks = {name: threading.Lock() for name in layers}
+        self.counts = {"cache_hits": 0, "generated": 0}
+
+    def layer(self, name):
+        """
+        The MapLayer for name, read again if its file changed. Raises KeyError for unknown
+        layers and FileNotFoundError if the file is missing.
+        """
+        spec = self.specs[name]
+        path = os.path.join(self.static_dir, spec['file'])
+        version = file_version(path)
+        with self._lock:
+            layer = self._layers.get(name)
+        if layer is not None and layer.version == version:
+            return layer
+        # Parsing a changed file takes seconds: only requests for this layer wait for it,
+        # one thread parses it, and the others then find it loaded
+        with self._load_locks[name]:
+            with self._lock:
+                layer = self._layers.get(name)
+            if layer is None or layer.version != version:
+                layer = MapLayer.from_file(name, path, spec)
+                with self._lock:
+                    self._layers[name] = layer
+                self._prune_cache(name, self._cache_key(layer))
+            return layer
+
+    @staticmethod
+    def _cache_key(layer):
+        return f"{layer.version}-{TILE_FORMAT}"
+
+    def _prune_cache(self, name, version):
+        """Remove cached tiles of earlier versions of the layer file or of TILE_FORMAT."""
+        directory = os.path.join(self.cache_dir, name) if self.cache_dir else None
+        if directory is None or not os.path.isdir(directory):
+            return
+        for entry in os.listdir(directory):
+            if entry != version:
+                shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+
+    def preload(self):
+        """Load every layer whose file exists, so the first requests do not wait for it."""
+        for name in self.specs:
+            try:
+                self.layer(name)
+            except FileNotFoundError:
+                print(f"No {self.specs[name]['file']} in {self.static_dir}; {name} tiles and queries are unavailable")
+
+    def query(self, name, bbox=None, zoom=None):
+        """MapLayer.geojson() of layer `name`. Raises KeyError and FileNotFoundError as layer()."""
+        return self.layer(name).geojson(bbox, zoom)
+
+    def valid(self, name, z, x, y):
+        return name in self.specs and 0 <= z <= self.max_zoom and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+    def tile(self, name, z, x, y):
+        """
+        Mapbox Vector Tile bytes of layer `name` at z/x/y, from the disk cache if there.
+        Raises KeyError for unknown layers and ValueError for tiles outside the grid or max_zoom.
+        """
+        if name not in self.specs:
+            raise KeyError(name)
+        if not self.valid(name, z, x, y):
+            raise ValueError(f"No tile {z}/{x}/{y}")
+        layer = self.layer(name)
+        path = None
+        if self.cache_dir:
+            path = os.path.join(self.cache_dir, name, self._cache_key(layer), str(z), str(x), f"{y}.pbf")
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+                with self._lock:
+                    self.counts["cache_hits"] += 1
+                return data
+            except FileNotFoundError:
+                pass
+        data = layer.encode(z, x, y)
+        with self._lock:
+            self.counts["generated"] += 1
+        if path is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written aside and renamed, so concurrent readers never see a partial tile
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return data
+
+    def seed(self, name, min_zoom, max_zoom):
+        """Make and cache every tile of the layer's extent from min_zoom to max_zoom; returns the count."""
+        layer = self.layer(name)
+        count = 0
+        for z in range(min_zoom, min(max_zoom, self.max_zoom) + 1):
+            for x, y in tiles_covering(layer.bounds, z):
+                self.tile(name, z, x, y)
+                count += 1
+        return count
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, layers={name: {"features": len(layer.properties), "version": layer.version}
+                                             for name, layer in self._layers.items()})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--layer", choices=sorted(LAYERS), action="append",
+                        help="Layer to pre-generate (repeatable; default: all)")
+    parser.add_argument("--min-zoom", type=int, default=10)
+    parser.add_argument("--max-zoom", type=int, default=15)
+    parser.add_argument("--static", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "static"),
+                        help="Folder holding the layer GeoJSON files")
+    parser.add_argument("--cache", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "tile_cache"),
+                        help="Tile cache directory (as TILE_CACHE for server.py)")
+    args = parser.parse_args()
+
+    tiles = MapLayers(args.static, args.cache)
+    for name in args.layer or sorted(LAYERS):
+        count = tiles.seed(name, args.min_zoom, args.max_zoom)
+        print(f"{name}: {count} tiles for zoom {args.min_zoom}-{min(args.max_zoom, tiles.max_zoom)} in {args.cache}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+from array import array
+from itertools import product
+
+import numpy as np
+
+from find_path import apply_risk_factors, risk_time_bucket
+
+# Every (is_rush_hour, is_weekday, is_winter) combination returned by risk_time_bucket
+TIME_BUCKETS = list(product((False, True), repeat=3))
+
+
+class RiskProfiles:
+    """
+    Precomputed per-edge search costs alpha*length + beta*adjusted_risk*length for
+    each of the 8 time buckets of a CSRGraph. A request only has to pick a vector.
+    """
+
+    def __init__(self, graph, alpha=1.0, beta=1.0, rush_hour_factor=2.0, weekday_factor=1.5, winter_factor=1.5):
+        """
+        - graph: csr_graph.CSRGraph to build the cost vectors for.
+        - alpha, beta: Distance and risk weights, as in find_path.astar_path.
+        - rush_hour_factor, weekday_factor, winter_factor: As in find_path.adjust_risk_score.
+        """
+        self.graph = graph
+        self.alpha = alpha
+        self.beta = beta
+        self.factors = dict(rush_hour_factor=rush_hour_factor, weekday_factor=weekday_factor,
+                            winter_factor=winter_factor)
+        # array('d') packs 8 bytes per edge like numpy, but indexes about as fast as a
+        # list inside the Python search loop
+        self._costs = {}
+        for bucket in TIME_BUCKETS:
+            adjusted_risk = apply_risk_factors(graph.risk_score, bucket, **self.factors)
+            cost = alpha * graph.length + beta * adjusted_risk * graph.length
+            self._costs[bucket] = array('d', cost.tobytes())
+
+    @property
+    def nbytes(self):
+        return sum(c.itemsize * len(c) for c in self._costs.values())
+
+    def bucket_costs(self, bucket):
+        """Cost vector for one of TIME_BUCKETS."""
+        return self._costs[bucket]
+
+    def costs(self, current_time):
+        """Cost vector for the bucket current_time falls in, ready for csr_graph.astar."""
+        return self.bucket_costs(risk_time_bucket(current_time))
+
+    def cost_array(self, current_time):
+        """The same cost vector as a numpy view, without copying."""
+        return np.frombuffer(self.costs(current_time), dtype=np.float64)
+
+    def adjusted_risk(self, edge_ids, current_time):
+        """Time-adjusted risk of the given edges."""
+        return apply_risk_factors(self.graph.risk_score[edge_ids], risk_time_bucket(current_time), **self.factors)
+
+    def total_risk(self, edge_ids, current_time):
+        """Sum of time-adjusted risk along a route's edges, in one vectorized pass."""
+        return float(self.adjusted_risk(edge_ids, current_time).sum())
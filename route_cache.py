@@ -0,0 +1,89 @@
+"""
+LRU/TTL cache of encoded /find_path responses.
+
+A route only depends on its snapped start and end nodes, the risk time bucket and the cost
+weights, so server.py keys responses on (graph generation, start_node, end_node, bucket,
+alpha, beta) and stores the JSON body it sent. A hit returns those bytes without searching
+or serializing again. The graph generation in the key means a route computed on a graph
+that has since been reloaded is never served; the cache is also cleared on reload so
+those entries do not hold memory until they age out.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class RouteCache:
+    """
+    Least-recently-used cache of bytes values, limited by their total size.
+    - max_bytes: Size limit of the stored values; 0 disables the cache.
+    - ttl: Seconds an entry stays valid after it is stored; None keeps it until evicted.
+    """
+
+    def __init__(self, max_bytes=64 * 2 ** 20, ttl=600.0, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """The value stored under key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires = entry
+            if expires is not None and self._clock() >= expires:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Store value, evicting the least recently used entries to stay within max_bytes."""
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        expires = self._clock() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            while self.bytes + size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            self._entries[key] = (value, expires)
+            self.bytes += size
+
+    def _remove(self, key):
+        value, _ = self._entries.pop(key)
+        self.bytes -= len(value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
@@ -0,0 +1,164 @@
+"""
+Route serialization for /find_path.
+
+Each route edge is drawn with its road's geometry in WGS84 and labelled with the road's
+display name. Both are resolved once per road when the graph is built or loaded, so
+serializing a route needs no GeoDataFrame, CRS transform or per-row name lookups.
+"""
+import math
+from functools import lru_cache
+
+import numpy as np
+import shapely
+from pyproj import Transformer
+
+# /find_path reports travel time at a flat 50 km/h
+SPEED_MPS = 13.89
+
+
+def is_missing(value):
+    """True for None and NaN, the values pd.isna treats as missing for a scalar."""
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def display_name(attributes):
+    """
+    Name shown for a road: its name, else its ref, else its highway type.
+    - attributes: Edge attributes of one of the road's edges.
+    """
+    name = attributes.get('name')
+    if isinstance(name, (list, tuple)):
+        name = name[0] if name else 'Unnamed Road'
+    if is_missing(name):
+        name = attributes.get('ref')
+    if is_missing(name):
+        name = (attributes.get('highway') or 'Unnamed Road').capitalize()
+    return name
+
+
+def road_key(attributes):
+    """
+    Edges sharing a geometry, display name and road_id are the edges of one road. The
+    geometry is compared by identity: add_road_to_graph gives all of a road's edges the
+    same LineString, and edge copies (find_path.SplitGraph) keep it.
+    """
+    return id(attributes['geometry']), display_name(attributes), attributes.get('road_id')
+
+
+@lru_cache(maxsize=None)
+def get_transformer(from_crs, to_crs):
+    """
+    Shared always_xy Transformer for a CRS pair. Building one costs far more than
+    transforming a few points, so each pair is only built once per process.
+    """
+    return Transformer.from_crs(from_crs, to_crs, always_xy=True)
+
+
+def wgs84_coordinates(geometries, crs='epsg:32611', geometries_4326=None):
+    """
+    Road LineStrings as EPSG:4326 coordinates.
+    Returns (coords, offsets): road i has coords[offsets[i]:offsets[i + 1]].
+    - geometries_4326: The same roads already projected at graph build time (the edges'
+      'geometry_4326'); used as-is when given for every road, else `geometries` are
+      projected in one call.
+    """
+    if geometries_4326 is not None and not any(g is None for g in geometries_4326):
+        coords, index = shapely.get_coordinates(np.asarray(geometries_4326, dtype=object), return_index=True)
+    else:
+        coords, index = shapely.get_coordinates(np.asarray(geometries, dtype=object), return_index=True)
+        lon, lat = get_transformer(crs, 'epsg:4326').transform(coords[:, 0], coords[:, 1])
+        coords = np.column_stack((lon, lat))
+    offsets = np.zeros(len(geometries) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(index, minlength=len(geometries)))
+    return coords, offsets
+
+
+class RouteSerializer:
+    """
+    Builds the /find_path FeatureCollection from route edge records, each resolved to an
+    index into the per-road tables (road_of).
+    - coords, offsets: WGS84 road coordinates, as returned by wgs84_coordinates.
+    - names: Display name of each road.
+    - road_ids: 'road_id' attribute of each road, reported as the feature's osmid.
+    - road_index: road_key -> road for the edges of a networkx graph (from_graph); edge
+      records of a graph artifact carry their 'road' instead.
+    """
+
+    def __init__(self, coords, offsets, names, road_ids, road_index=None):
+        self.coords = coords
+        self.offsets = offsets
+        self.names = list(names)
+        self.road_ids = list(road_ids)
+        self.road_index = road_index
+        self._coordinates = lru_cache(maxsize=16384)(self._road_coordinates)
+
+    @classmethod
+    def from_graph(cls, G):
+        """
+        Build the tables for a networkx road graph. G is not modified: the edges are
+        mapped to their roads by road_key.
+        """
+        roads = {}
+        geometries = []
+        geometries_4326 = []
+        names = []
+        road_ids = []
+        for u, v, data in G.edges(data=True):
+            key = road_key(data)
+            if key not in roads:
+                roads[key] = len(geometries)
+                geometries.append(data['geometry'])
+                geometries_4326.append(data.get('geometry_4326'))
+                names.append(key[1])
+                road_ids.append(data.get('road_id'))
+        coords, offsets = wgs84_coordinates(geometries, G.graph.get('crs', 'epsg:32611'), geometries_4326)
+        return cls(coords, offsets, names, road_ids, roads)
+
+    def road_of(self, data):
+        """Road index of a route edge record: by road_key for a networkx graph, else its 'road'."""
+        if self.road_index is not None:
+            return self.road_index[road_key(data)]
+        return data['road']
+
+    def _road_coordinates(self, road):
+        # Responses only read the cached lists, so they can be shared between requests
+        return self.coords[self.offsets[road]:self.offsets[road + 1]].tolist()
+
+    def feature_collection(self, route_edge_data, total_risk):
+        """
+        The route GeoJSON: one LineString feature per route edge plus route totals.
+        - route_edge_data: Edge attribute dicts along the route: the graph's own, or the
+          records of a graph artifact.
+        - total_risk: Time-adjusted risk of the route, reported as-is.
+        """
+        roads = [self.road_of(d) for d in route_edge_data]
+        lengths = np.fromiter((d['length'] for d in route_edge_data), dtype=np.float64, count=len(roads))
+        travel_times = np.where(lengths != 0, lengths / SPEED_MPS, 0.0)
+
+        features = [{
+            "type": "Feature",
+            "geometry": {"type": "LineString", "coordinates": self._coordinates(road)},
+            "properties": {
+                "osmid": self.road_ids[road],
+                "name": self.names[road],
+                "length": length,
+                "travel_time": travel_time,
+                "total_risk": None,
+                "risk_category": None,
+            },
+        } for road, length, travel_time in zip(roads, lengths.tolist(), travel_times.tolist())]
+
+        risk_category_counts = {}
+        for d in route_edge_data:
+            risk_category_counts[d["risk_category"]] = risk_category_counts.get(d["risk_category"], 0) + 1
+
+        return {
+            "type": "FeatureCollection",
+            "features": features,
+            "properties": {
+                "total_length": sum(lengths.tolist()),
+                "total_travel_time": sum(travel_times.tolist()),
+                "total_risk": total_risk,
+                "risk_category_counts": risk_category_counts,
+            },
+        }
@@ -0,0 +1,237 @@
+"""
+Route searches in worker processes, so /find_path can use more than one core.
+
+A* in Python holds the GIL, so however many threads serve requests, searches in one process
+run one at a time. RoutingPool runs them in N worker processes that share one read-only
+graph instead of each holding a copy:
+    - 'fork' (the default for the first workers where available): workers are forked from
+      the server after its graph is loaded and share its memory copy-on-write. gc.freeze()
+      before forking keeps the garbage collector from writing to (and so copying) the
+      inherited objects; the numpy arrays of the CSR graph and cost profiles are never
+      written. Forking is only safe while the server has no other threads, so the pool must
+      be created before the GraphStore watcher or the web server starts any.
+    - 'forkserver'/'spawn': each worker loads the graph itself, which is cheap and shared
+      when it is a graph artifact (graph_artifact.py), since every worker maps the same files.
+      Restarts on reload use one of these (forkserver where available): they run in the
+      watcher thread while request threads are live, and a forked child could inherit a
+      lock one of them holds.
+Workers return node paths, whole /find_path response bodies, or the bodies of a group of
+routes from one origin for /find_paths/batch (route_group below), or rows of the /matrix
+cost matrices (cost_matrix.py): the route GeoJSON built as
+server.py builds it in-process (search_path and route_geojson below) and encoded to JSON in
+the worker. Encoding a route costs more than searching it, and passing bytes back costs
+the server almost nothing, whereas unpickling a GeoJSON dict would again be serial work.
+
+The pool serves one graph generation; GraphStore reloads restart it (see restart()).
+"""
+import gc
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import networkx as nx
+
+import csr_graph
+from cost_matrix import snapshot_matrices
+from find_path import adjust_risk_score, astar_path, risk_time_bucket
+from graph_store import load_snapshot
+
+# The worker's GraphSnapshot: inherited from the parent on fork, loaded by _init_worker otherwise
+_snapshot = None
+
+
+def search_path(graph, start_node, end_node, current_time, alpha, beta):
+    """
+    Node path of the least-cost route on a GraphSnapshot with the snapshot's backend.
+    Raises networkx.NetworkXNoPath if end_node cannot be reached.
+    """
+    if graph.ch_router is not None:
+        return graph.ch_router.shortest_path(start_node, end_node, risk_time_bucket(current_time))
+    if graph.csr is not None:
+        csr = graph.csr
+        heuristic = True
+        if graph.landmarks is not None:
+            heuristic = graph.landmarks.search_heuristic(csr.index_of(start_node), csr.index_of(end_node))
+        return csr_graph.astar_path(csr, start_node, end_node, current_time,
+                                    cost=graph.risk_profiles.costs(current_time), heuristic=heuristic)
+    return astar_path(graph.G, start_node, end_node, current_time, alpha=alpha, beta=beta,
+                      landmarks=graph.landmarks)
+
+
+def route_geojson(graph, path, current_time):
+    """The /find_path route GeoJSON of a node path on a GraphSnapshot."""
+    G, csr = graph.G, graph.csr
+    route_edge_data = [G[u][v] for u, v in zip(path[:-1], path[1:])]
+    if csr is not None:
+        route_edge_ids = csr.edge_ids([csr.index_of(n) for n in path])
+        total_risk = graph.risk_profiles.total_risk(route_edge_ids, current_time)
+    else:
+        total_risk = sum(adjust_risk_score(d["risk_score"], current_time) for d in route_edge_data)
+    return graph.route_serializer.feature_collection(route_edge_data, total_risk)
+
+
+def encode_route(path_geojson):
+    """JSON body of a route, byte-for-byte as Flask's jsonify encodes it outside debug mode."""
+    return json.dumps(path_geojson, sort_keys=True, separators=(",", ":")).encode() + b"\n"
+
+
+def uses_tree(graph):
+    """Whether route_group answers from a shortest path tree on this GraphSnapshot (CSR without CH)."""
+    return graph.csr is not None and graph.ch_router is None
+
+
+def route_group(graph, start_node, end_nodes, current_time, alpha, beta):
+    """
+    Routes from start_node to each of end_nodes, as (route totals, encoded route GeoJSON)
+    or None where there is no route.
+    When uses_tree(), one Dijkstra over the graph serves every destination, however many, with
+    the same edge costs as search_path. Its routes are exact least-cost routes and depend only
+    on the origin, destination and time bucket. They are the routes search_path finds when its
+    search is exact (ALT landmarks), but can cost less than its Euclidean A* routes, whose
+    heuristic is not a lower bound on the risk-weighted cost. Otherwise (CH, networkx) each
+    destination is a search_path() query.
+    """
+    if uses_tree(graph):
+        csr = graph.csr
+        source = csr.index_of(start_node)
+        _, predecessors = csr_graph.shortest_path_tree(csr, source, graph.risk_profiles.costs(current_time))
+        paths = []
+        for end_node in end_nodes:
+            path = csr_graph.tree_path(predecessors, source, csr.index_of(end_node))
+            paths.append(csr.node_ids[path].tolist() if path is not None else None)
+    else:
+        paths = []
+        for end_node in end_nodes:
+            try:
+                paths.append(search_path(graph, start_node, end_node, current_time, alpha, beta))
+            except nx.NetworkXNoPath:
+                paths.append(None)
+    routes = []
+    for path in paths:
+        if not path:
+            routes.append(None)
+            continue
+        path_geojson = route_geojson(graph, path, current_time)
+        routes.append((path_geojson['properties'], encode_route(path_geojson)))
+    return routes
+
+
+def _init_worker(load_args):
+    global _snapshot
+    if _snapshot is None:
+        _snapshot = load_snapshot(*load_args)
+
+
+def _generation():
+    return _snapshot.generation
+
+
+def _node_path(start_node, end_node, current_time, alpha, beta):
+    return search_path(_snapshot, start_node, end_node, current_time, alpha, beta)
+
+
+def _route_json(start_node, end_node, current_time, alpha, beta):
+    path = search_path(_snapshot, start_node, end_node, current_time, alpha, beta)
+    if not path:
+        return None
+    path_geojson = route_geojson(_snapshot, path, current_time)
+    return path_geojson['properties'], encode_route(path_geojson)
+
+
+def _route_group(start_node, end_nodes, current_time, alpha, beta):
+    return route_group(_snapshot, start_node, end_nodes, current_time, alpha, beta)
+
+
+def _cost_matrices(origin_nodes, destination_nodes, current_time, alpha, beta):
+    return snapshot_matrices(_snapshot, origin_nodes, destination_nodes, current_time, alpha, beta)
+
+
+class RoutingPool:
+    """
+    Worker processes answering node-snapped route queries on the graph of a GraphStore.
+    - store: graph_store.GraphStore whose current snapshot the workers serve.
+    - processes: Number of worker processes.
+    - start_method: multiprocessing start method of the first workers; default 'fork' where
+      available, else 'spawn'. Create the pool before any other thread starts when it forks.
+    - restart_method: start method of the workers started by restart() on reload, which must
+      not be 'fork'; default 'forkserver' where available, else 'spawn'.
+    """
+
+    def __init__(self, store, processes, start_method=None, restart_method=None):
+        methods = multiprocessing.get_all_start_methods()
+        if start_method is None:
+            start_method = 'fork' if 'fork' in methods else 'spawn'
+        if restart_method is None:
+            restart_method = 'forkserver' if 'forkserver' in methods else 'spawn'
+        if restart_method == 'fork':
+            raise ValueError("restart_method cannot be 'fork': restarts run while other threads are live")
+        self.store = store
+        self.processes = processes
+        self.start_method = start_method
+        self.restart_method = restart_method
+        self.generation = None
+        self._executor = None
+        self.restart(store.snapshot)
+
+    def restart(self, snapshot):
+        """
+        Start workers for snapshot and then retire the old ones; use as a GraphStore listener.
+        Queries already submitted finish on the old workers, which then exit. Until the new
+        workers are up, self.generation still names the old graph.
+        The first workers use start_method, the workers of every restart restart_method.
+        """
+        global _snapshot
+        store = self.store
+        load_args = (store.artifact_path, store.pickle_path, store.routing_backend, store.ch_path,
+                     store.landmarks_path, snapshot.generation, store.alpha, store.beta)
+        old = self._executor
+        start_method = self.start_method if old is None else self.restart_method
+        if start_method == 'fork':
+            _snapshot = snapshot
+            gc.collect()
+            gc.freeze()
+        elif _snapshot is not None:
+            # The snapshot the first workers were forked with becomes collectable again
+            _snapshot = None
+            gc.unfreeze()
+        executor = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context(start_method),
+                                       initializer=_init_worker, initargs=(load_args,))
+        # Start (and, without fork, load) the workers now rather than on the first queries
+        generations = {f.result() for f in [executor.submit(_generation) for _ in range(self.processes)]}
+        assert generations == {snapshot.generation}, f"workers loaded generations {generations}"
+        self._executor = executor
+        self.generation = snapshot.generation
+        if old is not None:
+            old.shutdown(wait=False)
+
+    def submit_node_path(self, start_node, end_node, current_time, alpha, beta):
+        """Future of search_path() in a worker."""
+        return self._executor.submit(_node_path, start_node, end_node, current_time, alpha, beta)
+
+    def submit_route_json(self, start_node, end_node, current_time, alpha, beta):
+        """
+        Future of (route totals, encoded route GeoJSON) computed in a worker; None if the
+        path is empty. The totals are the GeoJSON's 'properties', for logging.
+        """
+        return self._executor.submit(_route_json, start_node, end_node, current_time, alpha, beta)
+
+    def submit_route_group(self, start_node, end_nodes, current_time, alpha, beta):
+        """Future of route_group() in a worker."""
+        return self._executor.submit(_route_group, start_node, end_nodes, current_time, alpha, beta)
+
+    def submit_cost_matrices(self, origin_nodes, destination_nodes, current_time, alpha, beta):
+        """Future of cost_matrix.snapshot_matrices() for some origins, in a worker."""
+        return self._executor.submit(_cost_matrices, origin_nodes, destination_nodes, current_time, alpha, beta)
+
+    def node_path(self, start_node, end_node, current_time, alpha, beta):
+        return self.submit_node_path(start_node, end_node, current_time, alpha, beta).result()
+
+    def route_json(self, start_node, end_node, current_time, alpha, beta):
+        return self.submit_route_json(start_node, end_node, current_time, alpha, beta).result()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        return {"processes": self.processes, "start_method": self.start_method,
+                "restart_method": self.restart_method, "generation": self.generation}
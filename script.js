@@ -41,78 +41,72 @@ document.addEventListener('DOMContentLoaded', function () {
             const baseMaps = { "Mapbox Streets": baseMap, "Risk & Accident View": customMap };
             const overlayMaps = {};
 
-            Promise.all([
-                fetch('http://localhost:5000/road_segments')
-                    .then(res => res.json())
-                    .then(data => {
-                        const layer = L.geoJSON(data, {
-                            style: feature => {
-                               // const category = feature.properties.risk_categ || 'Unknown';
-                                const category = feature.properties.risk_categ || feature.properties.risk_category || 'Unknown';
-                                console.log('Risk Category:', category);  // Debugging line
-
-                                let color = 'gray';
-                                
-                                switch (category) {
-                                    case 'Very Low': color = 'green'; break;
-                                    case 'Low': color = 'limegreen'; break;
-                                    case 'Medium': color = 'orange'; break;
-                                    case 'High': color = 'orangered'; break;
-                                    case 'Very High': color = 'darkred'; break;
-                                    default: color = 'gray';
-                                }
+            // Both layers come as vector tiles (/tiles/<layer>/<z>/<x>/<y>.pbf), so only the visible area is loaded
+            const roadColor = category => {
+                switch (category) {
+                    case 'Very Low': return 'green';
+                    case 'Low': return 'limegreen';
+                    case 'Medium': return 'orange';
+                    case 'High': return 'orangered';
+                    case 'Very High': return 'darkred';
+                    default: return 'gray';
+                }
+            };
 
-                            return { color, weight: 2 };
-                        },
-                        onEachFeature: (feature, layer) => {
-                            const props = feature.properties || {};
-                            //const osmid = Array.isArray(props.osmid) ? props.osmid.join(', ') : (props.osmid || 'Unknown');
-                            const name = props.name || 'Unnamed';
-                            //const category = props.risk_category || 'Unknown';
-                            const category = props.risk_categ || props.risk_category || 'Unknown';
-                            // Bind a popup to each road segment with details
-                            layer.bindPopup(`<b>Name:</b> ${name}<br><b>Risk:</b> ${category}`);
-                        }
-                    }).addTo(map);
-                    overlayMaps["Calgary Roads (Risk)"] = layer; // Add the layer to overlayMaps
-                }),
-                
-                fetch('http://localhost:5000/accidents').then(res => res.json()).then(data => {
-                    const layer = L.geoJSON(data, {
-                        pointToLayer: (feature, latlng) => {
-                            const isHotSpot = feature.properties.hotspot === "Hot Spot"; // Assuming 'hotspot' field exists
-                            const zScore = feature.properties.z_score || 0; // Assuming z_score exists and can be used
-                            let color = 'yellow'; // Default for non-hotspot
-                
-                            if (isHotSpot) {
-                                color = 'red'; // Hot Spot accidents are red
-                            } else if (zScore > 2) {
-                                color = 'orange'; // Higher z_score indicates more risk
-                            } else {
-                                color = 'green'; // Lower risk accidents
-                            }
-                
-                            return L.circleMarker(latlng, {
-                                radius: 4, // Adjust size as needed
-                                fillColor: color,
-                                color: 'darkred',
-                                weight: 1,
-                                fillOpacity: 0.7
-                            });
-                        },
-                        onEachFeature: (feature, layer) => {
-                            const desc = feature.properties.description || "Accident Site";
-                            const risk = feature.properties.hotspot === "Hot Spot" ? "High Risk (Hot Spot)" : 
-                            feature.properties.z_score > 2 ? "Moderate Risk" : "Low Risk";
-                            layer.bindPopup(`<b>Accident:</b> ${desc}<br><b>Risk:</b> ${risk}`);
+            const roadLayer = L.vectorGrid.protobuf('http://localhost:5000/tiles/road_segments/{z}/{x}/{y}.pbf', {
+                rendererFactory: L.canvas.tile,
+                maxNativeZoom: 16,
+                interactive: true,
+                vectorTileLayerStyles: {
+                    road_segments: properties => ({ color: roadColor(properties.risk_categ || 'Unknown'), weight: 2 })
+                }
+            }).on('click', e => {
+                const props = e.layer.properties || {};
+                const name = props.name || 'Unnamed';
+                const category = props.risk_categ || 'Unknown';
+                const score = props.risk_score != null ? `<br><b>Risk score:</b> ${props.risk_score}` : '';
+                L.popup().setLatLng(e.latlng).setContent(`<b>Name:</b> ${name}<br><b>Risk:</b> ${category}${score}`).openOn(map);
+            }).addTo(map);
+            overlayMaps["Calgary Roads (Risk)"] = roadLayer; // Add the layer to overlayMaps
+
+            const accidentLayer = L.vectorGrid.protobuf('http://localhost:5000/tiles/accidents/{z}/{x}/{y}.pbf', {
+                rendererFactory: L.canvas.tile,
+                maxNativeZoom: 16,
+                interactive: true,
+                vectorTileLayerStyles: {
+                    accidents: properties => {
+                        const isHotSpot = properties.hotspot === "Hot Spot";
+                        const zScore = properties.z_score || 0;
+                        let color = 'yellow'; // Default for non-hotspot
+
+                        if (isHotSpot) {
+                            color = 'red'; // Hot Spot accidents are red
+                        } else if (zScore > 2) {
+                            color = 'orange'; // Higher z_score indicates more risk
+                        } else {
+                            color = 'green'; // Lower risk accidents
                         }
-                    }).addTo(map);
-                    overlayMaps["Accidents"] = layer;
-                })
-                
-            ]).then(() => {
-                L.control.layers(baseMaps, overlayMaps).addTo(map);
-            });
+
+                        return {
+                            radius: 4, // Adjust size as needed
+                            fill: true,
+                            fillColor: color,
+                            color: 'darkred',
+                            weight: 1,
+                            fillOpacity: 0.7
+                        };
+                    }
+                }
+            }).on('click', e => {
+                const props = e.layer.properties || {};
+                const desc = props.description || "Accident Site";
+                const risk = props.hotspot === "Hot Spot" ? "High Risk (Hot Spot)" :
+                    props.z_score > 2 ? "Moderate Risk" : "Low Risk";
+                L.popup().setLatLng(e.latlng).setContent(`<b>Accident:</b> ${desc}<br><b>Risk:</b> ${risk}`).openOn(map);
+            }).addTo(map);
+            overlayMaps["Accidents"] = accidentLayer;
+
+            L.control.layers(baseMaps, overlayMaps).addTo(map);
 
             const legend = L.control({ position: 'bottomleft' });
             legend.onAdd = function () {
@@ -1,21 +1,24 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, send_file
 from flask_cors import CORS
-import osmnx as ox
 import networkx as nx
-import geopandas as gpd
-import json
-import pandas as pd
 from dotenv import load_dotenv
 import requests
 import os
 import math
-from alternate_pathfinding import find_alternate_paths
+import numpy as np
 from chatbot import *
-from find_path import find_nearest_node, adjust_risk_score, astar_path
+from find_path import find_nearest_node, adjust_risk_score, astar_split_path, risk_time_bucket
+from graph_store import GraphStore
+from route_cache import RouteCache
+from routing_pool import RoutingPool, route_geojson, search_path
+from batch_routing import in_bounds, plan_batch, snap_points, stream_batch
+from cost_matrix import snapshot_matrices
+from map_layers import MapLayers
+from static_layers import StaticLayers
+from geocoding import default_geocoder
+from route_geojson import get_transformer
 from datetime import datetime
 from dateutil.parser import parse as parse_datetime
-from pyproj import Transformer
-import pickle
 
 # Load environment variables from .env file
 load_dotenv()
@@ -24,13 +27,70 @@ app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "http://localhost:8000"}})
 
 print("Loading precomputed graph...")
-G = pickle.load(open(os.path.join(os.path.dirname(__file__), "road_network_processed.pkl"), "rb"))
+# 'csr' searches compact arrays built from G and returns the same paths as 'networkx';
+# 'ch' answers from contraction hierarchies built offline by contraction_hierarchy.py
+ROUTING_BACKEND = os.getenv('ROUTING_BACKEND', 'csr')
+GRAPH_ARTIFACT = os.getenv('GRAPH_ARTIFACT', os.path.join(os.path.dirname(__file__), "road_network_graph"))
+# Distance and risk weights of /find_path
+ALPHA, BETA = 0.1, 0.9
+# The graph, its indexes and cost tables live in one snapshot that the watcher replaces when
+# the artifact (or pickle) changes; each request reads graph_store.snapshot once
+graph_store = GraphStore(
+    GRAPH_ARTIFACT,
+    os.path.join(os.path.dirname(__file__), "road_network_processed.pkl"),
+    routing_backend=ROUTING_BACKEND,
+    ch_path=os.path.join(os.path.dirname(__file__), "road_network_ch.npz"),
+    # 'alt' replaces the Euclidean A* heuristic with landmark bounds from landmarks.py
+    landmarks_path=(os.path.join(os.path.dirname(__file__), "road_network_landmarks.npz")
+                    if os.getenv('ROUTING_HEURISTIC', 'euclidean') == 'alt' else None),
+    alpha=ALPHA, beta=BETA)
+# Worker processes for node-snapped route searches; 0 searches in the request thread.
+# Created before the watcher thread starts, as the first workers are forked from this process
+ROUTE_PROCESSES = int(os.getenv('ROUTE_PROCESSES', '0'))
+routing_pool = None
+if ROUTE_PROCESSES > 0:
+    routing_pool = RoutingPool(graph_store, ROUTE_PROCESSES)
+    # Workers started on reload (forkserver) import the main module, which must not be this
+    # script; run as `python server.py`, searches move to the request threads after a reload
+    if __name__ == '__main__':
+        print("Routing pool is not restarted on graph reload when server.py is run as a script; "
+              "use `flask --app server run` or uvicorn asgi_app:app")
+    else:
+        graph_store.listeners.append(routing_pool.restart)
+# Seconds between checks for a new graph; 0 turns reloading off
+graph_store.watch(float(os.getenv('GRAPH_RELOAD_INTERVAL', '30')))
+# Points routes may start and end at
+CALGARY_BOUNDS = {
+    'min_lat': 50.842, 'max_lat': 51.212,
+    'min_lon': -114.315, 'max_lon': -113.860
+}
+# Largest number of origin-destination pairs in one /find_paths/batch request
+BATCH_MAX_PAIRS = int(os.getenv('BATCH_MAX_PAIRS', '1000'))
+# Largest number of origins, and of destinations, in one /matrix request
+MATRIX_MAX_POINTS = int(os.getenv('MATRIX_MAX_POINTS', '500'))
+# Encoded /find_path responses of node-snapped routes; ROUTE_CACHE_BYTES=0 turns it off
+route_cache = RouteCache(max_bytes=int(os.getenv('ROUTE_CACHE_BYTES', str(64 * 2 ** 20))),
+                         ttl=float(os.getenv('ROUTE_CACHE_TTL', '600')))
+graph_store.listeners.append(lambda snapshot: route_cache.clear())
+# Road risk and accident layers in memory, for vector tiles and bbox queries;
+# TILE_CACHE='' makes every tile on request
+map_layers = MapLayers(os.path.join(os.path.dirname(__file__), 'static'),
+                       cache_dir=os.getenv('TILE_CACHE', os.path.join(os.path.dirname(__file__), 'tile_cache')) or None)
+map_layers.preload()
+# Content hashes and precompressed .gz/.br copies of the layer files, for ETags and Accept-Encoding
+static_layers = StaticLayers()
 print("Graph Loaded.")
 
 @app.route('/')
 def test():
     return "Backend is running!"
 
+@app.route('/status', methods=['GET'])
+def status():
+    return jsonify(dict(graph_store.status(), route_cache=route_cache.stats(), geocoder=default_geocoder().stats(),
+                        routing_pool=routing_pool.stats() if routing_pool is not None else None,
+                        map_layers=map_layers.stats()))
+
 @app.route('/config', methods=['GET'])
 def get_config():
     return jsonify({
@@ -41,22 +101,28 @@ def get_config():
 @app.route('/geocode', methods=['POST'])
 def geocode():
     geoapify_api_key = os.getenv('GEOAPIFY_API_KEY')
-    if not geoapify_api_key:
+    geocoder = default_geocoder()
+    if not geoapify_api_key and not geocoder.can_answer_offline():
         return jsonify({"error": "Geoapify API key not configured"}), 500
     data = request.get_json()
     location = data['location']
-    url = f"https://api.geoapify.com/v1/geocode/search?text={location}&limit=1&apiKey={geoapify_api_key}"
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        return jsonify(response.json())
+        return jsonify(geocoder.search(location, geoapify_api_key))
     except requests.exceptions.RequestException as e:
         return jsonify({"error": f"Geocoding failed: {str(e)}"}), 500
     
 
 @app.route('/find_path', methods=['POST'])
 def find_path():
-    data = request.get_json()
+    return find_path_response(request.get_json())
+
+def find_path_response(data):
+    """
+    The /find_path response for a request body, also called in-process by /chat.
+    """
+    # One consistent graph for the whole request, even if a reload swaps it meanwhile
+    graph = graph_store.snapshot
+    G = graph.G
     start_lat, start_lon = data['start']
     end_lat, end_lon = data['end']
     start_coords = (start_lon, start_lat)
@@ -64,10 +130,7 @@ def find_path():
 
     print(f"Received: start={start_lat},{start_lon}, end={end_lat},{end_lon}")
 
-    calgary_bounds = {
-        'min_lat': 50.842, 'max_lat': 51.212,
-        'min_lon': -114.315, 'max_lon': -113.860
-    }
+    calgary_bounds = CALGARY_BOUNDS
     if not (calgary_bounds['min_lat'] <= start_lat <= calgary_bounds['max_lat'] and
             calgary_bounds['min_lon'] <= start_lon <= calgary_bounds['max_lon']):
         return jsonify({"error": "Start point is outside Calgary bounds"}), 400
@@ -76,17 +139,24 @@ def find_path():
             calgary_bounds['min_lon'] <= end_lon <= calgary_bounds['max_lon']):
         return jsonify({"error": "End point is outside Calgary bounds"}), 400
 
-    transformer = Transformer.from_crs("EPSG:4326", "EPSG:32611", always_xy=True)
+    transformer = get_transformer("EPSG:4326", "EPSG:32611")
     start_coords_utm = transformer.transform(start_coords[0], start_coords[1])
     end_coords_utm = transformer.transform(end_coords[0], end_coords[1])
 
-    start_node = find_nearest_node(G, start_coords_utm)
-    end_node = find_nearest_node(G, end_coords_utm)
+    # 'node' snaps to the nearest graph vertex, 'edge' splits the nearest road segment
+    snap_mode = data.get('snap', 'node')
+    if snap_mode == 'edge':
+        start_snap = graph.edge_index.snap(start_coords_utm)
+        end_snap = graph.edge_index.snap(end_coords_utm)
+        print(f"Nearest edges: start={start_snap.u}->{start_snap.v}, end={end_snap.u}->{end_snap.v}")
+    else:
+        start_node = find_nearest_node(G, start_coords_utm, index=graph.node_index)
+        end_node = find_nearest_node(G, end_coords_utm, index=graph.node_index)
 
-    print(f"Nearest nodes: start={start_node}, end={end_node}")
+        print(f"Nearest nodes: start={start_node}, end={end_node}")
 
-    if start_node not in G.nodes or end_node not in G.nodes:
-        return jsonify({"error": "One or both points are outside the Calgary road network"}), 400
+        if start_node not in G.nodes or end_node not in G.nodes:
+            return jsonify({"error": "One or both points are outside the Calgary road network"}), 400
 
     try:
         time_str = data.get('time')
@@ -95,85 +165,129 @@ def find_path():
         else:
            current_time = datetime.now()
 
-        path = astar_path(G, start_node, end_node, current_time, alpha=0.1, beta=0.9)
+        # Node-snapped routes only depend on the end nodes, the time bucket and the weights
+        cache_key = None
+        if snap_mode != 'edge':
+            cache_key = (graph.generation, start_node, end_node, risk_time_bucket(current_time), ALPHA, BETA)
+            cached = route_cache.get(cache_key)
+            if cached is not None:
+                return app.response_class(cached, mimetype='application/json', headers={'X-Route-Cache': 'hit'})
+
+        path_geojson = summary = body = None
+        if snap_mode == 'edge':
+            path, split_graph = astar_split_path(G, start_snap, end_snap, current_time, alpha=ALPHA, beta=BETA)
+            if path:
+                route_edge_data = [split_graph.edge(u, v) for u, v in zip(path[:-1], path[1:])]
+                total_risk = sum(adjust_risk_score(d["risk_score"], current_time) for d in route_edge_data)
+                path_geojson = graph.route_serializer.feature_collection(route_edge_data, total_risk)
+        elif routing_pool is not None and routing_pool.generation == graph.generation:
+            # Searched and encoded in a worker process, so route requests use every core
+            encoded = routing_pool.route_json(start_node, end_node, current_time, ALPHA, BETA)
+            if encoded is not None:
+                summary, body = encoded
+        else:
+            path = search_path(graph, start_node, end_node, current_time, ALPHA, BETA)
+            if path:
+                path_geojson = route_geojson(graph, path, current_time)
     except nx.NetworkXNoPath as e:
         return jsonify({"error": f"Unexpected error: {str(e)}"}), 500
 
-    if path:
-        print(f"Path found with {len(path)} nodes")
-
-        route_edges = [(path[i], path[i+1]) for i in range(len(path)-1)]
-        print(f"Path found: {len(route_edges)} edges")
-
-        route_gdf = gpd.GeoDataFrame(
-            [G[u][v] for u, v in route_edges],
-            geometry=[G[u][v]["geometry"] for u, v in route_edges],
-            crs='epsg:32611'
-        )
-        route_gdf_4326 = route_gdf.to_crs('epsg:4326')
-
-        total_length = sum(G[u][v]["length"] for u, v in route_edges)
-        total_risk = sum(adjust_risk_score(G[u][v]["risk_score"], current_time) for u, v in route_edges)
-
-        print(f"Total distance: {total_length:.2f} meters")
-        print(f"Total adjusted risk: {total_risk:.2f}")
-
-        risk_categories = [G[u][v]["risk_category"] for u, v in route_edges]
-        risk_category_counts = {}
-        for category in risk_categories:
-            risk_category_counts[category] = risk_category_counts.get(category, 0) + 1
-
-        print("Risk category counts:")
-        for category, count in risk_category_counts.items():
-            print(f"  {category}: {count}")
-
-        total_travel_time = 0
-        features = []
-        for idx, row in route_gdf_4326.iterrows():
-            road_name = row.get('name', None)
-            if isinstance(road_name, list):
-                road_name = road_name[0] if road_name else 'Unnamed Road'
-            if pd.isna(road_name):
-                road_name = row.get('ref', None)
-            if pd.isna(road_name):
-                road_name = row.get('highway', 'Unnamed Road').capitalize()
-            length = row.get('length', 0)
-            # Always compute travel time, ignoring precomputed values
-            speed_mps = 13.89  # 50 km/h = 13.89 m/s
-            edge_travel_time = length / speed_mps if length else 0
-            route_gdf_4326.at[idx, 'travel_time'] = edge_travel_time
-    
-            # Add this edge's travel time to the total
-            total_travel_time += edge_travel_time
-
-                      
-
-            features.append({
-                "type": "Feature",
-                "geometry": row.geometry.__geo_interface__,
-                "properties": {
-                    "osmid": row.get('road_id', None),
-                    "name": road_name,
-                    "length": row.get('length', None),
-                    "travel_time": edge_travel_time,
-                    "total_risk": row.get('total_risk', None),
-                    "risk_category": row.get('risk_categ', None)
-                }
-            })
-    else:
+    if path_geojson is None and body is None:
         return None
+    if path_geojson is not None:
+        summary = path_geojson['properties']
+    print(f"Total distance: {summary['total_length']:.2f} meters")
+    print(f"Total adjusted risk: {summary['total_risk']:.2f}")
+
+    print("Risk category counts:")
+    for category, count in summary['risk_category_counts'].items():
+        print(f"  {category}: {count}")
+
+    response = jsonify(path_geojson) if body is None else app.response_class(body, mimetype='application/json')
+    if cache_key is not None:
+        route_cache.put(cache_key, response.get_data())
+        response.headers['X-Route-Cache'] = 'miss'
+    return response
+
+@app.route('/find_paths/batch', methods=['POST'])
+def find_paths_batch():
+    """Routes for many origin-destination pairs, streamed as NDJSON lines (see batch_routing.py)."""
+    graph = graph_store.snapshot
+    try:
+        plan = plan_batch(graph, request.get_json(silent=True), CALGARY_BOUNDS, BATCH_MAX_PAIRS)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid batch: {str(e)}"}), 400
+    lines = stream_batch(graph, plan, route_cache, routing_pool, ALPHA, BETA)
+    return app.response_class(lines, mimetype='application/x-ndjson', headers={'X-Pair-Count': str(len(plan['ids']))})
+
+@app.route('/matrix', methods=['POST'])
+def matrix():
+    return matrix_response(request.get_json(silent=True))
+
+def parse_points(data, key):
+    """(n, 2) lat/lon array of the point list data[key]. Raises ValueError if it is malformed."""
+    points = data.get(key)
+    if not isinstance(points, list) or not points:
+        raise ValueError(f"'{key}' must be a non-empty list of [lat, lon] points")
+    if len(points) > MATRIX_MAX_POINTS:
+        raise ValueError(f"at most {MATRIX_MAX_POINTS} {key}")
+    try:
+        points = np.array(points, dtype=float)
+    except (TypeError, ValueError):
+        points = None
+    if points is None or points.ndim != 2 or points.shape[1] != 2:
+        raise ValueError(f"'{key}' must be a non-empty list of [lat, lon] points")
+    outside = np.flatnonzero(~in_bounds(points, CALGARY_BOUNDS))
+    if len(outside):
+        raise ValueError(f"point {outside[0]} of '{key}' is outside Calgary bounds")
+    return points
+
+def finite_or_none(matrix):
+    """A matrix as nested lists, with null for unreachable (inf) entries."""
+    return [[v if math.isfinite(v) else None for v in row] for row in matrix.tolist()]
+
+def matrix_response(data):
+    """
+    The /matrix response for a request body: route cost, length and summed adjusted risk from
+    every origin to every destination (cost_matrix.py). Also run on worker threads by asgi_app.py.
+    """
+    graph = graph_store.snapshot
+    data = data or {}
+    try:
+        origins = parse_points(data, 'origins')
+        destinations = parse_points(data, 'destinations') if data.get('destinations') is not None else origins
+        time_str = data.get('time')
+        current_time = parse_datetime(time_str) if time_str else datetime.now()
+    except (ValueError, OverflowError) as e:
+        return jsonify({"error": f"Invalid matrix request: {str(e)}"}), 400
+    origin_nodes = snap_points(graph, origins)
+    destination_nodes = snap_points(graph, destinations)
+    try:
+        matrices = snapshot_matrices(graph, origin_nodes, destination_nodes, current_time, ALPHA, BETA, routing_pool)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 501
+    print(f"Matrix: {len(origin_nodes)} x {len(destination_nodes)}")
+    return jsonify({
+        "origin_nodes": origin_nodes,
+        "destination_nodes": destination_nodes,
+        "cost": finite_or_none(matrices.cost),
+        "length": finite_or_none(matrices.length),
+        "risk": finite_or_none(matrices.risk),
+    })
 
-    path_geojson = {
-        "type": "FeatureCollection",
-        "features": features,
-        "properties": {
-            "total_length": total_length,
-            "total_travel_time": total_travel_time,
-            "total_risk": total_risk,
-            "risk_category_counts": risk_category_counts,
-        }
-    }
-    return jsonify(path_geojson)
+def route_in_process(start_coords, end_coords):
+    """
+    Route GeoJSON between two (lat, lon) points from the /find_path logic, without an HTTP
+    round trip to this server; None if no route was found. Used as the chatbot's route_fn.
+    """
+    result = find_path_response({"start": list(start_coords), "end": list(end_coords)})
+    if result is None:
+        return None
+    response = app.make_response(result)
+    if response.status_code != 200:
+        print(f"Pathfinding failed: {response.get_json().get('error')}")
+        return None
+    return response.get_json()
 #-----
 
 @app.route('/chat', methods=['POST'])
@@ -185,10 +299,10 @@ def chat():
             return jsonify({"error": "No message provided"}), 400
 
         geoapify_api_key = os.getenv('GEOAPIFY_API_KEY')
-        if not geoapify_api_key:
+        if not geoapify_api_key and not default_geocoder().can_answer_offline():
             return jsonify({"error": "Geoapify API key not configured"}), 500
 
-        result = process_chat_message(user_input, geoapify_api_key)
+        result = process_chat_message(user_input, geoapify_api_key, route_fn=route_in_process)
         if isinstance(result, dict):
             return jsonify(result)
         else:
@@ -197,13 +311,72 @@ def chat():
         print(f"Error in chat endpoint: {str(e)}")
         return jsonify({"error": f"Unexpected error: {str(e)}"}), 500
 
+def parse_viewport(args):
+    """
+    (bbox, zoom) from the bbox=min_lon,min_lat,max_lon,max_lat and zoom query parameters,
+    each None if absent. Raises ValueError if they are malformed.
+    """
+    bbox = args.get('bbox')
+    zoom = args.get('zoom')
+    if bbox is not None:
+        bbox = [float(v) for v in bbox.split(',')]
+        # float() accepts 'nan' and 'inf', which would pass the ordering checks or reach the STRtree
+        if (len(bbox) != 4 or not all(math.isfinite(v) for v in bbox)
+                or bbox[0] > bbox[2] or bbox[1] > bbox[3]):
+            raise ValueError("bbox must be min_lon,min_lat,max_lon,max_lat")
+    if zoom is not None:
+        zoom = float(zoom)
+        if not math.isfinite(zoom):
+            raise ValueError("zoom must be a finite number")
+        zoom = min(max(zoom, 0.0), 22.0)
+    return bbox, zoom
+
+def send_static_layer(filename):
+    """A layer file in the best encoding the client accepts, or 304 if its copy is current."""
+    path = os.path.join(os.path.dirname(__file__), 'static', filename)
+    try:
+        status, file, headers = static_layers.negotiate(path, request.headers.get('Accept-Encoding'),
+                                                        request.headers.get('If-None-Match'))
+    except FileNotFoundError:
+        return jsonify({"error": f"{filename} is not available"}), 404
+    if status == 304:
+        return app.response_class(status=304, headers=headers)
+    response = send_file(file, mimetype='application/geo+json', conditional=False, etag=False)
+    response.headers.update(headers)
+    return response
+
+def serve_layer(name):
+    """The layer file, or with bbox/zoom parameters the features in view, streamed as encoded."""
+    if 'bbox' not in request.args and 'zoom' not in request.args:
+        return send_static_layer(map_layers.specs[name]['file'])
+    try:
+        bbox, zoom = parse_viewport(request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid bbox or zoom: {str(e)}"}), 400
+    try:
+        count, chunks = map_layers.query(name, bbox, zoom)
+    except FileNotFoundError:
+        return jsonify({"error": f"Layer {name} is not available"}), 404
+    return app.response_class(chunks, mimetype='application/json', headers={'X-Feature-Count': str(count)})
+
 @app.route('/road_segments')
 def serve_road_segments():
-    return send_from_directory('static', 'road_segments.geojson')
+    return serve_layer('road_segments')
 
 @app.route('/accidents')
 def serve_accidents():
-    return send_from_directory('static', 'accidents.geojson')
+    return serve_layer('accidents')
+
+@app.route('/tiles/<layer>/<int:z>/<int:x>/<int:y>.pbf')
+def serve_tile(layer, z, x, y):
+    if not map_layers.valid(layer, z, x, y):
+        return jsonify({"error": f"No tile {layer}/{z}/{x}/{y}"}), 404
+    try:
+        data = map_layers.tile(layer, z, x, y)
+    except FileNotFoundError:
+        return jsonify({"error": f"Layer {layer} is not available"}), 404
+    return app.response_class(data, mimetype='application/vnd.mapbox-vector-tile',
+                              headers={'Cache-Control': 'max-age=300'})
 
 @app.route('/config.js')
 def serve_config_js():
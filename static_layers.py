@@ -0,0 +1,193 @@
+"""
+Precompressed static GeoJSON layers with validators.
+
+The layer files in static/ (road_segments.geojson, accidents.geojson) are written once and
+then downloaded by every page load. This module
+    - writes .gz and .br siblings of a layer when it is generated, plus a .sha256 file with
+      the layer's content hash, written last so it only names finished siblings;
+    - serves the smallest encoding the client's Accept-Encoding allows, using a sibling only
+      if its .sha256 matches the layer's current content;
+    - gives each encoding a strong ETag derived from the content hash and answers 304 Not
+      Modified when If-None-Match names it, so a repeat visit costs one small request.
+
+Generate (export from a shapefile) or precompress layers with:
+    python static_layers.py export road_risk_layer_categorized.shp static/road_segments.geojson
+    python static_layers.py compress static/road_segments.geojson static/accidents.geojson
+"""
+import argparse
+import gzip
+import hashlib
+import os
+import threading
+
+import geopandas as gpd
+
+# Content codings in order of preference, with the sibling file suffix of each
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+HASH_CHUNK = 1 << 20
+
+
+def file_digest(path):
+    """SHA-256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def precompress(path, gzip_level=9, brotli_quality=11):
+    """Write path.gz, path.br and path.sha256 for the file at path. Returns the digest."""
+    import brotli  # Only needed to write the .br files, not to serve them
+
+    with open(path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    outputs = [
+        # mtime=0 so the same layer always compresses to the same bytes
+        (path + ".gz", gzip.compress(data, compresslevel=gzip_level, mtime=0)),
+        (path + ".br", brotli.compress(data, quality=brotli_quality)),
+        (path + ".sha256", digest.encode()),
+    ]
+    for target, content in outputs:
+        with open(target + ".tmp", "wb") as f:
+            f.write(content)
+        os.replace(target + ".tmp", target)
+    return digest
+
+
+def write_layer(gdf, path):
+    """Write a GeoDataFrame as a WGS84 GeoJSON layer and precompress it."""
+    gdf.to_crs("EPSG:4326").to_file(path + ".tmp", driver="GeoJSON")
+    os.replace(path + ".tmp", path)
+    return precompress(path)
+
+
+def accepted_encodings(accept_encoding):
+    """
+    {coding: q} from an Accept-Encoding header. Codings it refuses keep q=0, so that
+    "*, br;q=0" still refuses br.
+    """
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding] = max(q, 0.0)
+    return accepted
+
+
+def etag_matches(if_none_match, etags):
+    """Whether an If-None-Match header names one of etags (weak comparison, as RFC 9110 requires)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return not tags.isdisjoint(etags)
+
+
+class StaticLayers:
+    """
+    Content hashes and valid precompressed siblings of static files, recomputed when a
+    file changes; safe to share between threads.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, path):
+        st = os.stat(path)
+        # The .sha256 file is written after the siblings, so a later precompress is noticed too
+        try:
+            sha = os.stat(path + ".sha256")
+            siblings_version = (sha.st_ino, sha.st_mtime_ns)
+        except FileNotFoundError:
+            siblings_version = None
+        version = (st.st_ino, st.st_size, st.st_mtime_ns, siblings_version)
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is not None and entry["version"] == version:
+            return entry
+        digest = file_digest(path)
+        try:
+            with open(path + ".sha256") as f:
+                siblings_current = f.read().strip() == digest
+        except FileNotFoundError:
+            siblings_current = False
+        encodings = {}
+        if siblings_current:
+            encodings = {coding: path + suffix for coding, suffix in ENCODINGS if os.path.exists(path + suffix)}
+        elif os.path.exists(path + ".gz") or os.path.exists(path + ".br"):
+            print(f"Precompressed copies of {path} are out of date and not served; "
+                  f"run python static_layers.py compress {path}")
+        entry = {"version": version, "digest": digest, "encodings": encodings,
+                 "sizes": {coding: os.path.getsize(p) for coding, p in encodings.items()}}
+        with self._lock:
+            self._entries[path] = entry
+        return entry
+
+    def etag(self, digest, coding):
+        # Strong ETags are per representation, so each encoding gets its own
+        return f'"{digest[:32]}"' if coding is None else f'"{digest[:32]}-{coding}"'
+
+    def negotiate(self, path, accept_encoding=None, if_none_match=None):
+        """
+        How to answer a GET for the file at path: (status, file to send or None, headers).
+        status is 200, or 304 with no file. Raises FileNotFoundError if path is missing.
+        """
+        entry = self._entry(path)
+        accepted = accepted_encodings(accept_encoding)
+        coding = None
+        candidates = [c for c, _ in ENCODINGS if c in entry["encodings"] and accepted.get(c, accepted.get("*", 0)) > 0]
+        if candidates:
+            # Highest q wins; on a tie the smaller file (br before gzip in ENCODINGS)
+            coding = max(candidates, key=lambda c: (accepted.get(c, accepted.get("*", 0)), -entry["sizes"][c]))
+        headers = {
+            "ETag": self.etag(entry["digest"], coding),
+            "Vary": "Accept-Encoding",
+            # Cached copies are revalidated each time, which costs a 304 while the layer is unchanged
+            "Cache-Control": "no-cache",
+        }
+        # Only the representation that would be sent: a gzip ETag does not validate a br copy
+        if etag_matches(if_none_match, {headers["ETag"]}):
+            return 304, None, headers
+        if coding is not None:
+            headers["Content-Encoding"] = coding
+            return 200, entry["encodings"][coding], headers
+        return 200, path, headers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export = subparsers.add_parser("export", help="Write a layer (any format geopandas reads) as precompressed GeoJSON")
+    export.add_argument("source")
+    export.add_argument("target")
+    compress = subparsers.add_parser("compress", help="Write .gz/.br siblings of existing GeoJSON layers")
+    compress.add_argument("paths", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        paths = [args.target]
+        write_layer(gpd.read_file(args.source), args.target)
+    else:
+        paths = args.paths
+        for path in paths:
+            precompress(path)
+    for path in paths:
+        sizes = ", ".join(f"{suffix[1:]} {os.path.getsize(path + suffix) / 1e6:.2f} MB" for _, suffix in ENCODINGS)
+        print(f"{path}: {os.path.getsize(path) / 1e6:.2f} MB, {sizes}")
+
+
+if __name__ == "__main__":
+    main()
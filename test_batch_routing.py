@@ -0,0 +1,132 @@
+"""
+Batch routing (batch_routing.py) on the synthetic graph artifact of conftest.py: request
+parsing, snapping and grouping of the pairs, and the streamed routes, which must be the
+exact least-cost routes Dijkstra finds.
+
+    python -m pytest test_batch_routing.py
+"""
+import json
+from datetime import datetime
+
+import pytest
+
+import csr_graph
+from batch_routing import parse_pairs, plan_batch, stream_batch
+from conftest import node_latlon
+from find_path import risk_time_bucket
+from routing_pool import encode_route, route_geojson
+
+RUSH_HOUR, NIGHT = "2025-03-26T17:00", "2025-07-12T02:00"
+OUTSIDE = [51.5, -114.0]
+
+
+# Step 1: Parsing
+
+def test_parse_pairs():
+    starts, ends, times, ids = parse_pairs({"time": RUSH_HOUR, "pairs": [
+        {"start": [51.0, -114.1], "end": ["51.01", -114.09], "id": "truck-1"},
+        {"start": [51.02, -114.1], "end": [51.0, -114.1], "time": NIGHT},
+    ]}, max_pairs=2)
+    assert starts.tolist() == [[51.0, -114.1], [51.02, -114.1]]
+    assert ends.tolist() == [[51.01, -114.09], [51.0, -114.1]]
+    assert times == [datetime(2025, 3, 26, 17, 0), datetime(2025, 7, 12, 2, 0)]
+    assert ids == ["truck-1", None]
+
+
+@pytest.mark.parametrize("body", [
+    None,
+    [{"start": [51.0, -114.1], "end": [51.0, -114.1]}],
+    {"pairs": []},
+    {"pairs": {"start": [51.0, -114.1]}},
+    {"pairs": [{"start": [51.0, -114.1], "end": [51.0, -114.1]}] * 3},
+    {"pairs": [{"start": [51.0], "end": [51.0, -114.1]}]},
+    {"pairs": [{"start": [51.0, -114.1]}]},
+    {"pairs": [{"start": ["north", -114.1], "end": [51.0, -114.1]}]},
+    {"pairs": [{"start": [51.0, -114.1], "end": [51.0, -114.1], "time": "not a time"}]},
+    {"pairs": ["51.0,-114.1 to 51.0,-114.2"]},
+])
+def test_malformed_batches_are_refused(body):
+    with pytest.raises(ValueError):
+        parse_pairs(body, max_pairs=2)
+
+
+# Step 2: Planning
+
+def test_pairs_are_grouped_by_time_bucket_and_start_node(server, synthetic_G):
+    graph = server.graph_store.snapshot
+    a, b, c = node_latlon(synthetic_G, 16), node_latlon(synthetic_G, 100), node_latlon(synthetic_G, 200)
+    near_a = node_latlon(synthetic_G, 16, dx=3, dy=2)
+    plan = plan_batch(graph, {"time": RUSH_HOUR, "pairs": [
+        {"start": a, "end": b},
+        {"start": near_a, "end": c, "id": "same start"},
+        {"start": a, "end": c, "time": NIGHT},
+        {"start": OUTSIDE, "end": b},
+        {"start": b, "end": OUTSIDE},
+        {"start": b, "end": a},
+    ]}, server.CALGARY_BOUNDS, max_pairs=10)
+    assert plan["ids"] == [None, "same start", None, None, None, None]
+    assert sorted(plan["errors"]) == [(3, "Start point is outside Calgary bounds"),
+                                      (4, "End point is outside Calgary bounds")]
+    rush_hour = risk_time_bucket(datetime(2025, 3, 26, 17, 0))
+    night = risk_time_bucket(datetime(2025, 7, 12, 2, 0))
+    assert {key: group["pairs"] for key, group in plan["groups"].items()} == {
+        (rush_hour, 16): [(0, 100), (1, 200)],
+        (night, 16): [(2, 200)],
+        (rush_hour, 100): [(5, 16)],
+    }
+
+
+# Step 3: Routes
+
+def run_batch(server, body):
+    graph = server.graph_store.snapshot
+    plan = plan_batch(graph, body, server.CALGARY_BOUNDS, max_pairs=100)
+    lines = stream_batch(graph, plan, server.route_cache, None, server.ALPHA, server.BETA)
+    return [json.loads(line) for line in lines]
+
+
+def test_batch_routes_are_the_dijkstra_routes(server, synthetic_G):
+    graph = server.graph_store.snapshot
+    csr = graph.csr
+    node_pairs = [(16, 200), (16, 100), (16, 16), (30, 150), (150, 30), (224, 0), (16, 200)]
+    body = {"time": RUSH_HOUR, "pairs": [
+        {"start": node_latlon(synthetic_G, a), "end": node_latlon(synthetic_G, b), "id": f"{a}-{b}"}
+        for a, b in node_pairs]}
+    current_time = datetime(2025, 3, 26, 17, 0)
+    cost = graph.risk_profiles.costs(current_time)
+    lines = {line["index"]: line for line in run_batch(server, body)}
+    assert sorted(lines) == list(range(len(node_pairs)))
+    # A pair from a node to itself gets an empty route, as from /find_path
+    assert lines[2]["route"]["features"] == []
+    for line in lines.values():
+        a, b = node_pairs[line["index"]]
+        assert line["id"] == f"{a}-{b}"
+        path = csr.node_ids[csr_graph.dijkstra(csr, csr.index_of(a), csr.index_of(b), cost)].tolist()
+        expected = encode_route(route_geojson(graph, path, current_time))
+        assert json.dumps(line["route"], sort_keys=True, separators=(",", ":")).encode() + b"\n" == expected
+
+
+def test_out_of_bounds_pairs_get_error_lines(server, synthetic_G):
+    server.route_cache.clear()
+    lines = run_batch(server, {"pairs": [
+        {"start": OUTSIDE, "end": node_latlon(synthetic_G, 40), "id": "far"},
+        {"start": node_latlon(synthetic_G, 40), "end": node_latlon(synthetic_G, 60)},
+    ]})
+    by_index = {line["index"]: line for line in lines}
+    assert by_index[0] == {"index": 0, "id": "far", "error": "Start point is outside Calgary bounds"}
+    assert by_index[1]["route"]["type"] == "FeatureCollection"
+    # Tree routes are not /find_path's routes, so they stay out of its cache
+    assert server.route_cache.stats()["entries"] == 0
+
+
+def test_batch_endpoint(server, synthetic_G):
+    client = server.app.test_client()
+    response = client.post("/find_paths/batch", json={"time": NIGHT, "pairs": [
+        {"start": node_latlon(synthetic_G, 5), "end": node_latlon(synthetic_G, 205)},
+        {"start": node_latlon(synthetic_G, 205), "end": OUTSIDE},
+    ]})
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.get_data().splitlines()]
+    assert sorted(line["index"] for line in lines) == [0, 1]
+    assert client.post("/find_paths/batch", json={"pairs": []}).status_code == 400
+    assert client.post("/find_paths/batch", data="pairs", content_type="text/plain").status_code == 400
@@ -0,0 +1,179 @@
+"""
+Admission control of the asynchronous server (bounded_executor.py, asgi_app.py): a full
+limit answers 503 with a Retry-After header at once, and a slot is only freed when the
+work holding it is done. The ASGI app is loaded with the synthetic graph artifact of
+conftest.py and one route search thread.
+
+    python -m pytest test_bounded_executor.py
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from bounded_executor import BoundedExecutor, ConcurrencyLimit, Overloaded
+from conftest import load_server
+
+# Two points on the synthetic grid, inside server.CALGARY_BOUNDS
+START, END = [50.9690, -114.1490], [50.9760, -114.1380]
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+# Step 1: The limits on their own
+
+def test_concurrency_limit_counts_slot_before_it_is_entered():
+    limit = ConcurrencyLimit(1, name="batch routing", retry_after=5)
+    slot = limit.slot()
+    # A second request checking before the first entered its slot is still refused
+    with pytest.raises(Overloaded) as refused:
+        limit.slot()
+    assert refused.value.retry_after == 5
+    assert limit.stats() == {"limit": 1, "active": 1, "rejected": 1}
+    slot.release()
+    slot.release()
+    assert limit.active == 0
+
+    async def use():
+        async with limit.slot():
+            assert limit.active == 1
+    asyncio.run(use())
+    assert limit.active == 0
+
+
+def test_executor_slot_is_held_until_the_task_finishes():
+    done = threading.Event()
+
+    async def scenario():
+        executor = BoundedExecutor(ThreadPoolExecutor(max_workers=1), 1, 1, name="route search")
+        task = asyncio.ensure_future(executor.run(done.wait))
+        await asyncio.sleep(0.05)
+        with pytest.raises(Overloaded) as refused:
+            await executor.run(time.sleep, 0)
+        assert refused.value.retry_after >= 1
+        # The caller gives up, but the thread still runs: the slot stays taken
+        task.cancel()
+        await asyncio.sleep(0.05)
+        assert executor.pending == 1
+        with pytest.raises(Overloaded):
+            executor.submit(time.sleep, 0)
+        done.set()
+        while executor.pending:
+            await asyncio.sleep(0.01)
+        assert await executor.run(sum, [1, 2]) == 3
+        assert executor.stats()["rejected"] == 2 and executor.stats()["completed"] == 2
+        executor.executor.shutdown()
+    asyncio.run(scenario())
+
+
+def test_executor_slot_is_freed_when_a_queued_task_is_cancelled():
+    started, done = threading.Event(), threading.Event()
+
+    def block():
+        started.set()
+        done.wait()
+
+    async def scenario():
+        executor = BoundedExecutor(ThreadPoolExecutor(max_workers=1), 1, 2)
+        running = executor.submit(block)
+        await asyncio.get_running_loop().run_in_executor(None, started.wait)
+        queued = executor.submit(time.sleep, 0)
+        assert executor.pending == 2
+        # Cancelled before it started, so it never runs and gives its slot back
+        queued.cancel()
+        await asyncio.sleep(0.05)
+        assert executor.pending == 1
+        done.set()
+        await running
+        await asyncio.sleep(0.05)
+        assert executor.pending == 0 and executor.completed == 1
+        executor.executor.shutdown()
+    asyncio.run(scenario())
+
+
+# Step 2: The endpoints of asgi_app
+
+@pytest.fixture(scope="module")
+def asgi_app(artifact_dir):
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        yield load_server(artifact_dir, monkeypatch, ("server", "asgi_app"),
+                          ROUTE_WORKERS="1", ROUTE_QUEUE="1", BATCH_CONCURRENCY="1")
+
+
+@pytest.fixture(scope="module")
+def client(asgi_app):
+    # One app lifespan for the module: its shutdown stops the executors
+    from starlette.testclient import TestClient
+    with TestClient(asgi_app.app) as client:
+        yield client
+
+
+def in_background(request):
+    responses = []
+    thread = threading.Thread(target=lambda: responses.append(request()))
+    thread.start()
+    return thread, responses
+
+
+def test_full_route_executor_answers_503(asgi_app, client, monkeypatch):
+    release = threading.Event()
+    find_path_flask = asgi_app.find_path_flask
+
+    def slow_find_path(data):
+        release.wait(10)
+        return find_path_flask(data)
+    monkeypatch.setattr(asgi_app, "find_path_flask", slow_find_path)
+
+    body = {"start": START, "end": END}
+    thread, responses = in_background(lambda: client.post("/find_path", json=body))
+    wait_until(lambda: asgi_app.route_executor.pending == 1)
+    refused = client.post("/find_path", json=body)
+    assert refused.status_code == 503
+    assert int(refused.headers["Retry-After"]) >= 1
+    # Still held: the first search has not finished
+    assert client.post("/find_path", json=body).status_code == 503
+    release.set()
+    thread.join(10)
+    assert responses[0].status_code == 200
+    wait_until(lambda: asgi_app.route_executor.pending == 0)
+    assert client.post("/find_path", json=body).status_code == 200
+
+
+def test_batch_slot_is_held_until_the_routing_is_done(asgi_app, client, monkeypatch):
+    release = threading.Event()
+    stream_batch = asgi_app.stream_batch
+
+    def slow_stream_batch(*args):
+        release.wait(10)
+        yield from stream_batch(*args)
+    monkeypatch.setattr(asgi_app, "stream_batch", slow_stream_batch)
+
+    body = {"pairs": [{"start": START, "end": END}, {"start": END, "end": START}]}
+    thread, responses = in_background(lambda: client.post("/find_paths/batch", json=body))
+    wait_until(lambda: asgi_app.route_executor.pending == 1)
+    assert asgi_app.batch_limit.active == 1
+    refused = client.post("/find_paths/batch", json=body)
+    assert refused.status_code == 503
+    assert refused.headers["Retry-After"] == "5"
+    # The batch also holds the only route search slot
+    assert client.post("/find_path", json={"start": START, "end": END}).status_code == 503
+    release.set()
+    thread.join(10)
+    assert responses[0].status_code == 200
+    assert len(responses[0].text.splitlines()) == 2
+    wait_until(lambda: asgi_app.batch_limit.active == 0 and asgi_app.route_executor.pending == 0)
+
+
+def test_invalid_batch_gives_its_slot_back(asgi_app, client):
+    assert client.post("/find_paths/batch", json={"pairs": []}).status_code == 400
+    assert asgi_app.batch_limit.active == 0
+    assert client.post("/find_paths/batch", json={"pairs": [{"start": START, "end": END}]}).status_code == 200
+    # Freed by the routing's done callback, just after the last line is sent
+    wait_until(lambda: asgi_app.batch_limit.active == 0)
@@ -0,0 +1,120 @@
+"""
+The chatbot (chatbot.py): parsing requests, and the sync and async handlers, which must give
+the same replies. Places are geocoded from a gazetteer (geocoding.py) of points on the
+synthetic graph of conftest.py, so nothing is asked of Geoapify.
+
+    python -m pytest test_chatbot.py
+"""
+import asyncio
+import json
+
+import pytest
+
+import chatbot
+from chatbot import (NO_ROUTE, PARSE_FAILED, format_travel_time, parse_user_input, process_chat_message,
+                     process_chat_message_async)
+from conftest import node_latlon
+from geocoding import Geocoder
+
+ROUTE = {
+    "type": "FeatureCollection",
+    "features": [
+        {"type": "Feature", "properties": {"name": "Bow Trail", "length": 1200.0, "travel_time": 86.4}},
+        {"type": "Feature", "properties": {"name": "Bow Trail", "length": 300.0, "travel_time": 21.6}},
+        {"type": "Feature", "properties": {"name": "Crowchild Trail", "length": 2500.0, "travel_time": 120.0}},
+    ],
+    "properties": {"total_length": 4000.0},
+}
+
+
+@pytest.fixture
+def geocoder(tmp_path, synthetic_G, monkeypatch):
+    """A gazetteer Geocoder of two places on the synthetic graph, used by chatbot and server."""
+    path = tmp_path / "gazetteer.json"
+    path.write_text(json.dumps({"Alpha Place": node_latlon(synthetic_G, 16),
+                                "Beta Place": node_latlon(synthetic_G, 200)}))
+    geocoder = Geocoder(gazetteer_path=str(path))
+    monkeypatch.setattr(chatbot, "default_geocoder", lambda: geocoder)
+    return geocoder
+
+
+# Step 1: Parsing and formatting
+
+@pytest.mark.parametrize("message, expected", [
+    ("Find a route from Calgary Tower to University Station", ("Calgary Tower", "University Station")),
+    ("from Bow Valley College to the Calgary Zoo, Calgary", ("Bow Valley College", "the Calgary Zoo, Calgary")),
+    ("Starting at Chinook Centre ending at Stampede Park", ("Chinook Centre", "Stampede Park")),
+    ("  FROM Airport TO Downtown  ", ("Airport", "Downtown")),
+    ("Mount Royal University to Foothills Hospital", ("Mount Royal University", "Foothills Hospital")),
+    ("hello", (None, None)),
+    ("", (None, None)),
+])
+def test_parse_user_input(message, expected):
+    assert parse_user_input(message) == expected
+
+
+def test_format_travel_time():
+    assert format_travel_time(0) == "0 sec"
+    assert format_travel_time(42.4) == "42 sec"
+    assert format_travel_time(228) == "3 min 48 sec"
+
+
+def test_route_reply_lists_each_road_once():
+    reply = chatbot.format_route_response(ROUTE, "A", "B")
+    assert reply.count("Bow Trail") == 1
+    assert "Step 2: Travel on Crowchild Trail (2.50 km)" in reply
+    assert "Total Distance: 4.00 km" in reply and "Total Travel Time: 3 min 48 sec" in reply
+
+
+# Step 2: The sync and async handlers agree
+
+def run_both(message, geocoder, route):
+    """(sync reply, async reply) without their timings, and the locations each one routed."""
+    routed = {"sync": [], "async": []}
+
+    def route_fn(start, end):
+        routed["sync"].append((start, end))
+        return route
+
+    async def locate(location):
+        return geocoder.locate(location)
+
+    async def route_async(start, end):
+        routed["async"].append((start, end))
+        return route
+
+    sync = process_chat_message(message, None, route_fn=route_fn)
+    async_reply = asyncio.run(process_chat_message_async(message, locate, route_async))
+    assert routed["sync"] == routed["async"]
+    assert set(sync.pop("timings")) == set(async_reply.pop("timings"))
+    return sync, async_reply
+
+
+@pytest.mark.parametrize("message, route, expected", [
+    ("Find a route from Alpha Place to Beta Place", ROUTE, None),
+    ("from Alpha Place to Beta Place", None, NO_ROUTE),
+    ("from Alpha Place to Gamma Place", ROUTE, chatbot.not_found("Gamma Place, Calgary, AB")),
+    ("from Gamma Place to Beta Place", ROUTE, chatbot.not_found("Gamma Place, Calgary, AB")),
+    ("Which roads are risky?", ROUTE, PARSE_FAILED),
+])
+def test_sync_and_async_replies_are_the_same(geocoder, message, route, expected):
+    sync, async_reply = run_both(message, geocoder, route)
+    assert sync == async_reply
+    if expected is None:
+        assert sync["success"] and sync["route_geojson"] == ROUTE
+        assert sync["start_coords"] == geocoder.locate("Alpha Place")
+        assert sync["end_coords"] == geocoder.locate("Beta Place")
+    else:
+        assert sync == {"response": expected}
+
+
+def test_chat_endpoint_routes_on_the_graph(server, geocoder, monkeypatch):
+    monkeypatch.setattr(server, "default_geocoder", lambda: geocoder)
+    monkeypatch.delenv("GEOAPIFY_API_KEY", raising=False)
+    client = server.app.test_client()
+    reply = client.post("/chat", json={"message": "Find a route from Alpha Place to Beta Place"}).get_json()
+    assert reply["success"]
+    expected = client.post("/find_path", json={"start": list(reply["start_coords"]),
+                                               "end": list(reply["end_coords"])}).get_json()
+    assert reply["route_geojson"] == expected
+    assert set(reply["timings"]) >= {"parse_ms", "geocode_ms", "route_ms", "format_ms", "total_ms"}
@@ -0,0 +1,148 @@
+"""
+The geocoding caches (geocoding.py): normalized queries, the in-memory LRU, the gazetteer
+and the SQLite cache shared across Geocoder instances, against a local stand-in for the
+Geoapify search API that counts its requests.
+
+    python -m pytest test_geocoding.py
+"""
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+import pytest
+import requests
+
+import geocoding
+from geocoding import Geocoder, normalize_query
+
+BOW_VALLEY = [-114.0574, 51.0462]
+
+
+class FakeGeoapify(BaseHTTPRequestHandler):
+    """Answers every search with BOW_VALLEY, except 'fail' (HTTP 500)."""
+    requests = []
+
+    def do_GET(self):
+        text = parse_qs(urlparse(self.path).query)["text"][0]
+        self.requests.append(text)
+        if text == "fail":
+            self.send_response(500)
+            self.end_headers()
+            return
+        body = json.dumps({"type": "FeatureCollection", "features": [
+            {"type": "Feature", "properties": {"formatted": text},
+             "geometry": {"type": "Point", "coordinates": BOW_VALLEY}}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def geoapify_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGeoapify)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/v1/geocode/search"
+    server.shutdown()
+
+
+@pytest.fixture
+def geoapify(geoapify_url, monkeypatch):
+    """The list of texts the stand-in was asked for."""
+    monkeypatch.setattr(geocoding, "GEOAPIFY_URL", geoapify_url)
+    FakeGeoapify.requests = []
+    return FakeGeoapify.requests
+
+
+@pytest.fixture
+def gazetteer(tmp_path):
+    path = tmp_path / "gazetteer.json"
+    path.write_text(json.dumps({"Calgary Tower": [51.0447, -114.0631]}))
+    return str(path)
+
+
+def test_normalize_query():
+    assert normalize_query("  Calgary   Tower ,Calgary,AB ") == "calgary tower, calgary, ab"
+    assert normalize_query("CALGARY TOWER") == normalize_query("calgary tower")
+
+
+def test_repeated_queries_are_answered_from_memory(geoapify):
+    geocoder = Geocoder(api_key="key")
+    assert geocoder.locate("Bow Valley College, Calgary, AB") == (51.0462, -114.0574)
+    assert geocoder.locate("bow valley  college,calgary, ab") == (51.0462, -114.0574)
+    assert geoapify == ["Bow Valley College, Calgary, AB"]
+    assert geocoder.counts["memory_hits"] == 1 and geocoder.counts["requests"] == 1
+
+
+def test_least_recently_used_query_is_forgotten(geoapify):
+    geocoder = Geocoder(api_key="key", memory_size=2)
+    for text in ("a", "b", "a", "c", "a", "b"):
+        geocoder.search(text)
+    assert geoapify == ["a", "b", "c", "b"]
+
+
+def test_gazetteer_answers_without_the_network(geoapify, gazetteer):
+    geocoder = Geocoder(gazetteer_path=gazetteer)
+    assert geocoder.can_answer_offline()
+    # With or without the city the chatbot appends
+    assert geocoder.locate("calgary tower") == (51.0447, -114.0631)
+    assert geocoder.locate("Calgary Tower, Calgary, AB") == (51.0447, -114.0631)
+    # Without an API key a place it does not know has no result
+    assert geocoder.locate("Bow Valley College") is None
+    assert geoapify == []
+    assert geocoder.counts["gazetteer_hits"] == 2
+
+
+def test_disk_cache_is_shared_across_instances(geoapify, tmp_path):
+    path = str(tmp_path / "geocode.sqlite")
+    first = Geocoder(api_key="key", cache_path=path)
+    assert first.locate("Bow Valley College") == (51.0462, -114.0574)
+    # Another worker process, or the server after a restart
+    second = Geocoder(api_key="key", cache_path=path)
+    assert second.locate("BOW VALLEY COLLEGE") == (51.0462, -114.0574)
+    assert second.counts["disk_hits"] == 1 and second.counts["requests"] == 0
+    # Answered from memory after that
+    assert second.locate("Bow Valley College") == (51.0462, -114.0574)
+    assert second.counts["disk_hits"] == 1 and second.counts["memory_hits"] == 1
+    # Even a key-less instance can use what is cached
+    assert Geocoder(cache_path=path).locate("Bow Valley College") == (51.0462, -114.0574)
+    assert geoapify == ["Bow Valley College"]
+
+
+def test_expired_entries_are_fetched_again(geoapify, tmp_path):
+    path = str(tmp_path / "geocode.sqlite")
+    Geocoder(api_key="key", cache_path=path).search("Bow Valley College")
+    geocoder = Geocoder(api_key="key", cache_path=path, ttl=0)
+    geocoder.search("Bow Valley College")
+    geocoder.search("Bow Valley College")
+    assert geoapify == ["Bow Valley College"] * 3
+
+
+def test_failures_are_not_cached(geoapify, tmp_path):
+    geocoder = Geocoder(api_key="key", cache_path=str(tmp_path / "geocode.sqlite"))
+    with pytest.raises(requests.exceptions.HTTPError):
+        geocoder.search("fail")
+    assert geocoder.locate("fail") is None
+    assert geoapify == ["fail", "fail"]
+    assert geocoder.counts["errors"] == 2 and geocoder.stats()["memory_entries"] == 0
+
+
+def test_async_search_shares_the_cache(geoapify, tmp_path):
+    geocoder = Geocoder(api_key="key", cache_path=str(tmp_path / "geocode.sqlite"))
+
+    async def scenario():
+        async with httpx.AsyncClient() as client:
+            first = await geocoder.locate_async("Bow Valley College", client)
+            second = await geocoder.locate_async("bow valley college", client)
+            failed = await geocoder.locate_async("fail", client)
+            return first, second, failed
+    assert asyncio.run(scenario()) == ((51.0462, -114.0574), (51.0462, -114.0574), None)
+    assert geocoder.locate("Bow Valley College") == (51.0462, -114.0574)
+    assert geoapify == ["Bow Valley College", "fail"]
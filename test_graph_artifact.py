@@ -0,0 +1,121 @@
+"""
+Round trip of the routing graph through a graph artifact (graph_artifact.py): the CSR
+arrays, the edge attributes and geometries, the networkx-like view the server routes on,
+and the route GeoJSON, which must be the same as from the pickled graph.
+
+    python -m pytest test_graph_artifact.py
+"""
+import json
+import os
+import pickle
+import shutil
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from benchmarks import synthetic_graph
+from csr_graph import CSRGraph
+from graph_artifact import CSR_ARRAYS, GraphArtifact, is_artifact, write_graph_artifact
+from graph_store import load_snapshot
+from routing_pool import route_geojson, search_path
+
+RUSH_HOUR = datetime(2025, 3, 26, 17, 0)
+
+
+@pytest.fixture(scope="module")
+def artifact(artifact_dir):
+    return GraphArtifact(artifact_dir)
+
+
+def test_csr_arrays_are_memory_mapped_and_unchanged(synthetic_G, artifact):
+    expected = CSRGraph.from_networkx(synthetic_G)
+    for name in CSR_ARRAYS:
+        array = getattr(artifact.graph, name)
+        assert isinstance(array, np.memmap) or isinstance(array.base, np.memmap), name
+        assert array.dtype == getattr(expected, name).dtype and np.array_equal(array, getattr(expected, name)), name
+    assert artifact.graph.categories == expected.categories
+    assert artifact.manifest["nodes"] == synthetic_G.number_of_nodes()
+    assert artifact.manifest["edges"] == synthetic_G.number_of_edges()
+    # One record per road: the 15 avenues and 15 streets of the grid
+    assert artifact.manifest["roads"] == 30
+
+
+def test_edge_records_have_the_graph_attributes(synthetic_G, artifact):
+    graph = artifact.graph
+    for e, (u, v, data) in enumerate((u, v, data) for u in synthetic_G.nodes
+                                     for v, data in synthetic_G[u].items()):
+        assert graph.node_ids[graph.targets[e]] == v
+        record = artifact.edge_record(e)
+        road = record.pop('road')
+        assert record.pop('geometry').equals_exact(data['geometry'], 0)
+        assert record == {k: value for k, value in data.items() if k != 'geometry'}
+        assert artifact.edge_road[e] == road
+
+
+def test_view_answers_like_the_graph(synthetic_G, artifact):
+    G = artifact.view()
+    assert G.number_of_nodes() == synthetic_G.number_of_nodes()
+    assert 17 in G and -1 not in G and "17" not in G
+    assert G.nodes[17]['pos'] == synthetic_G.nodes[17]['pos']
+    assert list(G[17]) == list(synthetic_G[17])
+    assert G.has_edge(17, 18) and not G.has_edge(17, 19) and not G.has_edge(17, -1)
+    edge = G[17][18]
+    assert edge['length'] == synthetic_G[17][18]['length']
+    assert edge['name'] == synthetic_G[17][18]['name']
+    assert dict(edge).keys() == set(synthetic_G[17][18]) | {'road'}
+    assert [(v, d['risk_score']) for v, d in G[17].items()] == [
+        (v, d['risk_score']) for v, d in synthetic_G[17].items()]
+    with pytest.raises(KeyError):
+        G[17][19]
+
+
+def test_routes_are_the_same_as_from_the_pickle(synthetic_G, artifact_dir, tmp_path):
+    pickle_path = str(tmp_path / "road_network_processed.pkl")
+    with open(pickle_path, "wb") as f:
+        pickle.dump(synthetic_G, f)
+    from_artifact = load_snapshot(artifact_dir, pickle_path)
+    from_pickle = load_snapshot(str(tmp_path / "no_artifact"), pickle_path)
+    assert from_artifact.source == artifact_dir and from_pickle.source == pickle_path
+    for start, end in [(0, 224), (16, 200), (30, 150), (205, 5)]:
+        path = search_path(from_pickle, start, end, RUSH_HOUR, 0.1, 0.9)
+        assert search_path(from_artifact, start, end, RUSH_HOUR, 0.1, 0.9) == path
+        assert (json.dumps(route_geojson(from_artifact, path, RUSH_HOUR)) ==
+                json.dumps(route_geojson(from_pickle, path, RUSH_HOUR)))
+
+
+def test_attribute_values_are_stored_as_json(tmp_path):
+    G = synthetic_graph(rows=2, cols=2)
+    u, v = next(iter(G.edges))
+    G[u][v]['maxspeed'] = float('nan')
+    G[u][v]['lanes'] = np.int64(2)
+    G[u][v]['osmid'] = [np.int64(7), 8]
+    write_graph_artifact(G, str(tmp_path / "graph"))
+    edge = GraphArtifact(str(tmp_path / "graph")).view()[u][v]
+    assert edge['maxspeed'] is None and edge['lanes'] == 2 and edge['osmid'] == [7, 8]
+    # The reverse edge no longer shares the road record
+    assert 'lanes' not in GraphArtifact(str(tmp_path / "graph")).view()[v][u]
+
+
+def test_rewriting_replaces_the_artifact(tmp_path):
+    directory = str(tmp_path / "graph")
+    write_graph_artifact(synthetic_graph(rows=3, cols=3), directory)
+    old = GraphArtifact(directory)
+    write_graph_artifact(synthetic_graph(rows=4, cols=4), directory)
+    assert GraphArtifact(directory).graph.number_of_nodes == 16
+    # A server that mapped the old files keeps reading them until it reloads
+    assert old.graph.number_of_nodes == 9 and float(old.graph.length.sum()) > 0
+    assert sorted(os.listdir(tmp_path)) == ["graph"]
+
+
+def test_other_directories_are_not_loaded(tmp_path, artifact_dir):
+    assert not is_artifact(str(tmp_path))
+    copy = tmp_path / "graph"
+    shutil.copytree(artifact_dir, copy)
+    manifest = json.loads((copy / "manifest.json").read_text())
+    (copy / "manifest.json").write_text(json.dumps(dict(manifest, version=1)))
+    with pytest.raises(ValueError, match="format version 1"):
+        GraphArtifact(str(copy))
+    (copy / "manifest.json").write_text(json.dumps(dict(manifest, format="something else")))
+    with pytest.raises(ValueError):
+        GraphArtifact(str(copy))
@@ -0,0 +1,262 @@
+"""
+Vector tiles of the road risk and accident layers (map_layers.py), on small GeoJSON layer
+files written to a temporary static folder: tile coordinates, clipping to the tile,
+simplification and thinning by zoom, the attributes kept and the disk cache.
+
+    python -m pytest test_map_layers.py
+"""
+import json
+import os
+
+import mapbox_vector_tile
+import pytest
+import shapely
+
+from map_layers import (BUFFER, EXTENT, WEB_MERCATOR_HALF, MapLayers, mercator_bounds, pixel_size,
+                        tile_bounds, tiles_covering)
+
+# A road across several zoom-14 tiles, a 5 m road, and three accidents within a metre
+# of each other, the hot spot last in the file, plus one 1 km away
+LONG_ROAD = [[-114.10, 51.04], [-114.00, 51.04]]
+SHORT_ROAD = [[-114.05, 51.06], [-114.04993, 51.06]]
+ROADS = [
+    ({"risk_categ": "High", "risk_score": 0.123456, "name": "Long Rd", "segment_id": 7}, LONG_ROAD),
+    ({"risk_category": "Low", "risk_score": 0.01, "name": "Short St"}, SHORT_ROAD),
+]
+ACCIDENTS = [
+    ({"hotspot": "Not Significant", "z_score": 0.1, "description": "Rear end"}, [-114.05, 51.05]),
+    ({"hotspot": "Not Significant", "z_score": 0.2, "description": "Sideswipe"}, [-114.050005, 51.050005]),
+    ({"hotspot": "Hot Spot", "z_score": 3.2, "description": "Collision", "severity": 2}, [-114.05001, 51.05]),
+    ({"hotspot": "Not Significant", "z_score": 0.3, "description": "Parked car"}, [-114.036, 51.05]),
+]
+
+
+def write_layer(path, features, geometry_type):
+    collection = {"type": "FeatureCollection", "features": [
+        {"type": "Feature", "properties": properties, "geometry": {"type": geometry_type, "coordinates": coordinates}}
+        for properties, coordinates in features]}
+    with open(path, "w") as f:
+        json.dump(collection, f)
+
+
+@pytest.fixture
+def static_dir(tmp_path):
+    write_layer(tmp_path / "road_segments.geojson", ROADS, "LineString")
+    write_layer(tmp_path / "accidents.geojson", ACCIDENTS, "Point")
+    return str(tmp_path)
+
+
+def tile_at(lon, lat, z):
+    """(x, y) of the zoom-z tile holding a WGS84 point."""
+    x, y, _, _ = mercator_bounds((lon, lat, lon, lat))
+    (tile,) = tiles_covering((x, y, x, y), z)
+    return tile
+
+
+def decode(data, name):
+    return mapbox_vector_tile.decode(data).get(name, {"features": []})["features"]
+
+
+# Step 1: The tile grid
+
+def test_tile_bounds_and_covering_tiles_agree():
+    assert tile_bounds(0, 0, 0) == (-WEB_MERCATOR_HALF, -WEB_MERCATOR_HALF, WEB_MERCATOR_HALF, WEB_MERCATOR_HALF)
+    # Tile y counts down from the top
+    minx, miny, maxx, maxy = tile_bounds(1, 1, 0)
+    assert (minx, miny, maxx, maxy) == (0.0, 0.0, WEB_MERCATOR_HALF, WEB_MERCATOR_HALF)
+    for z, x, y in [(10, 186, 348), (14, 2998, 5578), (3, 0, 7)]:
+        minx, miny, maxx, maxy = tile_bounds(z, x, y)
+        inside = (minx + 1, miny + 1, maxx - 1, maxy - 1)
+        assert tiles_covering(inside, z) == [(x, y)]
+        assert len(tiles_covering((minx - 1, miny + 1, maxx + 1, maxy - 1), z)) == 3 - (x == 0)
+    # Bounds past the edge of the world stop at the last tile
+    assert tiles_covering((-1e9, -1e9, 1e9, 1e9), 1) == [(0, 0), (0, 1), (1, 0), (1, 1)]
+
+
+def test_calgary_tile():
+    # Zoom 10 tile of downtown Calgary, as in the usual slippy map numbering
+    assert tile_at(-114.0719, 51.0447, 10) == (187, 342)
+
+
+# Step 2: Tile contents
+
+def test_road_is_clipped_to_each_tile_with_its_attributes(static_dir):
+    layers = MapLayers(static_dir)
+    layer = layers.layer("road_segments")
+    tiles = tiles_covering(layer.geometries[0].bounds, 14)
+    assert len(tiles) == 5
+    total = 0.0
+    for x, y in tiles:
+        features = decode(layers.tile("road_segments", 14, x, y), "road_segments")
+        assert [feature["properties"] for feature in features] == [
+            {"risk_categ": "High", "risk_score": 0.1235, "name": "Long Rd"}]
+        coordinates = shapely.get_coordinates(shapely.geometry.shape(features[0]["geometry"]))
+        assert coordinates.min() >= -BUFFER and coordinates.max() <= EXTENT + BUFFER
+        minx, _, maxx, _ = tile_bounds(14, x, y)
+        # Only the part in the tile and its buffer, in tile units
+        unit = (maxx - minx) / EXTENT
+        total += (min(coordinates[:, 0].max(), EXTENT) - max(coordinates[:, 0].min(), 0)) * unit
+    # The pieces add up to the whole road
+    assert total == pytest.approx(layer.geometries[0].length, rel=1e-3)
+
+
+def test_short_road_only_shows_when_longer_than_a_pixel(static_dir):
+    layers = MapLayers(static_dir)
+    length = layers.layer("road_segments").geometries[1].length
+    assert pixel_size(10) > length > pixel_size(16)
+    x, y = tile_at(*SHORT_ROAD[0], 10)
+    features = decode(layers.tile("road_segments", 10, x, y), "road_segments")
+    assert [feature["properties"]["name"] for feature in features] == ["Long Rd"]
+    x, y = tile_at(*SHORT_ROAD[0], 16)
+    features = decode(layers.tile("road_segments", 16, x, y), "road_segments")
+    # risk_category stands in for a missing risk_categ
+    assert [feature["properties"] for feature in features] == [
+        {"risk_categ": "Low", "risk_score": 0.01, "name": "Short St"}]
+
+
+def test_accidents_are_thinned_to_one_per_pixel_keeping_hot_spots(static_dir):
+    layers = MapLayers(static_dir)
+    x, y = tile_at(*ACCIDENTS[0][1], 12)
+    features = decode(layers.tile("accidents", 12, x, y), "accidents")
+    assert sorted(feature["properties"]["description"] for feature in features) == ["Collision", "Parked car"]
+    hot_spot = next(feature for feature in features if feature["properties"]["hotspot"] == "Hot Spot")
+    assert hot_spot["properties"] == {"hotspot": "Hot Spot", "z_score": 3.2, "description": "Collision"}
+
+
+def test_empty_tile(static_dir):
+    assert decode(MapLayers(static_dir).tile("road_segments", 10, 0, 0), "road_segments") == []
+
+
+def test_tiles_outside_the_grid_are_refused(static_dir):
+    layers = MapLayers(static_dir, max_zoom=14)
+    assert layers.valid("accidents", 14, 2 ** 14 - 1, 0)
+    for z, x, y in [(15, 0, 0), (2, 4, 0), (2, 0, -1), (-1, 0, 0)]:
+        assert not layers.valid("accidents", z, x, y)
+        with pytest.raises(ValueError):
+            layers.tile("accidents", z, x, y)
+    with pytest.raises(KeyError):
+        layers.tile("bike_lanes", 10, 0, 0)
+    os.remove(os.path.join(static_dir, "accidents.geojson"))
+    with pytest.raises(FileNotFoundError):
+        layers.tile("accidents", 10, 0, 0)
+
+
+# Step 3: The tile cache
+
+def test_tiles_are_cached_per_layer_version(static_dir, tmp_path_factory):
+    cache = str(tmp_path_factory.mktemp("tile_cache"))
+    layers = MapLayers(static_dir, cache_dir=cache)
+    x, y = tile_at(*ACCIDENTS[0][1], 12)
+    data = layers.tile("accidents", 12, x, y)
+    assert layers.tile("accidents", 12, x, y) == data
+    assert layers.counts == {"cache_hits": 1, "generated": 1}
+    (version,) = os.listdir(os.path.join(cache, "accidents"))
+    # Another server process finds the tile on disk
+    assert MapLayers(static_dir, cache_dir=cache).tile("accidents", 12, x, y) == data
+
+    # A new accidents file starts a new cache and removes the old one
+    write_layer(os.path.join(static_dir, "accidents.geojson"), ACCIDENTS[:1], "Point")
+    path = os.path.join(static_dir, "accidents.geojson")
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    features = decode(layers.tile("accidents", 12, x, y), "accidents")
+    assert [feature["properties"]["description"] for feature in features] == ["Rear end"]
+    assert layers.counts["generated"] == 2
+    assert os.listdir(os.path.join(cache, "accidents")) != [version]
+    assert len(os.listdir(os.path.join(cache, "accidents"))) == 1
+
+
+def test_tile_endpoint(server, static_dir, monkeypatch):
+    monkeypatch.setattr(server, "map_layers", MapLayers(static_dir, max_zoom=16))
+    client = server.app.test_client()
+    x, y = tile_at(*ACCIDENTS[0][1], 12)
+    response = client.get(f"/tiles/accidents/12/{x}/{y}.pbf")
+    assert response.status_code == 200
+    assert response.mimetype == "application/vnd.mapbox-vector-tile"
+    assert len(decode(response.get_data(), "accidents")) == 2
+    assert client.get(f"/tiles/accidents/17/{x}/{y}.pbf").status_code == 404
+    assert client.get("/tiles/bike_lanes/12/0/0.pbf").status_code == 404
+
+
+# Step 4: Viewport queries
+
+def query(layers, name, bbox=None, zoom=None):
+    count, chunks = layers.query(name, bbox, zoom)
+    collection = json.loads("".join(chunks))
+    assert len(collection["features"]) == count
+    return collection["features"]
+
+
+def test_bbox_query_returns_the_features_in_view_unchanged(static_dir):
+    layers = MapLayers(static_dir)
+    features = query(layers, "accidents", (-114.0502, 51.0498, -114.0498, 51.0502))
+    # Without a zoom nothing is thinned, and every property is kept
+    # Hot spots come first, as in the tiles
+    assert [feature["properties"] for feature in features] == [ACCIDENTS[2][0], ACCIDENTS[0][0], ACCIDENTS[1][0]]
+    assert features[0]["geometry"] == {"type": "Point", "coordinates": ACCIDENTS[2][1]}
+    assert query(layers, "accidents", (-113.9, 51.1, -113.8, 51.2)) == []
+    # No bbox is the whole layer
+    assert len(query(layers, "accidents")) == len(ACCIDENTS)
+
+
+def test_zoom_simplifies_and_thins_without_clipping(static_dir):
+    layers = MapLayers(static_dir)
+    # A view of the middle of the long road only
+    view = (-114.06, 51.03, -114.04, 51.05)
+    (road,) = query(layers, "road_segments", view, zoom=16)
+    assert road["properties"] == ROADS[0][0]
+    # The whole road, not cut at the view
+    assert sum(road["geometry"]["coordinates"], []) == pytest.approx(sum(LONG_ROAD, []))
+    assert [feature["properties"]["name"] for feature in query(layers, "road_segments", zoom=10)] == ["Long Rd"]
+    assert [feature["properties"]["name"] for feature in query(layers, "road_segments", zoom=16)] == [
+        "Long Rd", "Short St"]
+    # The three close accidents are one pixel; the fourth is out of view
+    assert [feature["properties"]["description"] for feature in query(layers, "accidents", view, zoom=12)] == [
+        "Collision"]
+
+
+def test_query_is_streamed_in_chunks(static_dir, monkeypatch):
+    monkeypatch.setattr("map_layers.CHUNK_FEATURES", 3)
+    count, chunks = MapLayers(static_dir).query("accidents")
+    chunks = list(chunks)
+    assert count == 4 and len(chunks) == 4
+    assert len(json.loads("".join(chunks))["features"]) == 4
+
+
+@pytest.mark.parametrize("args, expected", [
+    ({}, (None, None)),
+    ({"bbox": "-114.1,51.0,-114.0,51.1"}, ([-114.1, 51.0, -114.0, 51.1], None)),
+    ({"zoom": "13.5"}, (None, 13.5)),
+    ({"zoom": "40"}, (None, 22.0)),
+    ({"zoom": "-3"}, (None, 0.0)),
+])
+def test_viewport_parameters(server, args, expected):
+    assert server.parse_viewport(args) == expected
+
+
+@pytest.mark.parametrize("args", [
+    {"bbox": "-114.1,51.0,-114.0"},
+    {"bbox": "-114.0,51.0,-114.1,51.1"},
+    {"bbox": "-114.1,51.1,-114.0,51.0"},
+    {"bbox": "nan,51.0,-114.0,51.1"},
+    {"bbox": "-inf,-inf,inf,inf"},
+    {"bbox": "a,b,c,d"},
+    {"zoom": "nan"},
+    {"zoom": "inf"},
+])
+def test_invalid_viewport_parameters(server, args):
+    with pytest.raises(ValueError):
+        server.parse_viewport(args)
+
+
+def test_viewport_endpoint(server, static_dir, monkeypatch):
+    monkeypatch.setattr(server, "map_layers", MapLayers(static_dir))
+    client = server.app.test_client()
+    response = client.get("/accidents?bbox=-114.06,51.04,-114.03,51.06&zoom=12")
+    assert response.status_code == 200
+    assert response.headers["X-Feature-Count"] == "2"
+    assert len(response.get_json()["features"]) == 2
+    assert client.get("/road_segments?bbox=-114.06,51.04,-114.03,nan").status_code == 400
+    assert client.get("/road_segments?zoom=inf").status_code == 400
+    os.remove(os.path.join(static_dir, "road_segments.geojson"))
+    assert client.get("/road_segments?zoom=12").status_code == 404
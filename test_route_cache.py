@@ -0,0 +1,97 @@
+"""
+RouteCache eviction and expiry, and the /find_path cache key: the snapped nodes, the risk
+time bucket, the weights and the graph generation (server.py, on the synthetic graph
+artifact of conftest.py).
+
+    python -m pytest test_route_cache.py
+"""
+from conftest import node_latlon
+from route_cache import RouteCache
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+# Step 1: RouteCache
+
+def test_least_recently_used_entry_is_evicted_first():
+    cache = RouteCache(max_bytes=10, ttl=None)
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"
+    cache.put("c", b"cccc")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"aaaa" and cache.get("c") == b"cccc"
+    assert cache.stats()["evictions"] == 1 and cache.bytes == 8
+
+
+def test_replacing_and_oversized_values_keep_the_size_accurate():
+    cache = RouteCache(max_bytes=10, ttl=None)
+    cache.put("a", b"aaaa")
+    cache.put("a", b"aaaaaa")
+    assert cache.bytes == 6 and cache.stats()["entries"] == 1
+    cache.put("big", b"x" * 11)
+    assert cache.get("big") is None and cache.get("a") == b"aaaaaa"
+    cache.clear()
+    assert cache.bytes == 0 and cache.get("a") is None
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = RouteCache(max_bytes=100, ttl=60, clock=clock)
+    cache.put("a", b"route")
+    clock.now = 59.9
+    assert cache.get("a") == b"route"
+    clock.now = 60.0
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert stats["expirations"] == 1 and stats["entries"] == 0 and stats["hits"] == 1 and stats["misses"] == 1
+
+
+def test_disabled_cache_stores_nothing():
+    cache = RouteCache(max_bytes=0)
+    cache.put("a", b"route")
+    assert cache.get("a") is None
+
+
+# Step 2: The /find_path cache key
+
+def find_path(client, start, end, time, **extra):
+    return client.post("/find_path", json=dict({"start": start, "end": end, "time": time}, **extra))
+
+
+def test_find_path_is_cached_per_snapped_nodes_and_time_bucket(server, synthetic_G):
+    server.route_cache.clear()
+    client = server.app.test_client()
+    start, end = node_latlon(synthetic_G, 16), node_latlon(synthetic_G, 200)
+    rush_hour, later_rush_hour, night = "2025-03-26T17:00", "2025-03-26T17:40", "2025-07-12T02:00"
+
+    first = find_path(client, start, end, rush_hour)
+    assert first.status_code == 200 and first.headers["X-Route-Cache"] == "miss"
+    # A few metres away snaps to the same nodes, and 17:40 is in the same bucket
+    again = find_path(client, node_latlon(synthetic_G, 16, dx=3, dy=-2), end, later_rush_hour)
+    assert again.headers["X-Route-Cache"] == "hit"
+    assert again.get_data() == first.get_data()
+    assert find_path(client, start, end, night).headers["X-Route-Cache"] == "miss"
+    assert find_path(client, end, start, rush_hour).headers["X-Route-Cache"] == "miss"
+    # Edge-snapped routes depend on the exact points and are not cached
+    assert "X-Route-Cache" not in find_path(client, start, end, rush_hour, snap="edge").headers
+
+
+def test_routes_are_not_served_after_a_graph_reload(server, synthetic_G):
+    server.route_cache.clear()
+    client = server.app.test_client()
+    start, end = node_latlon(synthetic_G, 30), node_latlon(synthetic_G, 150)
+    assert find_path(client, start, end, "2025-03-26T17:00").headers["X-Route-Cache"] == "miss"
+    assert find_path(client, start, end, "2025-03-26T17:00").headers["X-Route-Cache"] == "hit"
+    generation = server.graph_store.snapshot.generation
+    assert server.graph_store.reload(force=True)
+    assert server.graph_store.snapshot.generation == generation + 1
+    assert find_path(client, start, end, "2025-03-26T17:00").headers["X-Route-Cache"] == "miss"
+    assert find_path(client, start, end, "2025-03-26T17:00").headers["X-Route-Cache"] == "hit"
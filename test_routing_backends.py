@@ -0,0 +1,149 @@
+"""
+The routing backends must agree on a synthetic grid graph (benchmarks.synthetic_graph):
+CSR A* returns find_path.astar_path's paths, and contraction hierarchies, ALT landmarks
+and the cost matrices return exact least-cost routes, checked against Dijkstra.
+
+    python -m pytest test_routing_backends.py
+"""
+from datetime import datetime
+
+import networkx as nx
+import numpy as np
+import pytest
+
+import csr_graph
+from benchmarks import random_node_pairs, synthetic_graph
+from contraction_hierarchy import CHQuery, build_hierarchy
+from cost_matrix import cost_matrices, edge_values
+from csr_graph import CSRGraph
+from find_path import astar_path
+from landmarks import Landmarks
+from risk_profiles import RiskProfiles
+
+ALPHA, BETA = 0.1, 0.9
+# A weekday rush hour and a night, which fall in different risk time buckets
+TIMES = [datetime(2025, 3, 26, 17, 0), datetime(2025, 7, 12, 2, 0)]
+
+
+@pytest.fixture(scope="module")
+def G():
+    return synthetic_graph(rows=15, cols=15)
+
+
+@pytest.fixture(scope="module")
+def graph(G):
+    return CSRGraph.from_networkx(G)
+
+
+@pytest.fixture(scope="module")
+def pairs(G, graph):
+    """Random (start, end) pairs as node positions."""
+    return [(graph.index_of(a), graph.index_of(b)) for a, b in random_node_pairs(G, 40)]
+
+
+def path_cost(graph, path, cost):
+    return float(np.asarray(cost)[graph.edge_ids(path)].sum())
+
+
+# Step 1: CSR A* against the networkx search
+
+@pytest.mark.parametrize("current_time", TIMES)
+def test_csr_astar_matches_networkx(G, graph, current_time):
+    profiles = RiskProfiles(graph, alpha=ALPHA, beta=BETA)
+    for a, b in random_node_pairs(G, 40):
+        expected = astar_path(G, a, b, current_time, alpha=ALPHA, beta=BETA)
+        assert csr_graph.astar_path(graph, a, b, current_time, alpha=ALPHA, beta=BETA) == expected
+        assert csr_graph.astar_path(graph, a, b, current_time, cost=profiles.costs(current_time)) == expected
+
+
+# Step 2: Exact backends against Dijkstra
+
+@pytest.mark.parametrize("current_time", TIMES)
+def test_contraction_hierarchy_paths_are_shortest(graph, pairs, current_time):
+    cost = RiskProfiles(graph, alpha=ALPHA, beta=BETA).costs(current_time)
+    engine = CHQuery(build_hierarchy(graph, cost))
+    for a, b in pairs:
+        expected = path_cost(graph, csr_graph.dijkstra(graph, a, b, cost), cost)
+        ch_cost, path = engine.shortest_path(a, b)
+        assert path[0] == a and path[-1] == b
+        assert ch_cost == pytest.approx(expected)
+        assert path_cost(graph, path, cost) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("current_time", TIMES)
+def test_landmark_search_is_exact(G, graph, pairs, current_time):
+    landmarks = Landmarks.build(graph, ALPHA, BETA, count=8)
+    cost = RiskProfiles(graph, alpha=ALPHA, beta=BETA).costs(current_time)
+    for a, b in pairs:
+        expected = path_cost(graph, csr_graph.dijkstra(graph, a, b, cost), cost)
+        path = csr_graph.astar(graph, a, b, cost, heuristic=landmarks.search_heuristic(a, b))
+        assert path_cost(graph, path, cost) == pytest.approx(expected)
+        # The networkx search with the same landmarks
+        node_path = astar_path(G, graph.node_ids[a].item(), graph.node_ids[b].item(), current_time,
+                               alpha=ALPHA, beta=BETA, landmarks=landmarks)
+        assert path_cost(graph, [graph.index_of(n) for n in node_path], cost) == pytest.approx(expected)
+
+
+# Step 3: Cost matrices against one Dijkstra per pair
+
+@pytest.mark.parametrize("current_time", TIMES)
+def test_cost_matrices_match_dijkstra(graph, pairs, current_time):
+    cost, length, risk = edge_values(graph, current_time, ALPHA, BETA)
+    origins = [a for a, _ in pairs[:6]] + [pairs[0][0]]
+    destinations = [b for _, b in pairs[:8]] + [origins[0]]
+    matrices = cost_matrices(graph, origins, destinations, current_time, ALPHA, BETA)
+    assert matrices.cost.shape == (len(origins), len(destinations))
+    for i, a in enumerate(origins):
+        for j, b in enumerate(destinations):
+            path = csr_graph.dijkstra(graph, a, b, cost)
+            edges = graph.edge_ids(path)
+            assert matrices.cost[i, j] == pytest.approx(cost[edges].sum())
+            assert matrices.length[i, j] == pytest.approx(length[edges].sum())
+            assert matrices.risk[i, j] == pytest.approx(risk[edges].sum())
+
+
+def test_cost_matrices_unreachable_is_inf():
+    G = synthetic_graph(rows=4, cols=4)
+    G.add_node(-7, pos=(699000.0, 5649000.0))
+    graph = CSRGraph.from_networkx(G)
+    isolated = graph.index_of(-7)
+    matrices = cost_matrices(graph, [0, isolated], [isolated, 5], TIMES[0], ALPHA, BETA)
+    assert np.isinf(matrices.cost[0, 0]) and np.isinf(matrices.length[0, 0]) and np.isinf(matrices.risk[0, 0])
+    assert np.isinf(matrices.cost[1, 1])
+    assert matrices.cost[1, 0] == 0.0
+    assert np.isfinite(matrices.cost[0, 1])
+
+
+def test_missing_risk_categories_share_one_code():
+    G = synthetic_graph(rows=3, cols=3)
+    edges = list(G.edges(data=True))
+    edges[0][2]['risk_category'] = float('nan')
+    edges[1][2]['risk_category'] = np.float64('nan')
+    del edges[2][2]['risk_category']
+    graph = CSRGraph.from_networkx(G)
+    assert graph.categories.count(None) == 1
+    codes = graph.category_codes[[graph.edge_ids([graph.index_of(u), graph.index_of(v)])[0] for u, v, _ in edges[:3]]]
+    assert (codes == graph.categories.index(None)).all()
+
+
+def test_too_many_risk_categories_is_an_error():
+    G = synthetic_graph(rows=10, cols=10)
+    for n, (u, v, d) in enumerate(G.edges(data=True)):
+        d['risk_category'] = f"category {n}"
+    with pytest.raises(ValueError):
+        CSRGraph.from_networkx(G)
+
+
+@pytest.mark.parametrize("relabel", [False, True])
+def test_index_of_finds_every_node(relabel):
+    G = synthetic_graph(rows=4, cols=4)
+    if relabel:
+        # Ids that are not increasing in graph order fall back to a dict
+        G = nx.relabel_nodes(G, {n: f"n{n}" for n in G.nodes})
+    graph = CSRGraph(*(getattr(CSRGraph.from_networkx(G), name) for name in
+                       ('node_ids', 'x', 'y', 'offsets', 'targets', 'length', 'risk_score', 'category_codes', 'categories')))
+    for i, n in enumerate(G.nodes):
+        assert graph.index_of(n) == i
+    for missing in (-1, 16, "n99", 2.5, None):
+        with pytest.raises(KeyError):
+            graph.index_of(missing)
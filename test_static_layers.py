@@ -0,0 +1,110 @@
+"""
+Content negotiation, ETags and conditional GETs of precompressed static layers
+(static_layers.py), on a small GeoJSON file written to a temporary directory.
+
+    python -m pytest test_static_layers.py
+"""
+import gzip
+import json
+import os
+
+import brotli
+import pytest
+
+from static_layers import StaticLayers, accepted_encodings, etag_matches, precompress
+
+
+@pytest.fixture
+def layer(tmp_path):
+    path = str(tmp_path / "road_segments.geojson")
+    features = [{"type": "Feature", "properties": {"risk_categ": "High", "name": f"Road {i}"},
+                 "geometry": {"type": "LineString", "coordinates": [[-114.07, 51.04], [-114.06, 51.05 + i / 1e4]]}}
+                for i in range(200)]
+    with open(path, "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f)
+    precompress(path)
+    return path
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_accept_encoding_parsing():
+    assert accepted_encodings("gzip, deflate, br") == {"gzip": 1.0, "deflate": 1.0, "br": 1.0}
+    assert accepted_encodings("br;q=0.5, GZIP;q=0.8, identity") == {"br": 0.5, "gzip": 0.8, "identity": 1.0}
+    assert accepted_encodings("gzip;q=0, br") == {"gzip": 0.0, "br": 1.0}
+    assert accepted_encodings("br;q=oops") == {"br": 0.0}
+    assert accepted_encodings(None) == {}
+
+
+def test_siblings_decompress_to_the_layer(layer):
+    data = read(layer)
+    assert gzip.decompress(read(layer + ".gz")) == data
+    assert brotli.decompress(read(layer + ".br")) == data
+
+
+@pytest.mark.parametrize("accept_encoding, coding", [
+    ("gzip, deflate, br", "br"),
+    ("gzip", "gzip"),
+    ("br;q=0.5, gzip", "gzip"),
+    ("*", "br"),
+    ("*, br;q=0", "gzip"),
+    ("deflate", None),
+    (None, None),
+])
+def test_smallest_accepted_encoding_is_sent(layer, accept_encoding, coding):
+    status, path, headers = StaticLayers().negotiate(layer, accept_encoding)
+    assert status == 200
+    assert headers.get("Content-Encoding") == coding
+    assert path == (layer if coding is None else layer + {"br": ".br", "gzip": ".gz"}[coding])
+    assert headers["Vary"] == "Accept-Encoding"
+
+
+def test_each_encoding_has_its_own_etag(layer):
+    layers = StaticLayers()
+    etags = {layers.negotiate(layer, accept)[2]["ETag"] for accept in ("br", "gzip", None)}
+    assert len(etags) == 3
+    # The same content keeps its ETags
+    assert {StaticLayers().negotiate(layer, accept)[2]["ETag"] for accept in ("br", "gzip", None)} == etags
+
+
+def test_if_none_match_answers_304_for_the_selected_encoding_only(layer):
+    layers = StaticLayers()
+    br_etag = layers.negotiate(layer, "br")[2]["ETag"]
+    gzip_etag = layers.negotiate(layer, "gzip")[2]["ETag"]
+    status, path, headers = layers.negotiate(layer, "gzip, br", br_etag)
+    assert status == 304 and path is None and headers["ETag"] == br_etag
+    assert layers.negotiate(layer, "gzip, br", f'"other", W/{br_etag}')[0] == 304
+    assert layers.negotiate(layer, "gzip, br", "*")[0] == 304
+    # A gzip ETag does not validate the br copy the client would now get
+    assert layers.negotiate(layer, "gzip, br", gzip_etag)[0] == 200
+    assert layers.negotiate(layer, "gzip", gzip_etag)[0] == 304
+
+
+def test_changed_layer_gets_new_etags_and_stale_siblings_are_not_served(layer):
+    layers = StaticLayers()
+    old_etag = layers.negotiate(layer, None)[2]["ETag"]
+    with open(layer, "a") as f:
+        f.write("\n")
+    stat = os.stat(layer)
+    os.utime(layer, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    status, path, headers = layers.negotiate(layer, "gzip, br", old_etag)
+    assert status == 200 and path == layer and "Content-Encoding" not in headers
+    assert headers["ETag"] != old_etag
+    # Precompressing again is picked up without the layer changing
+    precompress(layer)
+    assert layers.negotiate(layer, "gzip, br")[2]["Content-Encoding"] == "br"
+
+
+def test_etag_matching():
+    assert etag_matches('"a", "b"', {'"b"'})
+    assert etag_matches('W/"a"', {'"a"'})
+    assert not etag_matches('"a"', {'"b"'})
+    assert not etag_matches(None, {'"a"'})
+
+
+def test_missing_layer_raises(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        StaticLayers().negotiate(str(tmp_path / "accidents.geojson"), "gzip")